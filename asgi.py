@@ -0,0 +1,21 @@
+"""
+Asynchronous Server Gateway Interface (ASGI) entry point
+
+Serve with an ASGI server, for example: uvicorn asgi:app --port 8080
+
+a2wsgi's WSGIMiddleware runs the Flask app on a bounded thread pool while
+the event loop holds the connections. Each request runs start to finish on
+one pool thread, so the thread-local request state behaves as under gunicorn.
+The pool defaults to the size of the database connection pool.
+"""
+from a2wsgi import WSGIMiddleware
+
+from service import create_app
+
+flask_app = create_app()
+
+app = WSGIMiddleware(
+    flask_app,
+    workers=flask_app.config["ASGI_THREADS"]
+    or flask_app.config["DB_POOL_SIZE"] + flask_app.config["DB_MAX_OVERFLOW"],
+)
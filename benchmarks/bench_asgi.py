@@ -0,0 +1,154 @@
+"""
+ASGI Benchmark
+
+Compares throughput at high concurrency of the two ways to serve the app.
+"sync" stands for gunicorn sync workers: --workers requests are served at
+a time and the other clients wait in the listen queue. "asgi" is asgi:app,
+where the event loop takes every connection and --threads requests run at
+once. Both run in process, so no server or network cost is measured.
+
+A local SQLite database answers in microseconds, which hides the cost of
+blocking on the database. --db-latency-ms adds a sleep before every
+statement to stand in for the round trip to a PostgreSQL server.
+
+Usage:
+    python -m benchmarks.bench_asgi [--clients 200] [--workers 4] [--threads 15] [--db-latency-ms 2]
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from benchmarks.common import bench_app, print_table, seed_promotions
+
+
+def paths(ids: list, count: int) -> list:
+    """Returns count request paths alternating between a list page and one promotion"""
+    return [f"/promotions/{ids[number % len(ids)]}" if number % 2 else "/promotions?limit=20" for number in range(count)]
+
+
+def sync_client(app, slots, requests: list, samples: list):
+    """Sends requests one at a time, each waiting for a free worker first"""
+    client = app.test_client()
+    for path in requests:
+        start = time.perf_counter()
+        with slots:
+            resp = client.get(path)
+        samples.append((time.perf_counter() - start) * 1000)
+        if resp.status_code != 200:
+            raise RuntimeError(f"GET {path} returned {resp.status_code}")
+
+
+def run_sync(app, clients: int, workers: int, requests: list) -> tuple:
+    """Runs the clients against workers sync workers and returns the samples and elapsed time"""
+    slots = threading.BoundedSemaphore(workers)
+    samples = []
+    threads = [threading.Thread(target=sync_client, args=(app, slots, requests, samples)) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - start
+
+
+async def asgi_client(adapter, requests: list, samples: list):
+    """Sends requests one at a time through the ASGI adapter"""
+    for path in requests:
+        route, _, query = path.partition("?")
+        scope = {
+            "type": "http",
+            "http_version": "1.1",
+            "method": "GET",
+            "path": route,
+            "query_string": query.encode(),
+            "headers": [],
+        }
+        codes = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                codes.append(message["status"])  # pylint: disable=cell-var-from-loop
+
+        start = time.perf_counter()
+        await adapter(scope, receive, send)
+        samples.append((time.perf_counter() - start) * 1000)
+        if codes != [200]:
+            raise RuntimeError(f"GET {path} returned {codes}")
+
+
+def run_asgi(app, clients: int, threads: int, requests: list) -> tuple:
+    """Runs the clients against the ASGI adapter and returns the samples and elapsed time"""
+    # pylint: disable=import-outside-toplevel
+    from a2wsgi import WSGIMiddleware
+
+    adapter = WSGIMiddleware(app, workers=threads)
+    samples = []
+
+    async def run_all():
+        await asyncio.gather(*(asgi_client(adapter, requests, samples) for _ in range(clients)))
+
+    start = time.perf_counter()
+    asyncio.run(run_all())
+    elapsed = time.perf_counter() - start
+    adapter.executor.shutdown()
+    return samples, elapsed
+
+
+def prepare(app, rows: int, latency: float) -> list:
+    """Seeds the promotions, slows every statement down by latency seconds and returns ids to read"""
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy import event
+    from service.models import Promotion, db
+
+    with app.app_context():
+        db.session.query(Promotion).delete()
+        db.session.commit()
+        seed_promotions(rows)
+        ids = [row.id for row in db.session.query(Promotion.id).limit(100)]
+        db.session.remove()
+        if latency:
+            event.listen(db.engine, "before_cursor_execute", lambda *_args: time.sleep(latency))
+    return ids
+
+
+def main():
+    """Reports throughput and latency of sync workers and the ASGI adapter"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=200, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=20, help="requests per client")
+    parser.add_argument("--workers", type=int, default=4, help="sync workers")
+    parser.add_argument("--threads", type=int, default=15, help="ASGI threads, DB_POOL_SIZE + DB_MAX_OVERFLOW by default")
+    parser.add_argument("--db-latency-ms", type=float, default=2.0, help="added to every SQL statement")
+    parser.add_argument("--rows", type=int, default=1000, help="promotions to seed")
+    args = parser.parse_args()
+
+    app = bench_app()
+    ids = prepare(app, args.rows, args.db_latency_ms / 1000)
+    # pylint: disable-next=import-outside-toplevel
+    from service.common.load_test import summarize
+
+    requests = paths(ids, args.requests)
+    rows = []
+    for mode, run, concurrency in (("sync", run_sync, args.workers), ("asgi", run_asgi, args.threads)):
+        samples, elapsed = run(app, args.clients, concurrency, requests)
+        result = summarize(samples, elapsed)
+        rows.append(
+            {
+                "mode": mode,
+                "clients": args.clients,
+                "at_once": concurrency,
+                "rps": result["rps"],
+                "p50_ms": result["p50_ms"],
+                "p99_ms": result["p99_ms"],
+                "max_ms": result["max_ms"],
+            }
+        )
+    print_table(f"GET /promotions and /promotions/<id> with {args.db_latency_ms} ms per SQL statement", rows)
+
+
+if __name__ == "__main__":
+    main()
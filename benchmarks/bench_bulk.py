@@ -0,0 +1,57 @@
+"""
+Bulk Create Benchmark
+
+Times loading a campaign through POST /promotions/bulk against one
+POST /promotions per promotion.
+
+Usage:
+    python -m benchmarks.bench_bulk [--count 10000] [--single 500]
+"""
+import argparse
+import time
+
+from benchmarks.common import bench_app, print_table
+
+
+def main():
+    """Loads the same kind of campaign both ways and reports promotions per second"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=10000, help="promotions in the bulk request")
+    parser.add_argument("--single", type=int, default=500, help="promotions created one POST at a time")
+    args = parser.parse_args()
+
+    app = bench_app()
+    # pylint: disable=import-outside-toplevel
+    from service.models import Promotion, db
+    from tests.factories import PromotionFactory
+
+    batch = [promotion.serialize() for promotion in PromotionFactory.build_batch(args.count)]
+    for number, item in enumerate(batch):
+        item["promotion_id"] = f"BULK{number:09d}"
+
+    results = []
+    with app.app_context():
+        client = app.test_client()
+
+        start = time.perf_counter()
+        for item in batch[: args.single]:
+            assert client.post("/promotions", json=item).status_code == 201
+        elapsed = time.perf_counter() - start
+        results.append({"endpoint": "POST /promotions", "promotions": args.single, "seconds": round(elapsed, 3),
+                        "per_second": round(args.single / elapsed)})
+
+        db.session.query(Promotion).delete()
+        db.session.commit()
+
+        start = time.perf_counter()
+        response = client.post("/promotions/bulk", json=batch)
+        elapsed = time.perf_counter() - start
+        assert response.status_code == 201, response.get_json()
+        results.append({"endpoint": "POST /promotions/bulk", "promotions": args.count, "seconds": round(elapsed, 3),
+                        "per_second": round(args.count / elapsed)})
+
+    print_table("Loading a campaign", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Cart Evaluation Benchmark
+
+Evaluates a cart of --lines lines against --rows active promotions, every
+one of them running, so each promotion gets a discount. It reports:
+
+    snapshot    loading the active promotions and building the columns
+    numpy       subtotal and discounts with NumPy arrays
+    python      the same arithmetic over lists
+    endpoint    POST /promotions/evaluate with the top 10 and with every discount
+
+The numpy row is skipped when NumPy is not installed.
+
+Usage:
+    python -m benchmarks.bench_evaluate [--rows 50000] [--lines 200]
+"""
+import argparse
+import os
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from benchmarks.common import DEFAULT_DATABASE_URI, bench_app, measure, print_table, seed_promotions
+
+AT = datetime(2025, 4, 1, 12)
+
+
+def cart(lines: int) -> dict:
+    """Returns a cart of random lines at AT"""
+    rng = random.Random(2820)
+    items = [{"sku": f"SKU-{line}", "price": round(rng.uniform(1, 200), 2), "quantity": rng.randint(1, 4)}
+             for line in range(lines)]
+    return {"items": items, "at": AT.isoformat()}
+
+
+def evaluate(snapshot, body: dict):
+    """Returns a function that evaluates a cart against a snapshot"""
+    # pylint: disable=import-outside-toplevel
+    from service.common.evaluator import subtotal_cents
+
+    prices = [item["price"] for item in body["items"]]
+    quantities = [item["quantity"] for item in body["items"]]
+    return lambda: snapshot.discounts(subtotal_cents(prices, quantities, snapshot.vectorized), AT)
+
+
+def post(client, body: dict, limit):
+    """Returns a function that posts a cart to the endpoint"""
+    return lambda: client.post("/promotions/evaluate", json={**body, "limit": limit})
+
+
+def main():
+    """Reports the cost of evaluating a cart"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000, help="active promotions")
+    parser.add_argument("--lines", type=int, default=200, help="lines in the cart")
+    parser.add_argument("--repeat", type=int, default=50, help="evaluations to time")
+    args = parser.parse_args()
+
+    app = bench_app(os.getenv("BENCH_DATABASE_URI", DEFAULT_DATABASE_URI))
+    # pylint: disable=import-outside-toplevel
+    from service.common.evaluator import Snapshot, cart_evaluator, numpy
+    from service.models import Promotion, db
+
+    body = cart(args.lines)
+    rows = []
+    with app.app_context():
+        db.session.query(Promotion).delete()
+        db.session.commit()
+        seed_promotions(args.rows)
+        db.session.execute(
+            update(Promotion).values(state="active", start_date=AT - timedelta(days=1), end_date=AT + timedelta(days=1))
+        )
+        db.session.commit()
+
+        terms = Promotion.active_terms()
+        rows.append({"step": "snapshot", **measure(lambda: Snapshot(Promotion.active_terms()), repeat=5, warmup=1)})
+        for name, vectorized in (("numpy", True), ("python", False)):
+            if vectorized and numpy is None:
+                continue
+            rows.append({"step": name, **measure(evaluate(Snapshot(terms, vectorized), body), repeat=args.repeat)})
+
+        client = app.test_client()
+        cart_evaluator.init_app(app)
+        for name, limit in (("endpoint top 10", 10), ("endpoint all", None)):
+            rows.append({"step": name, **measure(post(client, body, limit), repeat=args.repeat)})
+        db.session.remove()
+    print_table(f"Evaluating {args.lines} lines against {args.rows} running promotions", rows)
+
+
+if __name__ == "__main__":
+    main()
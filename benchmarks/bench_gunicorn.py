@@ -0,0 +1,139 @@
+"""
+Gunicorn Benchmark
+
+Starts gunicorn with the production profile in gunicorn.conf.py and with
+bare defaults (sync workers, no preload, no hooks), each with --workers
+workers. Each run drives the same read-heavy load at the server and then
+reports requests per second. It also reports the memory of one worker,
+both right after the workers start and after the load:
+
+    rss_mb    resident set, counting the pages shared with the master in full
+    pss_mb    proportional set, shared pages split between the processes
+    uss_mb    pages only this worker uses, what another worker would add
+
+Needs gunicorn and Linux /proc.
+
+Usage:
+    python -m benchmarks.bench_gunicorn [--workers 4] [--duration 10] [--concurrency 16]
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from urllib import error, request as urlrequest
+
+from benchmarks.common import DEFAULT_DATABASE_URI, bench_app, print_table, seed_promotions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILES = {
+    "defaults": ["--config", os.devnull],
+    "gunicorn.conf.py": ["--config", os.path.join(ROOT, "gunicorn.conf.py")],
+}
+
+
+def memory_mb(pid: int) -> dict:
+    """Returns the RSS, PSS and USS of a process in MiB from /proc/<pid>/smaps_rollup"""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup", encoding="utf-8") as file:
+        for line in file:
+            name, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                fields[name] = int(value.split()[0])
+    uss = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    return {"rss_mb": fields["Rss"] / 1024, "pss_mb": fields["Pss"] / 1024, "uss_mb": uss / 1024}
+
+
+def worker_pids(master: int) -> list:
+    """Returns the pids of the children of the gunicorn master"""
+    with open(f"/proc/{master}/task/{master}/children", encoding="utf-8") as file:
+        return [int(pid) for pid in file.read().split()]
+
+
+def worker_memory(master: int) -> dict:
+    """Returns the mean memory of the workers of a master"""
+    samples = [memory_mb(pid) for pid in worker_pids(master)]
+    return {name: round(sum(sample[name] for sample in samples) / len(samples), 1) for name in samples[0]}
+
+
+def wait_ready(url: str, master, workers: int, timeout: float = 60.0):
+    """Waits until the service answers and every worker is up"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if master.poll() is not None:
+            sys.exit(f"gunicorn exited with {master.returncode}")
+        try:
+            with urlrequest.urlopen(f"{url}/health", timeout=1):
+                if len(worker_pids(master.pid)) == workers:
+                    time.sleep(1)  # let the last worker finish booting
+                    return
+        except (error.URLError, OSError):
+            pass
+        time.sleep(0.2)
+    sys.exit("gunicorn did not start in time")
+
+
+def run_profile(name: str, args, database_uri: str) -> dict:
+    """Serves the app with one gunicorn profile and measures it"""
+    # pylint: disable=import-outside-toplevel
+    from service.common.load_test import HttpTransport, LoadTest, parse_mix
+
+    url = f"http://127.0.0.1:{args.port}"
+    env = dict(
+        os.environ,
+        DATABASE_URI=database_uri,
+        WEB_CONCURRENCY=str(args.workers),
+        GUNICORN_BIND=f"127.0.0.1:{args.port}",
+        GUNICORN_LOG_LEVEL="warning",
+    )
+    command = [sys.executable, "-m", "gunicorn", *PROFILES[name], "--bind", env["GUNICORN_BIND"], "wsgi:app"]
+    with subprocess.Popen(command, cwd=ROOT, env=env) as master:
+        try:
+            wait_ready(url, master, args.workers)
+            started = worker_memory(master.pid)
+            load = LoadTest(HttpTransport(url), parse_mix("list=50,get=50"), args.concurrency, seed=2820)
+            report = load.run(duration=args.duration)
+            loaded = worker_memory(master.pid)
+        finally:
+            master.send_signal(signal.SIGTERM)
+    return {
+        "profile": name,
+        "workers": args.workers,
+        "rss_mb": f"{started['rss_mb']} / {loaded['rss_mb']}",
+        "pss_mb": f"{started['pss_mb']} / {loaded['pss_mb']}",
+        "uss_mb": f"{started['uss_mb']} / {loaded['uss_mb']}",
+        "rps": report["total"]["rps"],
+        "p50_ms": report["total"]["p50_ms"],
+        "p99_ms": report["total"]["p99_ms"],
+        "failed": report["total"]["failed"],
+    }
+
+
+def main():
+    """Compares worker memory and throughput of the gunicorn profiles"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="workers of each profile")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--rows", type=int, default=10000, help="promotions to seed")
+    parser.add_argument("--port", type=int, default=8099, help="port to serve on")
+    args = parser.parse_args()
+
+    database_uri = os.getenv("BENCH_DATABASE_URI", DEFAULT_DATABASE_URI)
+    app = bench_app(database_uri)
+    # pylint: disable-next=import-outside-toplevel
+    from service.models import Promotion, db
+
+    with app.app_context():
+        db.session.query(Promotion).delete()
+        db.session.commit()
+        seed_promotions(args.rows)
+        db.session.remove()
+
+    rows = [run_profile(name, args, database_uri) for name in PROFILES]
+    print_table("Memory per worker after start / after load, and throughput", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+JSON Benchmark
+
+Compares encoding and decoding promotion lists with Flask's default JSON
+provider, fed isoformat() strings like Promotion.serialize used to
+return, against PromotionJSONProvider fed raw values.
+
+Usage:
+    python -m benchmarks.bench_json [--sizes 1 100 10000] [--repeat 20]
+"""
+import argparse
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from benchmarks.common import measure, print_table
+
+
+def legacy_serialize(promotion) -> dict:
+    """Serializes a Promotion the way Promotion.serialize did before it returned raw values"""
+    data = promotion.serialize()
+    data["start_date"] = promotion.start_date.isoformat()
+    data["end_date"] = promotion.end_date.isoformat()
+    data["promotion_type"] = promotion.promotion_type.value
+    return data
+
+
+def bench_provider(provider, serialize, promotions, repeat) -> dict:
+    """Returns the encode and decode throughput of a provider for a list of promotions"""
+
+    def encode():
+        return provider.dumps([serialize(promotion) for promotion in promotions])
+
+    document = encode()
+    encoded = measure(encode, repeat)
+    decoded = measure(lambda: provider.loads(document), repeat)
+    return {
+        "encode_ms": encoded["median_ms"],
+        "encode_per_s": round(len(promotions) / encoded["median_ms"] * 1000),
+        "decode_ms": decoded["median_ms"],
+        "decode_per_s": round(len(promotions) / decoded["median_ms"] * 1000),
+    }
+
+
+def promotion_pool(count: int) -> list:
+    """Builds count factory promotions with ids, as if they were read from the database"""
+    # pylint: disable=import-outside-toplevel
+    from tests.factories import PromotionFactory
+
+    pool = PromotionFactory.build_batch(count)
+    for number, promotion in enumerate(pool):
+        promotion.id = number + 1
+    return pool
+
+
+def main():
+    """Encodes and decodes lists of promotions with both providers and reports their throughput"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 10000], help="promotions per document")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per measurement")
+    args = parser.parse_args()
+
+    # pylint: disable=import-outside-toplevel
+    from service.common.json_provider import PromotionJSONProvider, orjson
+    from service.models import Promotion
+
+    app = Flask(__name__)
+    contenders = [
+        ("flask default", DefaultJSONProvider(app), legacy_serialize),
+        ("promotion provider", PromotionJSONProvider(app), Promotion.serialize),
+    ]
+    pool = promotion_pool(min(max(args.sizes), 1000))
+
+    rows = []
+    for size in args.sizes:
+        promotions = [pool[number % len(pool)] for number in range(size)]
+        for name, provider, serialize in contenders:
+            rows.append({"promotions": size, "provider": name, **bench_provider(provider, serialize, promotions, args.repeat)})
+
+    backend = "orjson" if orjson is not None else "standard library json"
+    print_table(f"Serialize and encode, then decode ({backend} backend)", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Metrics Benchmark
+
+Measures what the request metrics cost: one observe() call on its own, and
+the before and after request hooks together, which is what every request pays.
+
+Usage:
+    python -m benchmarks.bench_metrics [--calls 100000]
+"""
+import argparse
+import tempfile
+import time
+
+from flask import Flask
+
+from benchmarks.common import print_table
+
+
+def per_call_us(func, calls: int) -> float:
+    """Returns the mean time of one call of func in microseconds"""
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return round((time.perf_counter() - start) / calls * 1e6, 3)
+
+
+def hooks_us(metrics_dir: str, calls: int) -> float:
+    """Returns the time the before and after request hooks add to one request in microseconds"""
+    # pylint: disable=import-outside-toplevel, protected-access
+    from service.common.metrics import RequestMetrics
+
+    app = Flask(__name__)
+    app.config.update(METRICS_ENABLED=True, METRICS_DIR=metrics_dir)
+    metrics = RequestMetrics()
+    metrics.init_app(app)
+    response = app.response_class("")
+    with app.test_request_context("/promotions", headers={"X-Request-Start": f"t={time.time():.3f}"}):
+
+        def request():
+            metrics._before_request()
+            metrics._after_request(response)
+
+        return per_call_us(request, calls)
+
+
+def main():
+    """Reports the cost of recording metrics per call and per request"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=100000, help="calls to time")
+    args = parser.parse_args()
+
+    # pylint: disable=import-outside-toplevel
+    from service.common.metrics import RequestMetrics
+
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for storage, path in (("memory", ""), ("mmap", directory)):
+            metrics = RequestMetrics()
+            metrics.directory = path
+            observe = per_call_us(
+                lambda: metrics.observe(0, 200, 0.004, 0.001), args.calls  # pylint: disable=cell-var-from-loop
+            )
+            rows.append({"storage": storage, "observe_us": observe, "hooks_us": hooks_us(path, args.calls)})
+    print_table("Request metrics cost per request", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Pagination Benchmark
+
+Compares the cost of fetching page 1 and page N of GET /promotions with
+keyset (cursor) pagination against the equivalent LIMIT/OFFSET query.
+
+Usage:
+    python -m benchmarks.bench_pagination [--limit 10] [--pages 10000]
+"""
+import argparse
+
+from benchmarks.common import bench_app, measure, print_table, seed_promotions
+
+
+def main():
+    """Seeds pages * limit promotions and times the first and last page"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limit", type=int, default=10, help="page size")
+    parser.add_argument("--pages", type=int, default=10000, help="deepest page to fetch")
+    parser.add_argument("--repeat", type=int, default=50, help="timed calls per measurement")
+    args = parser.parse_args()
+
+    app = bench_app()
+    # pylint: disable=import-outside-toplevel
+    from service.common.pagination import encode_cursor
+    from service.models import Promotion, db
+
+    with app.app_context():
+        seed_promotions(args.limit * args.pages)
+        first_id = db.session.query(db.func.min(Promotion.id)).scalar()
+        client = app.test_client()
+        results = []
+        for page in (1, args.pages):
+            after_id = first_id - 1 + (page - 1) * args.limit
+            cursor_url = f"/promotions?limit={args.limit}&cursor={encode_cursor(after_id)}"
+            offset = (page - 1) * args.limit
+
+            def fetch_keyset(url=cursor_url):
+                response = client.get(url)
+                assert response.status_code == 200 and len(response.get_json()) == args.limit
+
+            def fetch_offset(offset=offset):
+                rows = Promotion.query.order_by(Promotion.id).offset(offset).limit(args.limit).all()
+                assert len(rows) == args.limit
+                db.session.remove()
+
+            results.append({"page": page, "strategy": "keyset (GET /promotions)", **measure(fetch_keyset, args.repeat)})
+            results.append({"page": page, "strategy": "offset (ORM query only)", **measure(fetch_offset, args.repeat)})
+
+    print_table(f"Pagination cost, {args.limit * args.pages} rows, limit {args.limit}", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Shared Cache Benchmark
+
+Compares the two promotion cache backends. The time of one hit, one miss
+and one put is measured in this process. Then --workers forked workers
+each look up --lookups random promotions out of --keys and fill every
+miss, the way Promotion.find does. The per-process LRU cache has to miss
+every key once in every worker. The shared cache misses it once per node.
+
+Usage:
+    python -m benchmarks.bench_shared_cache [--workers 4] [--keys 1000] [--lookups 20000]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.common import print_table
+from service.common.cache import LRUCache
+from service.common.shared_cache import SharedCache
+
+ROW = {
+    "id": 1,
+    "name": "Spring Sale",
+    "promotion_id": "SPRING-0001",
+    "promotion_type": "PERCENTAGE_DISCOUNT",
+    "promotion_amount": 15.0,
+    "promotion_description": "15% off everything in the spring collection",
+    "usage_count": 42,
+    "state": "active",
+    "version": 3,
+}
+CACHES = []
+
+
+def per_call_us(func, calls: int) -> float:
+    """Returns the mean time of one call of func in microseconds"""
+    start = time.perf_counter()
+    for number in range(calls):
+        func(number)
+    return round((time.perf_counter() - start) / calls * 1e6, 3)
+
+
+def make_cache(backend: str, path: str, keys: int):
+    """Returns an enabled cache of the backend with room for every key"""
+    if backend == "memory":
+        cache = LRUCache(maxsize=keys * 2, ttl=600)
+    else:
+        cache = SharedCache(path, maxsize=keys * 2, ttl=600)
+        cache.open()
+    cache.enabled = True
+    return cache
+
+
+def worker(keys: int, lookups: int, seed: int) -> int:
+    """Looks up random keys in the inherited cache and fills the misses, returns the number of misses"""
+    cache = CACHES[0]
+    rng = random.Random(seed)
+    misses = 0
+    for _ in range(lookups):
+        key = rng.randrange(keys)
+        if cache.get(key) is None:
+            misses += 1
+            cache.put(key, {**ROW, "id": key})
+    return misses
+
+
+def run_backend(backend: str, args, path: str) -> dict:
+    """Measures one backend"""
+    cache = make_cache(backend, path, args.keys)
+    put_us = per_call_us(lambda number: cache.put(number % args.keys, {**ROW, "id": number}), args.lookups)
+    hit_us = per_call_us(lambda number: cache.get(number % args.keys), args.lookups)
+    miss_us = per_call_us(lambda number: cache.get(args.keys + number), args.lookups)
+    cache.clear()
+
+    CACHES[:] = [cache]  # forked workers inherit it, a cache cannot be pickled
+    context = multiprocessing.get_context("fork")
+    with context.Pool(args.workers) as pool:
+        misses = pool.starmap(worker, [(args.keys, args.lookups, seed) for seed in range(args.workers)])
+    lookups = args.workers * args.lookups
+    return {
+        "backend": backend,
+        "hit_us": hit_us,
+        "miss_us": miss_us,
+        "put_us": put_us,
+        "db_reads": sum(misses),
+        "hit_rate": round(1 - sum(misses) / lookups, 3),
+    }
+
+
+def main():
+    """Reports the cost of a lookup and the database reads of each backend"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="forked workers")
+    parser.add_argument("--keys", type=int, default=1000, help="distinct promotions looked up")
+    parser.add_argument("--lookups", type=int, default=20000, help="lookups per worker")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "promotion-cache")
+        rows = [run_backend(backend, args, path) for backend in ("memory", "shared")]
+    print_table(f"Promotion cache backends, {args.workers} workers", rows)
+
+
+if __name__ == "__main__":
+    main()
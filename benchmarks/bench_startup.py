@@ -0,0 +1,72 @@
+"""
+Startup Benchmark
+
+Measures create_app() cold: each run is a fresh interpreter that imports
+the service and creates the app, the way a gunicorn worker boots. The
+"check" mode is what the service does now, a schema version query, and
+"rebuild" adds the drop and re-create of every table that it used to do.
+
+Usage:
+    python -m benchmarks.bench_startup [--runs 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks.common import DEFAULT_DATABASE_URI, print_table, upgrade_database
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from service import create_app, migrations
+from service.models import db
+imported = time.perf_counter()
+app = create_app()
+if sys.argv[1] == "rebuild":
+    with app.app_context():
+        migrations.drop_all(db.engine, db.metadata)
+        migrations.upgrade(db.engine)
+created = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "create_app_ms": (created - imported) * 1000}))
+"""
+
+
+def cold_start(mode: str, database_uri: str) -> dict:
+    """Starts a fresh interpreter that creates the app and returns its timings"""
+    env = dict(os.environ, DATABASE_URI=database_uri)
+    result = subprocess.run(
+        [sys.executable, "-c", STARTUP_SCRIPT, mode], env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    """Cold starts the app in each mode and reports the median timings"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="cold starts per mode")
+    args = parser.parse_args()
+
+    database_uri = os.getenv("BENCH_DATABASE_URI", DEFAULT_DATABASE_URI)
+    upgrade_database(database_uri)
+
+    rows = []
+    for mode in ("check", "rebuild"):
+        runs = [cold_start(mode, database_uri) for _ in range(args.runs)]
+        imports = statistics.median(run["import_ms"] for run in runs)
+        creates = statistics.median(run["create_app_ms"] for run in runs)
+        rows.append(
+            {
+                "mode": mode,
+                "import_ms": round(imports, 1),
+                "create_app_ms": round(creates, 1),
+                "total_ms": round(imports + creates, 1),
+            }
+        )
+    print_table(f"Cold create_app() over {args.runs} runs (median)", rows)
+
+
+if __name__ == "__main__":
+    main()
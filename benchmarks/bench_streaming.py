@@ -0,0 +1,61 @@
+"""
+Streaming Benchmark
+
+Compares peak Python heap and time to first byte of GET /promotions as a
+JSON array against the streamed NDJSON mode.
+
+Usage:
+    python -m benchmarks.bench_streaming [--rows 10000 100000]
+"""
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.common import bench_app, print_table, seed_promotions
+
+
+def profile_request(client, headers) -> dict:
+    """Consumes one list response and reports its peak heap and timings"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = client.get("/promotions", headers=headers, buffered=False)
+    chunks = iter(response.response)
+    first = next(chunks, b"")
+    first_byte = time.perf_counter() - start
+    size = len(first) + sum(len(chunk) for chunk in chunks)
+    total = time.perf_counter() - start
+    response.close()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "first_byte_ms": round(first_byte * 1000, 2),
+        "total_ms": round(total * 1000, 2),
+        "bytes": size,
+        "peak_heap_mb": round(peak / 2**20, 2),
+    }
+
+
+def main():
+    """Seeds each table size and profiles both response modes"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000], help="table sizes to test")
+    args = parser.parse_args()
+
+    app = bench_app()
+    # pylint: disable=import-outside-toplevel
+    from service.models import Promotion, db
+
+    results = []
+    with app.app_context():
+        client = app.test_client()
+        for rows in args.rows:
+            db.session.query(Promotion).delete()
+            db.session.commit()
+            seed_promotions(rows)
+            for mode, accept in (("json", "application/json"), ("ndjson", "application/x-ndjson")):
+                results.append({"rows": rows, "mode": mode, **profile_request(client, {"Accept": accept})})
+    print_table("GET /promotions response modes", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Read Path Benchmark
+
+Compares loading and serializing promotions as ORM Promotion instances
+against the Core rows and PromotionView tuples that the read endpoints use:
+wall time to load and serialize, and the memory blocks each loaded row holds.
+
+Usage:
+    python -m benchmarks.bench_views [--rows 10000] [--repeat 10]
+"""
+import argparse
+import tracemalloc
+
+from benchmarks.common import bench_app, measure, print_table, seed_promotions
+
+
+def load_orm():
+    """Returns every promotion as an ORM Promotion"""
+    # pylint: disable=import-outside-toplevel
+    from service.models import Promotion
+
+    return Promotion.query.order_by(Promotion.id).all()
+
+
+def load_views():
+    """Returns every promotion as a PromotionView"""
+    # pylint: disable=import-outside-toplevel
+    from service.models import Promotion, PromotionView
+
+    return list(PromotionView.from_rows(Promotion.views(Promotion.query).order_by(Promotion.id)))
+
+
+def serialize_all(load):
+    """Loads and serializes every promotion the way GET /promotions does, then ends the session"""
+    # pylint: disable=import-outside-toplevel
+    from service.models import db
+
+    results = [promotion.serialize() for promotion in load()]
+    db.session.remove()
+    return results
+
+
+def profile(load) -> dict:
+    """Counts the memory blocks and bytes that the loaded promotions hold on to"""
+    # pylint: disable=import-outside-toplevel
+    from service.models import db
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    promotions = load()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    diff = after.compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in diff)
+    size = sum(stat.size_diff for stat in diff)
+    count = len(promotions)
+    del promotions
+    db.session.remove()
+    return {
+        "blocks_per_row": round(blocks / count, 1),
+        "held_mb": round(size / 2**20, 2),
+        "peak_heap_mb": round(peak / 2**20, 2),
+    }
+
+
+def main():
+    """Seeds the table and reports time and memory for both read paths"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000, help="promotions to read")
+    parser.add_argument("--repeat", type=int, default=10, help="timed runs per path")
+    args = parser.parse_args()
+
+    app = bench_app()
+    # pylint: disable=import-outside-toplevel
+    from service.models import Promotion, db
+
+    results = []
+    with app.app_context():
+        db.session.query(Promotion).delete()
+        db.session.commit()
+        seed_promotions(args.rows)
+        for name, load in (("orm", load_orm), ("view", load_views)):
+            timing = measure(lambda: serialize_all(load), args.repeat)  # pylint: disable=cell-var-from-loop
+            results.append({"path": name, "median_ms": timing["median_ms"], "p95_ms": timing["p95_ms"], **profile(load)})
+    print_table(f"Reading and serializing {args.rows} promotions", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark Helpers
+
+Utility functions shared by the benchmark scripts
+"""
+import os
+import statistics
+import tempfile
+import time
+
+DEFAULT_DATABASE_URI = "sqlite:///" + os.path.join(tempfile.gettempdir(), "promotions-bench.db")
+SEED_POOL_SIZE = 1000
+SEED_BATCH_SIZE = 10000
+
+
+def bench_app(database_uri=None):
+    """Creates the service app against a scratch database"""
+    os.environ["DATABASE_URI"] = database_uri or os.getenv("BENCH_DATABASE_URI", DEFAULT_DATABASE_URI)
+    # pylint: disable=import-outside-toplevel
+    import logging
+    from service import create_app
+
+    upgrade_database(os.environ["DATABASE_URI"])
+
+    app = create_app()
+    app.logger.setLevel(logging.CRITICAL)
+    logging.getLogger("flask.app").setLevel(logging.CRITICAL)
+    return app
+
+
+def upgrade_database(database_uri: str) -> None:
+    """Brings the schema of a scratch database up to date, the service only checks it"""
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy import create_engine
+    from service import migrations
+
+    engine = create_engine(database_uri)
+    migrations.upgrade(engine)
+    engine.dispose()
+
+
+def seed_promotions(count: int) -> None:
+    """Inserts count promotions built from PromotionFactory in batches
+
+    Must be called inside an application context. Faker is slow, so a pool of
+    factory promotions is recycled with a unique promotion_id for every row.
+    """
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy import insert
+    from service.models import Promotion, db
+    from tests.factories import PromotionFactory
+
+    columns = [column.name for column in Promotion.__table__.columns if column.name != "id"]
+    pool = [
+        {name: getattr(promotion, name) for name in columns}
+        for promotion in PromotionFactory.build_batch(min(count, SEED_POOL_SIZE))
+    ]
+    for offset in range(0, count, SEED_BATCH_SIZE):
+        rows = []
+        for number in range(offset, min(offset + SEED_BATCH_SIZE, count)):
+            row = dict(pool[number % len(pool)])
+            row["promotion_id"] = f"BENCH{number:09d}"
+            row["state"] = "active"
+            rows.append(row)
+        db.session.execute(insert(Promotion), rows)
+        db.session.commit()
+
+
+def measure(func, repeat: int = 20, warmup: int = 2) -> dict:
+    """Calls func repeatedly and returns its latency distribution in milliseconds"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "repeat": repeat,
+        "min_ms": round(samples[0], 4),
+        "median_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        "max_ms": round(samples[-1], 4),
+    }
+
+
+def print_table(title: str, rows: list) -> None:
+    """Prints benchmark results as an aligned table"""
+    print(f"\n{title}")
+    if not rows:
+        return
+    headers = list(rows[0].keys())
+    widths = [max(len(str(header)), *(len(str(row[header])) for row in rows)) for header in headers]
+    print("  ".join(str(header).ljust(width) for header, width in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(str(row[header]).ljust(width) for header, width in zip(headers, widths)))
@@ -0,0 +1,256 @@
+"""
+Benchmark Suite
+
+Runs the standard scenarios against a scratch database seeded from
+tests.factories.PromotionFactory with a fixed random seed, writes the
+results as JSON and compares them with a stored baseline:
+
+    serialize / deserialize    Promotion.serialize and deserialize of 1000 promotions
+    list_<rows>_*              GET /promotions pages of 100, unfiltered and filtered, and one id at each --rows size
+    apply_concurrent           PUT /promotions/{id}/apply from --threads clients at once
+    startup_cold               create_app() in a fresh interpreter
+
+Results are SQLite numbers unless BENCH_DATABASE_URI points at PostgreSQL.
+Every scenario whose median latency (or throughput) is more than
+--tolerance and --noise-ms worse than the baseline is reported, and the
+exit code is 1.
+
+Usage:
+    python -m benchmarks.suite [--rows 1000 100000] [--output benchmark-results.json]
+    python -m benchmarks.suite --save-baseline
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from importlib.metadata import version
+
+from benchmarks.bench_startup import cold_start
+from benchmarks.common import DEFAULT_DATABASE_URI, bench_app, measure, print_table, seed_promotions
+
+SEED = 2820
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+FILTERED = "promotion_type=DISCOUNT&active_at=2025-06-01T00:00:00"
+
+
+def reseed():
+    """Makes factory data and random choices the same on every run"""
+    # pylint: disable=import-outside-toplevel
+    import factory.random
+
+    random.seed(SEED)
+    factory.random.reseed_random(SEED)
+
+
+######################################################################
+# Scenarios
+######################################################################
+
+
+def bench_codec(app, repeat: int) -> dict:
+    """Times Promotion.serialize and deserialize over 1000 factory promotions"""
+    # pylint: disable=import-outside-toplevel
+    from service.models import Promotion
+    from tests.factories import PromotionFactory
+
+    reseed()
+    promotions = PromotionFactory.build_batch(1000)
+    documents = [app.json.loads(app.json.dumps(promotion.serialize())) for promotion in promotions]
+    return {
+        "serialize": measure(lambda: [promotion.serialize() for promotion in promotions], repeat),
+        "deserialize": measure(lambda: [Promotion().deserialize(document) for document in documents], repeat),
+    }
+
+
+def bench_list(client, rows: int, repeat: int) -> dict:
+    """Seeds rows promotions and times the read endpoints over them"""
+    # pylint: disable=import-outside-toplevel
+    from service.models import Promotion, db
+
+    db.session.query(Promotion).delete()
+    db.session.commit()
+    reseed()
+    seed_promotions(rows)
+    middle = db.session.query(Promotion.id).order_by(Promotion.id).offset(rows // 2).limit(1).scalar()
+    db.session.remove()
+
+    def get(url):
+        return lambda: client.get(url).status_code == 200 or sys.exit(f"GET {url} failed")
+
+    return {
+        f"list_{rows}_first_page": measure(get("/promotions?limit=100"), repeat),
+        f"list_{rows}_filtered": measure(get(f"/promotions?{FILTERED}&limit=100"), repeat),
+        f"list_{rows}_get": measure(get(f"/promotions/{middle}"), repeat),
+    }
+
+
+def apply_worker(app, ids: list, requests: int, samples: list, errors: list):
+    """Applies random promotions from one client and records each latency"""
+    client = app.test_client()
+    chooser = random.Random(SEED + threading.get_ident())
+    for _ in range(requests):
+        start = time.perf_counter()
+        resp = client.put(f"/promotions/{chooser.choice(ids)}/apply")
+        samples.append((time.perf_counter() - start) * 1000)
+        if resp.status_code != 200:
+            errors.append(resp.status_code)
+
+
+def bench_apply(app, threads: int, requests: int) -> dict:
+    """Times PUT /promotions/{id}/apply from several clients at once"""
+    # pylint: disable=import-outside-toplevel
+    from service.models import Promotion, db
+
+    ids = [row.id for row in db.session.query(Promotion.id).order_by(Promotion.id).limit(100)]
+    db.session.remove()
+    samples, errors = [], []
+    workers = [
+        threading.Thread(target=apply_worker, args=(app, ids, requests, samples, errors)) for _ in range(threads)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    samples.sort()
+    return {
+        "apply_concurrent": {
+            "threads": threads,
+            "median_ms": round(samples[len(samples) // 2], 4),
+            "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+            "ops_per_s": round(len(samples) / elapsed, 1),
+            "errors": len(errors),
+        }
+    }
+
+
+def bench_startup(database_uri: str, runs: int) -> dict:
+    """Times create_app() cold"""
+    samples = sorted(sum(cold_start("check", database_uri).values()) for _ in range(runs))
+    return {
+        "startup_cold": {"repeat": runs, "median_ms": round(samples[len(samples) // 2], 1), "max_ms": round(samples[-1], 1)}
+    }
+
+
+######################################################################
+# Results
+######################################################################
+
+
+def metadata(database_uri: str, args) -> dict:
+    """Describes the code and machine the results came from"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = "unknown"
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "flask": version("flask"),
+        "sqlalchemy": version("sqlalchemy"),
+        "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+        "database": database_uri.split(":", 1)[0],
+        "rows": args.rows,
+        "seed": SEED,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float, noise_ms: float) -> list:
+    """Returns a row for every scenario that both runs have, flagging regressions
+
+    A scenario regressed when it is more than tolerance slower and also more than
+    noise_ms slower, so jitter on sub-millisecond scenarios is not reported.
+    """
+    rows = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if "ops_per_s" in result and "ops_per_s" in before:
+            ratio = before["ops_per_s"] / result["ops_per_s"] if result["ops_per_s"] else float("inf")
+        else:
+            ratio = result["median_ms"] / before["median_ms"] if before["median_ms"] else 1.0
+        slower_ms = result["median_ms"] - before["median_ms"]
+        rows.append(
+            {
+                "scenario": name,
+                "baseline_ms": before["median_ms"],
+                "now_ms": result["median_ms"],
+                "slowdown": f"{ratio:.2f}x",
+                "status": "REGRESSION" if ratio > 1 + tolerance and slower_ms > noise_ms else "ok",
+            }
+        )
+    return rows
+
+
+def run(args) -> dict:
+    """Runs every scenario and returns the results by name"""
+    database_uri = os.getenv("BENCH_DATABASE_URI", DEFAULT_DATABASE_URI)
+    app = bench_app(database_uri)
+    results = bench_codec(app, args.repeat)
+    with app.app_context():
+        client = app.test_client()
+        for rows in args.rows:
+            results.update(bench_list(client, rows, args.repeat))
+        results.update(bench_apply(app, args.threads, args.requests))
+    results.update(bench_startup(database_uri, args.startup_runs))
+    return {"meta": metadata(database_uri, args), "results": results}
+
+
+def main():
+    """Runs the suite, writes the results and compares them with the baseline"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000], help="table sizes for the list scenarios")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per scenario")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent clients applying promotions")
+    parser.add_argument("--requests", type=int, default=50, help="applies per client")
+    parser.add_argument("--startup-runs", type=int, default=5, help="cold starts to time")
+    parser.add_argument("--output", default="benchmark-results.json", help="where to write the results")
+    parser.add_argument("--baseline", default=BASELINE, help="results to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="slowdown that counts as a regression")
+    parser.add_argument("--noise-ms", type=float, default=2.0, help="smaller slowdowns in ms are jitter")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_table(
+        "Benchmark results",
+        [
+            {"scenario": name, **{column: result.get(column, "-") for column in ("median_ms", "p95_ms", "ops_per_s")}}
+            for name, result in report["results"].items()
+        ],
+    )
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+            file.write("\n")
+        print(f"\nSaved the baseline to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, run with --save-baseline to store one")
+        return
+
+    with open(args.baseline, encoding="utf-8") as file:
+        baseline = json.load(file)
+    if baseline["meta"]["database"] != report["meta"]["database"]:
+        print(f"\nThe baseline was measured on {baseline['meta']['database']}, not {report['meta']['database']}")
+    rows = compare(report["results"], baseline["results"], args.tolerance, args.noise_ms)
+    print_table(f"Compared with {baseline['meta']['commit']} ({baseline['meta']['timestamp']})", rows)
+    if any(row["status"] == "REGRESSION" for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Gunicorn configuration for production
+
+    gunicorn --config gunicorn.conf.py wsgi:app
+
+The app is created once in the master and forked into the workers. Before
+each fork the garbage collector freezes every object the master holds, so
+collections in the workers never write to those pages and they stay shared
+copy-on-write. Each worker then drops the connections it inherited from
+the master's engine and opens its own.
+
+The worker class, workers and threads come from the CPU count unless set
+by GUNICORN_WORKER_CLASS, WEB_CONCURRENCY and GUNICORN_THREADS. The
+request metrics of all the workers are shared through METRICS_DIR, which
+defaults to a directory in /dev/shm.
+"""
+import gc
+import glob
+import multiprocessing
+import os
+import tempfile
+
+
+def _env_bool(name: str, default: str) -> bool:
+    return os.getenv(name, default).lower() in ["true", "yes", "1"]
+
+
+# Threads of one worker, no more than the connections in its pool
+_pool_capacity = int(os.getenv("DB_POOL_SIZE", "5")) + int(os.getenv("DB_MAX_OVERFLOW", "10"))
+threads = max(1, min(int(os.getenv("GUNICORN_THREADS", "4")), _pool_capacity))
+
+# Threaded workers wait on the database without blocking each other, so one per CPU is enough
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread" if threads > 1 else "sync")
+_cpus = multiprocessing.cpu_count()
+workers = int(os.getenv("WEB_CONCURRENCY", str(_cpus + 1 if threads > 1 else 2 * _cpus + 1)))
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8080')}")
+preload_app = _env_bool("GUNICORN_PRELOAD", "True")
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+# Every worker maps its request metrics from a file here, so a scrape of any worker adds up all of them.
+# It is set before the app is loaded, in the master or in the workers, so the app config picks it up.
+_shm = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+_metrics_dir = os.environ.setdefault("METRICS_DIR", os.path.join(_shm, "promotion-metrics"))
+
+
+def _dispose_engine(server, close: bool):
+    """Drops the pooled connections of the preloaded app, to the primary and to every replica"""
+    # pylint: disable=import-outside-toplevel
+    from service.common.replicas import replica_router
+    from service.models import db
+
+    with server.app.wsgi().app_context():
+        db.engine.dispose(close=close)
+        for replica in replica_router.replicas:
+            replica.engine.dispose(close=close)
+
+
+def on_starting(server):
+    """Creates the metrics directory and removes the files of workers from an earlier run of the master"""
+    if not _metrics_dir:
+        if workers > 1:
+            server.log.warning("METRICS_DIR is empty, GET /metrics reports only the worker that answers it")
+        return
+    os.makedirs(_metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(_metrics_dir, "metrics_*.db")):
+        os.remove(path)
+
+
+def when_ready(server):
+    """Closes the connections the master opened while creating the app, no worker may inherit them"""
+    if server.cfg.preload_app:
+        _dispose_engine(server, close=True)
+
+
+def pre_fork(_server, _worker):
+    """Moves everything the master holds out of reach of the garbage collector"""
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Forgets the master's connections without closing them, the worker opens its own"""
+    if server.cfg.preload_app:
+        _dispose_engine(server, close=False)
+    server.log.info("Worker %s started with %d frozen objects", worker.pid, gc.get_freeze_count())
+
+
+def child_exit(_server, worker):
+    """Zeroes the in-flight requests of a worker that exited in the shared metrics"""
+    # pylint: disable=import-outside-toplevel
+    from service.common.metrics import request_metrics
+
+    if not request_metrics.directory:
+        request_metrics.directory = _metrics_dir
+    request_metrics.mark_process_dead(worker.pid)
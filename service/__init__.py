@@ -18,26 +18,77 @@ Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging
 and SQL database
 """
+import os
 import sys
 from flask import Flask
-from service import config
+from service import config, migrations
 from service.common import log_handlers
+from service.common.json_provider import PromotionJSONProvider
+
+
+def check_schema(app, engine):
+    """Makes sure the database schema is the version the code expects
+
+    Creating or upgrading the tables is left to flask db-upgrade
+    """
+    try:
+        version = migrations.check(engine)
+    except migrations.SchemaVersionError as error:
+        if app.config["SCHEMA_CHECK_STRICT"]:
+            raise
+        app.logger.warning("%s", error)
+    else:
+        app.logger.info("Database schema is at version %d", version)
+
+
+def prepare_database(app, engine):
+    """Checks the schema and warms the promotion cache before the service takes requests
+
+    Skipped for flask commands, because db-upgrade and db-create have to
+    start on a database whose schema is not current yet
+    """
+    if os.environ.get("FLASK_RUN_FROM_CLI") == "true":
+        app.logger.info("Skipping the schema check for a flask command")
+        return
+    # pylint: disable=import-outside-toplevel
+    from service.common.cache import promotion_cache
+    from service.models import Promotion
+
+    check_schema(app, engine)
+    if promotion_cache.enabled and app.config["PROMOTION_CACHE_WARM"] > 0:
+        Promotion.warm_cache(app.config["PROMOTION_CACHE_WARM"])
 
 
 ############################################################
 # Initialize the Flask instance
 ############################################################
-def create_app():
+def create_app():  # pylint: disable=too-many-locals
     """Initialize the core application."""
     # Create Flask application
     app = Flask(__name__)
     app.config.from_object(config)
+    app.json = PromotionJSONProvider(app)
 
     # Initialize Plugins
     # pylint: disable=import-outside-toplevel
     from service.models import db
+    from service.common.usage_buffer import usage_buffer
+    from service.common.interval_tree import live_index
+    from service.common.evaluator import cart_evaluator
+    from service.common.cache import promotion_cache
+    from service.common.db_pool import engine_options, pool_metrics
+    from service.common.metrics import request_metrics
+    from service.common.profiling import request_profiler
+    from service.common.query_log import query_log
+    from service.common.replicas import replica_router
 
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(app.config))
     db.init_app(app)
+    usage_buffer.init_app(app)
+    live_index.init_app(app)
+    cart_evaluator.init_app(app)
+    promotion_cache.init_app(app)
+    request_profiler.init_app(app)
 
     with app.app_context():
         # Dependencies require we import the routes AFTER the Flask app is created
@@ -45,9 +96,12 @@ def create_app():
         from service import routes, models  # noqa: F401 E402
         from service.common import error_handlers, cli_commands  # noqa: F401, E402
 
+        pool_metrics.watch(db.engine)
+        query_log.init_app(app, db.engine)
+        replica_router.init_app(app)
+        request_metrics.init_app(app)
         try:
-            db.drop_all()
-            db.create_all()
+            prepare_database(app, db.engine)
         except Exception as error:  # pylint: disable=broad-except
             app.logger.critical("%s: Cannot continue", error)
             # gunicorn requires exit code 4 to stop spawning workers when they die
@@ -0,0 +1,164 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Promotion Cache
+
+Bounded read-through cache for Promotion.find. Entries are evicted least
+recently used first and expire after PROMOTION_CACHE_TTL seconds. Ids
+that do not exist are remembered for PROMOTION_CACHE_NEGATIVE_TTL seconds
+so scans over missing ids do not reach the database.
+
+PROMOTION_CACHE_BACKEND chooses where the entries live: "memory" keeps
+an LRUCache in each process, "shared" keeps one SharedCache in a memory
+mapped file for every worker on the node (see shared_cache.py).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# Cached in place of the row of a Promotion that does not exist
+NOT_FOUND = object()
+
+
+def promotion_id_key(code: str) -> tuple:
+    """Returns the cache key that maps a promotion_id to the id of its Promotion"""
+    return ("promotion_id", code)
+
+
+class LRUCache:
+    """Thread safe LRU cache whose entries expire after a ttl"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 5.0, negative_ttl: float = 1.0):
+        self.enabled = False
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "negative_hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def init_app(self, app):
+        """Configures the cache from the app config, empties it and resets its counters"""
+        self.enabled = app.config["PROMOTION_CACHE_ENABLED"]
+        self.maxsize = max(1, app.config["PROMOTION_CACHE_SIZE"])
+        self.ttl = app.config["PROMOTION_CACHE_TTL"]
+        self.negative_ttl = app.config["PROMOTION_CACHE_NEGATIVE_TTL"]
+        self.clear()
+        with self._lock:
+            self._stats = dict.fromkeys(self._stats, 0)
+
+    def get(self, key):
+        """Returns the cached value of key, NOT_FOUND for a cached miss or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["negative_hits" if value is NOT_FOUND else "hits"] += 1
+            return value
+
+    def put(self, key, value):
+        """Caches value, or NOT_FOUND for a key that does not exist, and evicts the oldest entries"""
+        ttl = self.negative_ttl if value is NOT_FOUND else self.ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, *keys):
+        """Forgets keys after they were written"""
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """Forgets every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Returns the size of the cache and its hit, miss and eviction counters"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["negative_hits"] + self._stats["misses"]
+            hit_rate = (lookups - self._stats["misses"]) / lookups if lookups else 0.0
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hit_rate": round(hit_rate, 3),
+                **self._stats,
+            }
+
+
+class PromotionCache:
+    """The promotion cache of the service, kept by the backend in PROMOTION_CACHE_BACKEND"""
+
+    BACKENDS = ("memory", "shared")
+
+    def __init__(self):
+        self.name = "memory"
+        self.backend = LRUCache()
+
+    @property
+    def enabled(self) -> bool:
+        """True when Promotion lookups go through the cache"""
+        return self.backend.enabled
+
+    def init_app(self, app):
+        """Switches to the configured backend and configures it"""
+        name = app.config["PROMOTION_CACHE_BACKEND"]
+        if name not in self.BACKENDS:
+            raise ValueError(f"Invalid PROMOTION_CACHE_BACKEND: {name}")
+        # pylint: disable-next=import-outside-toplevel
+        from service.common.shared_cache import SharedCache
+
+        if isinstance(self.backend, SharedCache):
+            self.backend.close()
+        self.name = name
+        self.backend = SharedCache() if name == "shared" else LRUCache()
+        self.backend.init_app(app)
+
+    def get(self, key):
+        """Returns the cached value of key, NOT_FOUND for a cached miss or None"""
+        return self.backend.get(key)
+
+    def put(self, key, value):
+        """Caches value, or NOT_FOUND for a key that does not exist"""
+        self.backend.put(key, value)
+
+    def invalidate(self, *keys):
+        """Forgets keys after they were written"""
+        self.backend.invalidate(*keys)
+
+    def clear(self):
+        """Forgets every entry"""
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        """Returns the backend, the size of the cache and its hit, miss and eviction counters"""
+        return {"backend": self.name, **self.backend.stats()}
+
+
+promotion_cache = PromotionCache()
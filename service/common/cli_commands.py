@@ -16,7 +16,11 @@
 """
 Flask CLI Command Extensions
 """
+import json
+import click
 from flask import current_app as app  # Import Flask application
+from service import migrations
+from service.common.load_test import DEFAULT_MIX, PERCENTILES, ClientTransport, HttpTransport, LoadTest, parse_mix
 from service.models import db
 
 
@@ -31,6 +35,66 @@ def db_create():
     Recreates a local database. You probably should not use this on
     production. ;-)
     """
-    db.drop_all()
-    db.create_all()
+    migrations.drop_all(db.engine, db.metadata)
+    migrations.upgrade(db.engine)
     db.session.commit()
+
+
+######################################################################
+# Command to apply pending schema migrations
+# Usage:
+#   flask db-upgrade
+######################################################################
+@app.cli.command("db-upgrade")
+def db_upgrade():
+    """Applies any schema migrations the database is missing"""
+    try:
+        applied = migrations.upgrade(db.engine)
+    except migrations.MigrationError as error:
+        raise click.ClickException(str(error)) from error
+    if applied:
+        click.echo(f"Upgraded schema to version {applied[-1]}")
+    else:
+        click.echo(f"Schema is up to date at version {migrations.latest_version()}")
+
+
+######################################################################
+# Command to load test the service
+# Usage:
+#   flask load-test --duration 30 --concurrency 8 --rps 200
+#   flask load-test --url http://localhost:8080 --mix list=80,get=20
+######################################################################
+@app.cli.command("load-test")
+@click.option("--url", default=None, help="Base URL of a running service, the app in process when omitted")
+@click.option("--mix", default=DEFAULT_MIX, show_default=True, help="Weights of list, get, create, apply and cancel")
+@click.option("--concurrency", default=4, show_default=True, help="Worker threads sending requests")
+@click.option("--rps", default=0.0, show_default=True, help="Target requests per second, 0 sends as fast as possible")
+@click.option("--duration", default=10.0, show_default=True, help="Seconds to run, 0 for no limit")
+@click.option("--requests", "limit", default=0, show_default=True, help="Requests to send, 0 for no limit")
+@click.option("--seed", default=None, type=int, help="Random seed for a repeatable request sequence")
+@click.option("--output", default=None, type=click.Path(dir_okay=False), help="Write the results as JSON")
+def load_test(url, mix, concurrency, rps, duration, limit, seed, output):  # pylint: disable=too-many-arguments
+    """Drives a mix of requests at the service and reports throughput and latency"""
+    try:
+        weights = parse_mix(mix)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--mix") from error
+    if not duration and not limit:
+        raise click.UsageError("Set --duration or --requests, or the load test never ends")
+
+    transport = HttpTransport(url) if url else ClientTransport(app._get_current_object())
+    click.echo(f"Load testing {url or 'the app in process'} with {concurrency} workers ({mix})...")
+    report = LoadTest(transport, weights, concurrency=concurrency, rps=rps, seed=seed).run(duration, limit)
+    report["settings"].update(url=url, mix=weights)
+
+    columns = ["requests", "rps", "failed"] + [f"p{value:g}_ms" for value in PERCENTILES] + ["max_ms"]
+    click.echo(" ".join(f"{name:>10}" for name in ["operation"] + columns))
+    for name, result in [*report["operations"].items(), ("total", report["total"])]:
+        click.echo(" ".join(f"{value:>10}" for value in [name] + [result[column] for column in columns]))
+    for name, result in report["operations"].items():
+        click.echo(f"{name} status codes: {result['statuses']}")
+    click.echo(f"Deleted {report['deleted']} promotions the load test created")
+    if output:
+        with open(output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        click.echo(f"Results written to {output}")
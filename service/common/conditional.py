@@ -0,0 +1,72 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Conditional Requests
+
+ETags and Cache-Control for Promotion resources. An ETag is built from
+the id and row version of every Promotion in a response, so it can be
+checked against If-None-Match without loading or serializing anything
+else. A response stays fresh until the next start_date or end_date of
+a Promotion in it, when the set of running promotions changes.
+"""
+import hashlib
+from datetime import datetime, timezone
+
+
+def resource_etag(by_id, version) -> str:
+    """Returns the ETag of a single Promotion"""
+    return f"{by_id}-{version}"
+
+
+def collection_etag(versions, *variant) -> str:
+    """
+    Returns the ETag of a list of Promotions
+
+    Args:
+        versions (iterable): the (id, version, ...) of each Promotion in response order
+        variant: anything else that changes the response, like its media type
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(variant).encode())
+    for row in versions:
+        digest.update(b"%d-%d;" % (row[0], row[1]))
+    return digest.hexdigest()
+
+
+def max_age(boundaries, limit: int, now=None) -> int:
+    """
+    Returns how many seconds a response can be cached
+
+    Args:
+        boundaries (iterable): the start_date and end_date of each Promotion in the response
+        limit (int): the longest a response is ever cached
+        now (datetime): the current time as a naive UTC datetime
+    """
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    upcoming = [boundary for boundary in boundaries if boundary > now]
+    if not upcoming:
+        return limit
+    return max(0, min(limit, int((min(upcoming) - now).total_seconds())))
+
+
+def cache_headers(etag, boundaries, limit: int) -> dict:
+    """Returns the ETag, Cache-Control and Vary headers of a response"""
+    return {
+        "ETag": f'"{etag}"',
+        "Cache-Control": f"public, max-age={max_age(boundaries, limit)}",
+        "Vary": "Accept",
+    }
@@ -0,0 +1,116 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Database Connection Pool
+
+Builds the SQLAlchemy engine options for the connection pool of each
+worker from the DB_POOL_* settings and keeps live statistics about it,
+so workers x DB_POOL_SIZE + DB_MAX_OVERFLOW can be sized against the
+max_connections of PostgreSQL with data.
+"""
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that measures how long each checkout waits for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_lock = threading.Lock()
+        self.wait_stats = {"waits": 0, "timeouts": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self.wait_lock:
+                self.wait_stats["timeouts"] += 1
+            raise
+        finally:
+            waited = (time.perf_counter() - start) * 1000
+            with self.wait_lock:
+                self.wait_stats["waits"] += 1
+                self.wait_stats["wait_ms_total"] += waited
+                self.wait_stats["wait_ms_max"] = max(self.wait_stats["wait_ms_max"], waited)
+
+
+def engine_options(config) -> dict:
+    """Returns the SQLALCHEMY_ENGINE_OPTIONS for the DB_POOL_* settings in config"""
+    options = {
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+    }
+    uri = config["SQLALCHEMY_DATABASE_URI"]
+    if uri.startswith("sqlite") and (":memory:" in uri or uri.rstrip("/") == "sqlite:"):
+        # an in-memory SQLite database lives in its one connection, there is no pool to size
+        return options
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_size=config["DB_POOL_SIZE"],
+        max_overflow=config["DB_MAX_OVERFLOW"],
+        pool_timeout=config["DB_POOL_TIMEOUT"],
+    )
+    return options
+
+
+class PoolMetrics:
+    """Counts connection pool events of an engine"""
+
+    def __init__(self):
+        self.engine = None
+        self._lock = threading.Lock()
+        self._stats = {"checkouts": 0, "checkins": 0, "connects": 0, "invalidations": 0}
+
+    def watch(self, engine):
+        """Starts counting the pool events of engine"""
+        self.engine = engine
+        event.listen(engine, "checkout", lambda *args: self._count("checkouts"))
+        event.listen(engine, "checkin", lambda *args: self._count("checkins"))
+        event.listen(engine, "connect", lambda *args: self._count("connects"))
+        event.listen(engine, "invalidate", lambda *args: self._count("invalidations"))
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self) -> dict:
+        """Returns how busy the pool is right now and how long checkouts have waited"""
+        with self._lock:
+            stats = dict(self._stats)
+        pool = self.engine.pool if self.engine is not None else None
+        if isinstance(pool, QueuePool):
+            stats.update(
+                size=pool.size(),
+                checked_in=pool.checkedin(),
+                checked_out=pool.checkedout(),
+                overflow=max(0, pool.overflow()),
+                max_overflow=pool._max_overflow,  # pylint: disable=protected-access
+            )
+        if isinstance(pool, TimedQueuePool):
+            with pool.wait_lock:
+                waits = dict(pool.wait_stats)
+            waits["wait_ms_avg"] = waits["wait_ms_total"] / waits["waits"] if waits["waits"] else 0.0
+            stats.update({name: round(value, 3) for name, value in waits.items()})
+        return stats
+
+
+pool_metrics = PoolMetrics()
@@ -70,6 +70,21 @@ def method_not_supported(error):
     )
 
 
+@app.errorhandler(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+def request_entity_too_large(error):
+    """Handles oversized requests with 413_REQUEST_ENTITY_TOO_LARGE"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            error="Request Entity Too Large",
+            message=message,
+        ),
+        status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    )
+
+
 @app.errorhandler(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
 def mediatype_not_supported(error):
     """Handles unsupported media requests with 415_UNSUPPORTED_MEDIA_TYPE"""
@@ -0,0 +1,253 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Cart Evaluation
+
+Works out what each running Promotion takes off a cart, for
+POST /promotions/evaluate. The CartEvaluator keeps a snapshot of the
+active Promotions with one array per column. It evaluates a cart against
+all of them at once with NumPy, which the service image installs. Without
+NumPy, as in a bare development setup, the same arithmetic runs over lists
+and gives the same results, only slower.
+
+A Promotion applies to the whole cart while it is active and the time
+of the cart is between its start_date and end_date:
+    DISCOUNT, FLASH    promotion_amount percent off the subtotal, at most 100
+    COUPON             promotion_amount off the subtotal, at most the subtotal
+
+Amounts are worked out in whole cents and rounded half up. The snapshot
+is rebuilt after EVALUATE_SNAPSHOT_TTL seconds, or sooner when this
+process changes a Promotion.
+"""
+import logging
+import math
+import threading
+import time
+from datetime import datetime
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+from service.models import Promotion, PromotionType
+
+logger = logging.getLogger("flask.app")
+
+PERCENT_TYPES = frozenset((PromotionType.DISCOUNT, PromotionType.FLASH))
+EPOCH = datetime(1970, 1, 1)
+# the largest subtotal in cents, small enough that int64 sums and float64 percents of it stay exact
+MAX_CENTS = 2**53
+
+
+def to_seconds(when: datetime) -> float:
+    """Returns a naive UTC datetime as seconds since the epoch"""
+    return (when - EPOCH).total_seconds()
+
+
+def to_cents(amount: float) -> int:
+    """Returns an amount of money in whole cents, rounded half up"""
+    return math.floor(amount * 100 + 0.5)
+
+
+def subtotal_cents(prices, quantities, vectorized: bool = True) -> int:
+    """Returns the subtotal of a cart in cents from the price and quantity of each line"""
+    if vectorized and numpy is not None:
+        cents = numpy.floor(numpy.asarray(prices, dtype=numpy.float64) * 100 + 0.5).astype(numpy.int64)
+        return int(cents @ numpy.asarray(quantities, dtype=numpy.int64))
+    return sum(to_cents(price) * quantity for price, quantity in zip(prices, quantities))
+
+
+class Snapshot:
+    """The terms of the active Promotions, one column per field"""
+
+    def __init__(self, rows, vectorized: bool = True):
+        """
+        Builds the columns
+
+        Args:
+            rows (list): (id, promotion_id, name, promotion_type, promotion_amount, start_date, end_date) rows
+                in id order
+            vectorized (bool): keep the columns in NumPy arrays when NumPy is installed
+        """
+        self.rows = rows
+        self.vectorized = vectorized and numpy is not None
+        columns = list(zip(*rows)) or [()] * 7
+        ids, types, amounts, start_dates, end_dates = columns[0], columns[3], columns[4], columns[5], columns[6]
+        percent = [promotion_type in PERCENT_TYPES for promotion_type in types]
+        if self.vectorized:
+            amounts = numpy.array(amounts, dtype=numpy.float64)
+            self.ids = numpy.array(ids, dtype=numpy.int64)
+            self.starts = numpy.array(start_dates, dtype="datetime64[us]").astype(numpy.int64) / 1e6
+            self.ends = numpy.array(end_dates, dtype="datetime64[us]").astype(numpy.int64) / 1e6
+            self.percent = numpy.array(percent, dtype=bool)
+            self.rates = numpy.clip(amounts, 0.0, 100.0)
+            self.cents = numpy.floor(numpy.maximum(amounts, 0.0) * 100 + 0.5).astype(numpy.int64)
+        else:
+            self.ids = list(ids)
+            self.starts = [to_seconds(start_date) for start_date in start_dates]
+            self.ends = [to_seconds(end_date) for end_date in end_dates]
+            self.percent = percent
+            self.rates = [min(max(amount, 0.0), 100.0) for amount in amounts]
+            self.cents = [to_cents(max(amount, 0.0)) for amount in amounts]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def discounts(self, subtotal: int, at: datetime, limit=None) -> tuple:
+        """Returns how many Promotions run at `at`, and the indexes of the limit of them that take
+        the most off subtotal with the cents each one takes
+
+        The biggest discount comes first, and equal discounts are in id order.
+        """
+        if self.vectorized:
+            return self._discounts_numpy(subtotal, to_seconds(at), limit)
+        return self._discounts_python(subtotal, to_seconds(at), limit)
+
+    def _discounts_numpy(self, subtotal: int, at: float, limit) -> tuple:
+        running = numpy.flatnonzero((self.starts <= at) & (self.ends >= at))
+        count = len(running)
+        percent_off = numpy.floor(subtotal * self.rates[running] / 100 + 0.5).astype(numpy.int64)
+        discount = numpy.where(self.percent[running], percent_off, numpy.minimum(self.cents[running], subtotal))
+        if limit is not None and limit < count:
+            # the limit biggest discounts, the first ones in id order among those equal to the smallest of them
+            threshold = numpy.partition(discount, count - limit)[count - limit]
+            bigger = numpy.flatnonzero(discount > threshold)
+            keep = numpy.concatenate((bigger, numpy.flatnonzero(discount == threshold)[:limit - len(bigger)]))
+            keep.sort()
+            running, discount = running[keep], discount[keep]
+        # running is in id order, so one sort of (subtotal - discount, position) orders by discount then id
+        size = max(len(running), 1)
+        if subtotal < (2**62) // size:
+            order = numpy.sort((subtotal - discount) * size + numpy.arange(len(running))) % size
+        else:
+            order = numpy.lexsort((numpy.arange(len(running)), -discount))
+        return count, running[order].tolist(), discount[order].tolist()
+
+    def _discounts_python(self, subtotal: int, at: float, limit) -> tuple:
+        found = []
+        for index, (start, end) in enumerate(zip(self.starts, self.ends)):
+            if start <= at <= end:
+                if self.percent[index]:
+                    discount = math.floor(subtotal * self.rates[index] / 100 + 0.5)
+                else:
+                    discount = min(self.cents[index], subtotal)
+                found.append((-discount, self.ids[index], index))
+        found.sort()
+        return len(found), [index for _, _, index in found[:limit]], [-discount for discount, _, _ in found[:limit]]
+
+
+class CartEvaluator:
+    """Evaluates carts against a snapshot of the active Promotions that is rebuilt when it goes stale"""
+
+    def __init__(self):
+        self.ttl = 5.0
+        self._snapshot = None
+        self._built_at = None
+        self._generation = 0
+        self._built_generation = -1
+        self._lock = threading.Lock()
+        self._stats = {"evaluations": 0, "rebuilds": 0, "last_rebuild_ms": 0.0}
+
+    def init_app(self, app):
+        """Configures the evaluator from the app config"""
+        self.ttl = app.config["EVALUATE_SNAPSHOT_TTL"]
+        if numpy is None:  # pragma: no cover
+            logger.warning("NumPy is not installed, carts are evaluated over lists, which is much slower")
+        self._snapshot = None
+        self._built_at = None
+        self._stats = {"evaluations": 0, "rebuilds": 0, "last_rebuild_ms": 0.0}
+        self.invalidate()
+
+    @property
+    def built(self) -> bool:
+        """True once a cart was evaluated"""
+        return self._snapshot is not None
+
+    def evaluate(self, prices, quantities, at: datetime, limit=None) -> dict:
+        """
+        Returns the subtotal of a cart and the discount of every Promotion running at `at`
+
+        Args:
+            prices (list): the unit price of each line of the cart
+            quantities (list): the quantity of each line of the cart
+            at (datetime): the naive UTC time of the cart
+            limit (int): the most discounts to return, the biggest ones, or None for all of them
+        """
+        snapshot = self._current()
+        subtotal = subtotal_cents(prices, quantities, snapshot.vectorized)
+        count, indexes, discounts = snapshot.discounts(subtotal, at, limit)
+        self._stats["evaluations"] += 1
+        results = []
+        for index, discount in zip(indexes, discounts):
+            row = snapshot.rows[index]
+            results.append(
+                {
+                    "id": row.id,
+                    "promotion_id": row.promotion_id,
+                    "name": row.name,
+                    "promotion_type": row.promotion_type,
+                    "promotion_amount": row.promotion_amount,
+                    "discount": discount / 100,
+                }
+            )
+        return {"at": at, "subtotal": subtotal / 100, "count": count, "discounts": results}
+
+    def invalidate(self):
+        """Forces a rebuild on the next evaluation after this process changed a Promotion"""
+        self._generation += 1
+
+    def stats(self) -> dict:
+        """Returns how big and how old the snapshot is"""
+        age = time.monotonic() - self._built_at if self._built_at is not None else 0.0
+        return {
+            "promotions": len(self._snapshot) if self._snapshot is not None else 0,
+            "vectorized": self._snapshot.vectorized if self._snapshot is not None else numpy is not None,
+            "age_seconds": round(age, 3),
+            **self._stats,
+        }
+
+    def _current(self) -> Snapshot:
+        """Returns the snapshot, rebuilding it first if it is older than the ttl
+
+        While one thread rebuilds it, the others keep evaluating against the old one.
+        """
+        if not self._stale():
+            return self._snapshot
+        if not self._lock.acquire(blocking=self._snapshot is None):
+            return self._snapshot
+        try:
+            if self._stale():
+                start = time.perf_counter()
+                built_at, generation = time.monotonic(), self._generation
+                self._snapshot = Snapshot(Promotion.active_terms())
+                self._built_at, self._built_generation = built_at, generation
+                self._stats["rebuilds"] += 1
+                self._stats["last_rebuild_ms"] = round((time.perf_counter() - start) * 1000, 3)
+                logger.info("Rebuilt cart evaluation snapshot with %d promotions", len(self._snapshot))
+        finally:
+            self._lock.release()
+        return self._snapshot
+
+    def _stale(self) -> bool:
+        """Checks if a Promotion changed or the ttl ran out since the last rebuild"""
+        if self._built_generation != self._generation:
+            return True
+        return time.monotonic() - self._built_at >= self.ttl
+
+
+cart_evaluator = CartEvaluator()
@@ -0,0 +1,164 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Interval Tree
+
+A static centered interval tree that answers "which intervals contain
+this point" in O(log n + k), and the LiveIndex that keeps one over the
+start_date/end_date of every Promotion so active_at lookups do not have
+to scan the promotion table.
+"""
+import logging
+import threading
+import time
+
+from service.models import Promotion
+
+logger = logging.getLogger("flask.app")
+
+
+class _Node:  # pylint: disable=too-few-public-methods
+    """The intervals that contain the center point of a subtree"""
+
+    __slots__ = ("center", "by_start", "by_end", "left", "right")
+
+    def __init__(self, center, intervals):
+        self.center = center
+        self.by_start = sorted(intervals, key=lambda interval: interval[0])
+        self.by_end = sorted(intervals, key=lambda interval: interval[1], reverse=True)
+        self.left = None
+        self.right = None
+
+
+class IntervalTree:
+    """Immutable set of closed [start, end] intervals that can be stabbed with a point"""
+
+    def __init__(self, intervals=()):
+        """
+        Builds the tree
+
+        Args:
+            intervals (iterable): (start, end, value) tuples with start <= end
+        """
+        intervals = [interval for interval in intervals if interval[0] <= interval[1]]
+        self.size = len(intervals)
+        self.root = self._build(intervals)
+
+    def _build(self, intervals):
+        """Builds the subtree for intervals around the median of their endpoints"""
+        if not intervals:
+            return None
+        endpoints = sorted(point for interval in intervals for point in interval[:2])
+        center = endpoints[len(endpoints) // 2]
+        left = [interval for interval in intervals if interval[1] < center]
+        right = [interval for interval in intervals if interval[0] > center]
+        node = _Node(center, [interval for interval in intervals if interval[0] <= center <= interval[1]])
+        node.left = self._build(left)
+        node.right = self._build(right)
+        return node
+
+    def __len__(self):
+        return self.size
+
+    def at(self, point) -> list:
+        """Returns the values of every interval that contains point"""
+        found = []
+        node = self.root
+        while node is not None:
+            if point < node.center:
+                # every interval here ends at or after the center, so only the start matters
+                for start, _, value in node.by_start:
+                    if start > point:
+                        break
+                    found.append(value)
+                node = node.left
+            elif point > node.center:
+                for _, end, value in node.by_end:
+                    if end < point:
+                        break
+                    found.append(value)
+                node = node.right
+            else:
+                found.extend(value for _, _, value in node.by_start)
+                break
+        return found
+
+
+class LiveIndex:
+    """Interval tree over the Promotion schedule that is rebuilt when it goes stale"""
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.ttl = 5.0
+        self.max_ids = 1000
+        self._tree = IntervalTree()
+        self._built_at = None
+        self._generation = 0
+        self._built_generation = -1
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "rebuilds": 0, "last_rebuild_ms": 0.0}
+
+    def init_app(self, app):
+        """Configures the index from the app config"""
+        self.app = app
+        self.enabled = app.config["LIVE_INDEX_ENABLED"]
+        self.ttl = app.config["LIVE_INDEX_TTL"]
+        self.max_ids = app.config["LIVE_INDEX_MAX_IDS"]
+        self._stats = {"hits": 0, "rebuilds": 0, "last_rebuild_ms": 0.0}
+        self.invalidate()
+
+    def ids_at(self, when) -> list:
+        """Returns the ids of the Promotions that are running at when, in order"""
+        tree = self._current()
+        self._stats["hits"] += 1
+        return sorted(tree.at(when))
+
+    def invalidate(self):
+        """Forces a rebuild on the next lookup after this process changed a schedule"""
+        self._generation += 1
+
+    def stats(self) -> dict:
+        """Returns how big and how old the index is"""
+        age = time.monotonic() - self._built_at if self._built_at is not None else 0.0
+        return {"intervals": len(self._tree), "age_seconds": round(age, 3), **self._stats}
+
+    def _current(self) -> IntervalTree:
+        """Returns the tree, rebuilding it first if it is older than the ttl"""
+        if not self._stale():
+            return self._tree
+        with self._lock:
+            if self._stale():
+                start = time.perf_counter()
+                built_at, generation = time.monotonic(), self._generation
+                self._tree = IntervalTree(
+                    (start_date, end_date, by_id) for by_id, start_date, end_date in Promotion.schedule()
+                )
+                self._built_at, self._built_generation = built_at, generation
+                self._stats["rebuilds"] += 1
+                self._stats["last_rebuild_ms"] = round((time.perf_counter() - start) * 1000, 3)
+                logger.info("Rebuilt live index with %d promotions", len(self._tree))
+        return self._tree
+
+    def _stale(self) -> bool:
+        """Checks if a schedule changed or the ttl ran out since the last rebuild"""
+        if self._built_generation != self._generation:
+            return True
+        return time.monotonic() - self._built_at >= self.ttl
+
+
+live_index = LiveIndex()
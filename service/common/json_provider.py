@@ -0,0 +1,78 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+JSON Provider
+
+Flask JSON provider that encodes datetimes as ISO 8601 and enums as
+their values, so models can serialize to raw Python values. It uses
+orjson, which the service image installs, and falls back to the standard
+library where orjson is missing.
+"""
+from datetime import date
+from enum import Enum
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj):
+    """Encodes the types the standard library json module does not know"""
+    if isinstance(obj, date):
+        return obj.isoformat()
+    if isinstance(obj, Enum):
+        return obj.value
+    return DefaultJSONProvider.default(obj)
+
+
+class PromotionJSONProvider(DefaultJSONProvider):
+    """JSON provider that is backed by orjson when it is available"""
+
+    default = staticmethod(_default)
+
+    def _options(self, kwargs) -> int:
+        """Returns the orjson options that match the json.dumps keyword arguments"""
+        options = orjson.OPT_NON_STR_KEYS
+        if kwargs.get("sort_keys", self.sort_keys):
+            options |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs) -> str:
+        """Serializes obj to a JSON string"""
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._options(kwargs)).decode()
+
+    def loads(self, s, **kwargs):
+        """Deserializes a JSON string or bytes"""
+        if orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Returns a JSON response without decoding orjson's bytes to a string and back"""
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        options = {"indent": 2} if (self.compact is None and self._app.debug) or self.compact is False else {}
+        body = orjson.dumps(obj, default=self.default, option=self._options(options) | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
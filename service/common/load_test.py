@@ -0,0 +1,273 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Load Generator
+
+Drives a weighted mix of list, get, create, apply and cancel requests at
+the service, either a running one at a URL or the app in process through
+the Flask test client, from a number of worker threads. With a target
+rate the requests are scheduled open loop and their latency counts from
+the time they were due, so a slow service cannot hide its queueing.
+
+Writes only ever touch promotions the run created itself: it creates a
+set of fixtures to get, apply and cancel, and deletes them along with
+everything else it created when it ends, so existing promotions keep
+their usage counts and states.
+"""
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from urllib import error, request as urlrequest
+
+OPERATIONS = ("list", "get", "create", "apply", "cancel")
+DEFAULT_MIX = "list=50,get=30,create=10,apply=8,cancel=2"
+PERCENTILES = (50, 90, 95, 99, 99.9)
+PROMOTION_TYPES = ("DISCOUNT", "FLASH", "COUPON")
+
+
+def parse_mix(mix: str) -> dict:
+    """Parses "list=50,get=30" into operation weights, raising ValueError on a bad mix"""
+    weights = {}
+    for part in filter(None, (part.strip() for part in mix.split(","))):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{name}', use {', '.join(OPERATIONS)}")
+        weights[name] = float(weight or 1)
+    if not weights or sum(weights.values()) <= 0:
+        raise ValueError("The mix needs at least one operation with a positive weight")
+    return weights
+
+
+def percentile(samples: list, rank: float) -> float:
+    """Returns the nearest-rank percentile of sorted samples"""
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, max(0, math.ceil(rank / 100 * len(samples)) - 1))]
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    """Returns the throughput and latency distribution of latency samples in milliseconds"""
+    samples = sorted(samples)
+    summary = {"requests": len(samples), "rps": round(len(samples) / elapsed, 1) if elapsed else 0.0}
+    summary.update({f"p{value:g}_ms": round(percentile(samples, value), 3) for value in PERCENTILES})
+    summary["max_ms"] = round(samples[-1], 3) if samples else 0.0
+    return summary
+
+
+def promotion_payload(chooser: random.Random) -> dict:
+    """Returns a new promotion to create"""
+    start = datetime.now().replace(microsecond=0) - timedelta(days=chooser.randint(0, 30))
+    return {
+        "name": f"Load test {chooser.randint(1, 9999)}",
+        "promotion_id": f"LOAD-{uuid.uuid4().hex[:16]}",
+        "start_date": start.isoformat(),
+        "end_date": (start + timedelta(days=chooser.randint(1, 90))).isoformat(),
+        "promotion_type": chooser.choice(PROMOTION_TYPES),
+        "promotion_amount": round(chooser.uniform(1, 50), 2),
+        "promotion_description": "Created by flask load-test",
+        "state": "active",
+    }
+
+
+######################################################################
+# Transports
+######################################################################
+
+
+class ClientTransport:  # pylint: disable=too-few-public-methods
+    """Sends requests to the app in process through the Flask test client"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def send(self, method: str, path: str, body=None):
+        """Returns the status code and JSON body of a request"""
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        resp = client.open(path, method=method, json=body)
+        return resp.status_code, resp.get_json(silent=True)
+
+
+class HttpTransport:  # pylint: disable=too-few-public-methods
+    """Sends requests to a running service over HTTP"""
+
+    def __init__(self, url: str, timeout: float = 30.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def send(self, method: str, path: str, body=None):
+        """Returns the status code and JSON body of a request"""
+        data = json.dumps(body).encode() if body is not None else None
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        req = urlrequest.Request(self.url + path, data=data, method=method, headers=headers)
+        try:
+            with urlrequest.urlopen(req, timeout=self.timeout) as resp:
+                return resp.status, _json(resp.read())
+        except error.HTTPError as http_error:
+            return http_error.code, _json(http_error.read())
+
+
+def _json(payload: bytes):
+    try:
+        return json.loads(payload) if payload else None
+    except ValueError:
+        return None
+
+
+######################################################################
+# Load generator
+######################################################################
+
+
+class LoadTest:  # pylint: disable=too-many-instance-attributes
+    """Runs a mix of requests against a transport and collects their latencies"""
+
+    def __init__(self, transport, mix: dict, concurrency: int = 4, rps: float = 0.0, seed=None):
+        # pylint: disable=too-many-arguments
+        self.transport = transport
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.concurrency = max(1, concurrency)
+        self.rps = rps
+        self.seed = seed
+        self.ids = []  # the fixtures to get, apply and cancel
+        self.created = []  # promotions created by requests that were not canceled yet
+        self.owned = []  # everything this run created, deleted when it ends
+        self._lock = threading.Lock()
+        self._issued = 0
+        self._samples = {name: [] for name in self.operations}
+        self._statuses = {name: Counter() for name in self.operations}
+        self._errors = Counter()
+
+    def prepare(self, chooser: random.Random, fixtures: int = 10):
+        """Creates the promotions to get, apply and cancel, so the run never writes to existing ones"""
+        while len(self.ids) < fixtures:
+            code, body = self.transport.send("POST", "/promotions", promotion_payload(chooser))
+            if code != 201:
+                raise RuntimeError(f"Cannot create promotions to load test with, POST /promotions returned {code}")
+            self.ids.append(body["id"])
+            self.owned.append(body["id"])
+
+    def cleanup(self) -> int:
+        """Deletes every promotion this run created and returns how many were deleted"""
+        deleted = 0
+        while self.owned:
+            try:
+                code, _ = self.transport.send("DELETE", f"/promotions/{self.owned.pop()}")
+            except (OSError, error.URLError):
+                code = None
+            deleted += code == 204
+        return deleted
+
+    def request(self, name: str, chooser: random.Random):
+        """Sends one request of an operation and returns its status code"""
+        if name == "list":
+            return self.transport.send("GET", "/promotions?limit=20")[0]
+        if name == "get":
+            return self.transport.send("GET", f"/promotions/{chooser.choice(self.ids)}")[0]
+        if name == "create":
+            code, body = self.transport.send("POST", "/promotions", promotion_payload(chooser))
+            if code == 201:
+                with self._lock:
+                    self.created.append(body["id"])
+                    self.owned.append(body["id"])
+            return code
+        if name == "apply":
+            return self.transport.send("PUT", f"/promotions/{chooser.choice(self.ids)}/apply")[0]
+        with self._lock:
+            # canceling only works once, so cancel what the requests created before the fixtures
+            promotion_id = self.created.pop() if self.created else chooser.choice(self.ids)
+        return self.transport.send("PUT", f"/promotions/{promotion_id}/cancel")[0]
+
+    def _next_slot(self, start: float, stop: float, limit: int):
+        """Returns the time the next request is due, None when the run is over"""
+        with self._lock:
+            if limit and self._issued >= limit:
+                return None
+            due = start + self._issued / self.rps if self.rps else time.perf_counter()
+            if due >= stop:
+                return None
+            self._issued += 1
+            return due
+
+    def _worker(self, number: int, start: float, stop: float, limit: int):
+        chooser = random.Random(None if self.seed is None else self.seed + number)
+        while True:
+            due = self._next_slot(start, stop, limit)
+            if due is None:
+                return
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            name = chooser.choices(self.operations, self.weights)[0]
+            try:
+                code = self.request(name, chooser)
+            except (OSError, error.URLError) as failure:
+                code = None
+                with self._lock:
+                    self._errors[type(failure).__name__] += 1
+            elapsed = (time.perf_counter() - due) * 1000
+            with self._lock:
+                self._samples[name].append(elapsed)
+                self._statuses[name][str(code)] += 1
+
+    def run(self, duration: float = 10.0, requests: int = 0) -> dict:
+        """Runs until duration seconds have passed or requests were sent, and returns the report
+
+        The promotions the run created are deleted at the end, even when it fails.
+        """
+        try:
+            self.prepare(random.Random(self.seed))
+            start = time.perf_counter()
+            stop = start + duration if duration else float("inf")
+            workers = [
+                threading.Thread(target=self._worker, args=(number, start, stop, requests), daemon=True)
+                for number in range(self.concurrency)
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            deleted = self.cleanup()
+        return {**self.report(elapsed), "deleted": deleted}
+
+    def report(self, elapsed: float) -> dict:
+        """Returns the results by operation and overall"""
+        operations = {}
+        for name in self.operations:
+            statuses = self._statuses[name]
+            failed = sum(count for code, count in statuses.items() if code == "None" or code.startswith("5"))
+            operations[name] = {**summarize(self._samples[name], elapsed), "failed": failed, "statuses": dict(statuses)}
+        everything = [sample for samples in self._samples.values() for sample in samples]
+        total = summarize(everything, elapsed)
+        total["failed"] = sum(operation["failed"] for operation in operations.values())
+        return {
+            "settings": {"concurrency": self.concurrency, "target_rps": self.rps, "seed": self.seed},
+            "elapsed_s": round(elapsed, 3),
+            "total": total,
+            "operations": operations,
+            "errors": dict(self._errors),
+        }
@@ -0,0 +1,296 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Request Metrics
+
+Counts requests by route and status code and keeps latency, queue time
+and database time histograms in a fixed array of doubles. With METRICS_DIR
+set, every worker process maps its array from a file in that directory and
+GET /metrics adds up the files of all the workers on the node, so the
+numbers are right under gunicorn. Each request costs a few array updates
+under one lock.
+"""
+import glob
+import mmap
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from flask import request
+
+from service.common.query_log import query_log
+
+# Flask endpoint of each route that is reported on its own, everything else is "other"
+ROUTES = {
+    "list_promotions": "list",
+    "get_promotions": "get",
+    "create_promotions": "create",
+    "update_promotion": "update",
+    "apply_promotion": "apply",
+    "cancel_promotion": "cancel",
+    "delete_promotions": "delete",
+    "create_promotions_bulk": "bulk",
+    "change_promotions_state": "state",
+    "evaluate_cart": "evaluate",
+}
+ROUTE_LABELS = tuple(dict.fromkeys(ROUTES.values())) + ("other",)
+STATUS_CODES = (200, 201, 202, 204, 304, 400, 404, 405, 409, 412, 415, 422, 429, 500, 503)
+CODE_LABELS = tuple(str(code) for code in STATUS_CODES) + ("other",)
+
+# HDR style log-linear bucket bounds in seconds, from 10us to 80s with at most 25% error
+BUCKETS = tuple(
+    float(f"{mantissa}e{exponent}")
+    for exponent in range(-5, 2)
+    for mantissa in (1, 1.2, 1.5, 2, 2.5, 3, 4, 5, 6, 8)
+)
+QUANTILES = (0.5, 0.95, 0.99)
+
+_ROUTE_INDEX = {endpoint: ROUTE_LABELS.index(label) for endpoint, label in ROUTES.items()}
+_CODE_INDEX = {code: index for index, code in enumerate(STATUS_CODES)}
+_HISTOGRAM = len(BUCKETS) + 2  # bucket counts, the +Inf bucket and the sum
+
+# offsets of each metric in the array of doubles
+REQUESTS = 0
+LATENCY = REQUESTS + len(ROUTE_LABELS) * len(CODE_LABELS)
+DB_TIME = LATENCY + len(ROUTE_LABELS) * _HISTOGRAM
+QUEUE_TIME = DB_TIME + len(ROUTE_LABELS) * _HISTOGRAM
+IN_FLIGHT = QUEUE_TIME + _HISTOGRAM
+SIZE = IN_FLIGHT + 1
+
+
+def request_start(header: str):
+    """Returns the epoch seconds in an X-Request-Start header, None if it has none
+
+    Proxies send seconds (nginx "t=1700000000.123"), milliseconds or microseconds
+    """
+    try:
+        value = float(header.strip().removeprefix("t="))
+    except (AttributeError, ValueError):
+        return None
+    if value > 1e14:
+        return value / 1e6
+    if value > 1e11:
+        return value / 1e3
+    return value
+
+
+def quantile(counts, fraction: float) -> float:
+    """Estimates a quantile from non-cumulative bucket counts, the last one being +Inf"""
+    total = sum(counts)
+    if not total:
+        return 0.0
+    rank = fraction * total
+    seen = 0.0
+    for index, count in enumerate(counts):
+        if count and seen + count >= rank:
+            if index == len(BUCKETS):
+                return BUCKETS[-1]
+            lower = BUCKETS[index - 1] if index else 0.0
+            return lower + (BUCKETS[index] - lower) * (rank - seen) / count
+        seen += count
+    return BUCKETS[-1]  # pragma: no cover
+
+
+def _number(value: float) -> str:
+    """Formats a sample value the way the Prometheus text format expects"""
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class RequestMetrics:
+    """Per-process request metrics that add up across the workers sharing METRICS_DIR"""
+
+    def __init__(self):
+        self.enabled = False
+        self.directory = ""
+        self._pid = None
+        self._values = None
+        self._mmap = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def init_app(self, app):
+        """Configures the metrics from the app config and times every request"""
+        self.enabled = app.config["METRICS_ENABLED"]
+        self.directory = app.config["METRICS_DIR"]
+        self._pid = None
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    ######################################################################
+    # Storage
+    ######################################################################
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"metrics_{pid}.db")
+
+    def values(self):
+        """Returns the array of doubles of this process, mapping it after a fork"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._open(os.getpid())
+        return self._values
+
+    def _open(self, pid: int):
+        if not self.directory:
+            self._values = memoryview(bytearray(SIZE * 8)).cast("d")
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(pid), "a+b") as file:
+                if os.fstat(file.fileno()).st_size < SIZE * 8:
+                    file.truncate(SIZE * 8)
+                self._mmap = mmap.mmap(file.fileno(), SIZE * 8)
+            self._values = memoryview(self._mmap).cast("d")
+        self._pid = pid
+
+    def collect(self) -> array:
+        """Returns the sum of the arrays of every process sharing the directory"""
+        if not self.directory:
+            return array("d", self.values())
+        self.values()
+        total = array("d", bytes(SIZE * 8))
+        for path in glob.glob(os.path.join(self.directory, "metrics_*.db")):
+            with open(path, "rb") as file:
+                data = array("d", file.read(SIZE * 8))
+            for index, value in enumerate(data):
+                total[index] += value
+        return total
+
+    def mark_process_dead(self, pid: int):
+        """Zeroes the in-flight requests of a worker that exited, its counters stay"""
+        path = self._path(pid)
+        if not self.directory or not os.path.exists(path):
+            return
+        with open(path, "r+b") as file:
+            file.seek(IN_FLIGHT * 8)
+            file.write(bytes(8))
+
+    ######################################################################
+    # Instrumentation
+    ######################################################################
+
+    # pylint: disable-next=too-many-arguments
+    def observe(self, route: int, code: int, seconds: float, db_seconds: float, queue_seconds=None, finished=False):
+        """Records one served request, finished also takes it off the in-flight gauge"""
+        values = self.values()
+        code_index = _CODE_INDEX.get(code, len(STATUS_CODES))
+        latency = LATENCY + route * _HISTOGRAM
+        db_time = DB_TIME + route * _HISTOGRAM
+        with self._lock:
+            values[REQUESTS + route * len(CODE_LABELS) + code_index] += 1
+            values[latency + bisect_left(BUCKETS, seconds)] += 1
+            values[latency + _HISTOGRAM - 1] += seconds
+            values[db_time + bisect_left(BUCKETS, db_seconds)] += 1
+            values[db_time + _HISTOGRAM - 1] += db_seconds
+            if finished:
+                values[IN_FLIGHT] -= 1
+            if queue_seconds is not None:
+                values[QUEUE_TIME + bisect_left(BUCKETS, queue_seconds)] += 1
+                values[QUEUE_TIME + _HISTOGRAM - 1] += queue_seconds
+
+    def _in_flight(self, change: int):
+        values = self.values()
+        with self._lock:
+            values[IN_FLIGHT] += change
+
+    def _before_request(self):
+        self._in_flight(1)
+        self._local.start = time.perf_counter()
+
+    def _after_request(self, response):
+        # thread locals, not flask.g: every context proxy lookup costs a microsecond or more
+        start = self._local.start
+        if start is not None:
+            self._local.start = None
+            current = request._get_current_object()  # pylint: disable=protected-access
+            queued = request_start(current.environ.get("HTTP_X_REQUEST_START"))
+            self.observe(
+                _ROUTE_INDEX.get(current.endpoint, len(ROUTE_LABELS) - 1),
+                response.status_code,
+                time.perf_counter() - start,
+                query_log.request_seconds(),
+                None if queued is None else max(0.0, time.time() - queued),
+                finished=True,
+            )
+        return response
+
+    def _teardown_request(self, _error):
+        if getattr(self._local, "start", None) is not None:
+            self._local.start = None
+            self._in_flight(-1)
+
+    ######################################################################
+    # Exposition
+    ######################################################################
+
+    def render(self) -> str:
+        """Returns the metrics of every worker in the Prometheus text format"""
+        values = self.collect()
+        lines = [
+            "# HELP promotions_requests_total Requests served by route and status code",
+            "# TYPE promotions_requests_total counter",
+        ]
+        for route, route_label in enumerate(ROUTE_LABELS):
+            for code, code_label in enumerate(CODE_LABELS):
+                count = values[REQUESTS + route * len(CODE_LABELS) + code]
+                if count:
+                    lines.append(f'promotions_requests_total{{route="{route_label}",code="{code_label}"}} {_number(count)}')
+        lines += [
+            "# HELP promotions_requests_in_flight Requests being served right now",
+            "# TYPE promotions_requests_in_flight gauge",
+            f"promotions_requests_in_flight {_number(values[IN_FLIGHT])}",
+        ]
+        self._render_histogram(lines, "promotions_request_duration_seconds", "Request latency by route", values, LATENCY)
+        self._render_histogram(lines, "promotions_request_db_seconds", "Database time per request by route", values, DB_TIME)
+        self._render_histogram(
+            lines, "promotions_request_queue_seconds", "Time from X-Request-Start to the worker", values, QUEUE_TIME, False
+        )
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_histogram(lines, name, description, values, offset, by_route=True):  # pylint: disable=too-many-arguments
+        """Appends a histogram and its p50/p95/p99 estimates to lines"""
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+        estimates = []
+        for route, route_label in enumerate(ROUTE_LABELS if by_route else ("",)):
+            start = offset + route * _HISTOGRAM
+            counts = values[start:start + len(BUCKETS) + 1]
+            total = sum(counts)
+            if not total:
+                continue
+            label = f'route="{route_label}",' if by_route else ""
+            cumulative = 0.0
+            for bound, count in zip(BUCKETS + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{name}_bucket{{{label}le="{le}"}} {_number(cumulative)}')
+            series = f"{{{label.rstrip(',')}}}" if by_route else ""
+            lines.append(f"{name}_sum{series} {_number(values[start + _HISTOGRAM - 1])}")
+            lines.append(f"{name}_count{series} {_number(total)}")
+            for fraction in QUANTILES:
+                estimates.append(f'{name}_quantile{{{label}quantile="{fraction}"}} {quantile(counts, fraction)!r}')
+        if estimates:
+            lines += [f"# HELP {name}_quantile Quantiles estimated from the buckets", f"# TYPE {name}_quantile gauge"]
+            lines += estimates
+
+
+request_metrics = RequestMetrics()
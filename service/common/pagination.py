@@ -0,0 +1,45 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Keyset Pagination
+
+This module contains utility functions to encode and decode the opaque
+cursor tokens used to page through collections by primary key
+"""
+import base64
+import binascii
+import json
+
+
+def encode_cursor(last_id: int) -> str:
+    """Returns an opaque cursor that resumes a listing after last_id"""
+    payload = json.dumps({"id": last_id}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """Returns the last seen id from a cursor, raises ValueError if it is malformed"""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        last_id = payload["id"]
+    except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError) as error:
+        raise ValueError(f"Invalid cursor: {cursor}") from error
+
+    if not isinstance(last_id, int) or isinstance(last_id, bool) or last_id < 0:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return last_id
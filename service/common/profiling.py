@@ -0,0 +1,227 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Request Profiler
+
+Opt-in profiling of single requests. A request is profiled when it sends
+PROFILE_SECRET in the X-Profile header or the profile query parameter, or
+when it is picked at PROFILE_SAMPLE_RATE. The whole WSGI request runs under
+cProfile, or pyinstrument when it is installed and PROFILE_BACKEND asks for
+it, and the profile is written to PROFILE_DIR. With X-Profile-Format or
+profile_format set to "collapsed" the response is replaced by collapsed
+stacks for flamegraph tools instead. The app never sees the profile and
+profile_format query parameters. When neither a secret nor a sample rate
+is configured the app is not wrapped at all.
+"""
+import cProfile
+import hmac
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from urllib.parse import parse_qs, unquote_plus
+
+try:
+    from pyinstrument import Profiler as InstrumentProfiler
+except ImportError:  # pragma: no cover
+    InstrumentProfiler = None
+
+logger = logging.getLogger("flask.app")
+
+MAX_DEPTH = 128
+MIN_SECONDS = 1e-6  # stacks that took less are left out of the collapsed output
+QUERY_PARAMETERS = ("profile", "profile_format")  # taken out of the query string before the app sees it
+
+
+def _label(func) -> str:
+    """Returns a frame label for a pstats function key that is safe in collapsed stacks"""
+    filename, line, name = func
+    if filename == "~":
+        return name.replace(";", ":")
+    return f"{name} ({os.path.basename(filename)}:{line})".replace(";", ":")
+
+
+def collapsed_stacks(stats: pstats.Stats) -> str:
+    """Turns a cProfile call graph into collapsed stacks with microsecond weights
+
+    cProfile only records caller and callee pairs, so the time of a function is
+    split over its callers in proportion to the time each call edge took.
+    """
+    entries = stats.stats  # pylint: disable=no-member
+    callees = defaultdict(dict)
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees[caller][func] = edge[3]
+    weights = Counter()
+
+    def walk(func, stack, on_stack, share):
+        own_time = entries[func][2]
+        stack = stack + (_label(func),)
+        weights[";".join(stack)] += own_time * share
+        if len(stack) >= MAX_DEPTH:
+            return
+        for callee, edge_time in callees[func].items():
+            callee_total = entries[callee][3]
+            callee_share = share * edge_time / callee_total if callee_total else 0.0
+            if callee not in on_stack and callee_total * callee_share >= MIN_SECONDS:
+                walk(callee, stack, on_stack | {callee}, callee_share)
+
+    for root in (func for func, entry in entries.items() if not entry[4]):
+        walk(root, (), {root}, 1.0)
+    return "".join(
+        f"{stack} {round(seconds * 1e6)}\n" for stack, seconds in sorted(weights.items()) if round(seconds * 1e6) > 0
+    )
+
+
+def without_profile_parameters(query: str) -> str:
+    """Returns a query string without the profiler's own parameters, the others as they were sent"""
+    return "&".join(
+        part for part in query.split("&") if part and unquote_plus(part.split("=", 1)[0]) not in QUERY_PARAMETERS
+    )
+
+
+class RequestProfiler:
+    """Profiles the requests that ask for it or are sampled, and nothing else"""
+
+    def __init__(self):
+        self.secret = ""
+        self.sample_rate = 0.0
+        self.directory = ""
+        self.backend = "cprofile"
+        self._lock = threading.Lock()
+        self._stats = {"profiled": 0, "sampled": 0}
+
+    def init_app(self, app):
+        """Configures the profiler and wraps the WSGI app when profiling is possible"""
+        self.secret = app.config["PROFILE_SECRET"]
+        self.sample_rate = app.config["PROFILE_SAMPLE_RATE"]
+        self.directory = app.config["PROFILE_DIR"]
+        self.backend = app.config["PROFILE_BACKEND"]
+        if self.backend == "pyinstrument" and InstrumentProfiler is None:  # pragma: no cover
+            logger.warning("pyinstrument is not installed, profiling with cProfile")
+            self.backend = "cprofile"
+        if self.secret or self.sample_rate > 0:
+            app.wsgi_app = self.wrap(app.wsgi_app)
+
+    @property
+    def enabled(self) -> bool:
+        """True when requests can be profiled"""
+        return bool(self.secret) or self.sample_rate > 0
+
+    def stats(self) -> dict:
+        """Returns how many requests were profiled"""
+        with self._lock:
+            return dict(self._stats)
+
+    def requested(self, environ) -> str:
+        """Returns "flag" or "sample" when a request should be profiled, "" otherwise"""
+        if self.secret:
+            token = environ.get("HTTP_X_PROFILE")
+            query = environ.get("QUERY_STRING", "")
+            if token is None and "profile=" in query:
+                token = parse_qs(query).get("profile", [None])[0]
+            if token is not None and hmac.compare_digest(token.encode(), self.secret.encode()):
+                return "flag"
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sample"
+        return ""
+
+    def wrap(self, wsgi_app):
+        """Returns a WSGI app that profiles the requests that ask for it"""
+
+        def profiled_app(environ, start_response):
+            reason = self.requested(environ)
+            if not reason:
+                return wsgi_app(environ, start_response)
+            return self.profile(wsgi_app, environ, start_response, reason)
+
+        return profiled_app
+
+    def profile(self, wsgi_app, environ, start_response, reason):
+        """Runs one request under the profiler and writes or returns the profile"""
+        response = {}
+        body = []
+
+        def capture(status, headers, exc_info=None):  # pylint: disable=unused-argument
+            response.update(status=status, headers=list(headers))
+            return body.append
+
+        collapsed = reason == "flag" and self._wants_collapsed(environ)
+        # the app would reject or misread parameters it does not know, and the profile would show that instead
+        environ["QUERY_STRING"] = without_profile_parameters(environ.get("QUERY_STRING", ""))
+        profiler = InstrumentProfiler() if self.backend == "pyinstrument" else cProfile.Profile()
+        start = time.perf_counter()
+        with profiler:
+            app_iter = wsgi_app(environ, capture)
+            try:
+                body.extend(app_iter)
+            finally:
+                if hasattr(app_iter, "close"):
+                    app_iter.close()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            self._stats["profiled" if reason == "flag" else "sampled"] += 1
+        if collapsed:
+            start_response(
+                "200 OK",
+                [("Content-Type", "text/plain; charset=utf-8"), ("X-Profile-Status", response["status"])],
+            )
+            return [self._collapsed(profiler).encode()]
+
+        name = self._save(profiler, environ, elapsed_ms)
+        headers = response["headers"]
+        if reason == "flag":
+            headers.append(("X-Profile-File", name))
+        start_response(response["status"], headers)
+        return body
+
+    @staticmethod
+    def _wants_collapsed(environ) -> bool:
+        output = environ.get("HTTP_X_PROFILE_FORMAT")
+        if output is None:
+            output = parse_qs(environ.get("QUERY_STRING", "")).get("profile_format", [""])[0]
+        return output.lower() == "collapsed"
+
+    def _collapsed(self, profiler) -> str:
+        if self.backend == "pyinstrument":  # pragma: no cover
+            return profiler.output_text()
+        return collapsed_stacks(pstats.Stats(profiler))
+
+    def _save(self, profiler, environ, elapsed_ms: float) -> str:
+        """Writes a profile to the profile directory and returns its file name"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = re.sub(r"[^A-Za-z0-9]+", "_", environ.get("PATH_INFO", "")).strip("_") or "root"
+        method = environ.get("REQUEST_METHOD", "GET")
+        stem = f"{time.strftime('%Y%m%dT%H%M%S')}-{method}-{path}-{elapsed_ms:.0f}ms-{uuid.uuid4().hex[:8]}"
+        if self.backend == "pyinstrument":  # pragma: no cover
+            name = f"{stem}.html"
+            with open(os.path.join(self.directory, name), "w", encoding="utf-8") as file:
+                file.write(profiler.output_html())
+        else:
+            name = f"{stem}.prof"
+            profiler.dump_stats(os.path.join(self.directory, name))
+        logger.info("Profiled %s %s in %.1f ms: %s", method, environ.get("PATH_INFO"), elapsed_ms, name)
+        return name
+
+
+request_profiler = RequestProfiler()
@@ -0,0 +1,157 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Query Log
+
+Counts and times the SQL statements of every request from the SQLAlchemy
+cursor events. Each request is summarized in the debug log, and in X-SQL-*
+response headers in debug mode. A statement that runs SQL_REPEAT_THRESHOLD
+times in one request is reported as a likely N+1, and one that takes
+SQL_SLOW_QUERY_MS or longer goes to the slow query log with its parameters
+replaced by their types.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+
+from flask import request
+from sqlalchemy import event
+
+logger = logging.getLogger("flask.app")
+slow_logger = logging.getLogger("flask.app.slow_query")
+
+
+def redact(parameters, executemany: bool = False):
+    """Replaces the values of statement parameters with their type names"""
+    if executemany:
+        return f"<{len(parameters)} parameter sets>"
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+class RequestQueries:  # pylint: disable=too-few-public-methods
+    """The statements one request has run so far"""
+
+    __slots__ = ("count", "seconds", "statements")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+
+class QueryLog:
+    """Per-request SQL statement counter and slow query log"""
+
+    def __init__(self):
+        self.slow_seconds = 0.2
+        self.repeat_threshold = 10
+        self.headers = False
+        self._handler = None
+        self._local = threading.local()
+
+    def init_app(self, app, engine):
+        """Configures the log from the app config and listens to the cursor events of engine"""
+        self.slow_seconds = app.config["SQL_SLOW_QUERY_MS"] / 1000
+        self.repeat_threshold = app.config["SQL_REPEAT_THRESHOLD"]
+        self.headers = app.debug or app.config["SQL_DEBUG_HEADERS"]
+        if self._handler is not None:
+            # an app created again must not write every slow query twice
+            slow_logger.removeHandler(self._handler)
+            self._handler.close()
+            self._handler = None
+        if app.config["SQL_SLOW_QUERY_LOG"]:
+            self._handler = logging.FileHandler(app.config["SQL_SLOW_QUERY_LOG"])
+            self._handler.setFormatter(logging.Formatter("[%(asctime)s] [%(process)d] %(message)s"))
+            slow_logger.addHandler(self._handler)
+        self.watch(engine)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def watch(self, engine):
+        """Counts and times the statements of engine"""
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+
+    def current(self):
+        """Returns the statements of the request on this thread, None outside of a request"""
+        return getattr(self._local, "request", None)
+
+    def request_seconds(self) -> float:
+        """Returns the time the request on this thread has spent in SQL statements"""
+        queries = self.current()
+        return queries.seconds if queries is not None else 0.0
+
+    ######################################################################
+    # Hooks
+    ######################################################################
+
+    def _before_execute(self, *_args):
+        self._local.start = time.perf_counter()
+
+    # pylint: disable-next=too-many-arguments
+    def _after_execute(self, _conn, _cursor, statement, parameters, _context, executemany):
+        elapsed = time.perf_counter() - self._local.start
+        queries = self.current()
+        if queries is not None:
+            queries.count += 1
+            queries.seconds += elapsed
+            queries.statements[statement] += 1
+        if 0 < self.slow_seconds <= elapsed:
+            slow_logger.warning(
+                "Slow query took %.1f ms: %s parameters=%s",
+                elapsed * 1000,
+                " ".join(statement.split()),
+                redact(parameters, executemany),
+            )
+
+    def _before_request(self):
+        self._local.request = RequestQueries()
+
+    def _after_request(self, response):
+        queries = self.current()
+        if queries is None:  # pragma: no cover
+            return response
+        statement, repeats = queries.statements.most_common(1)[0] if queries.statements else ("", 0)
+        if repeats >= self.repeat_threshold:
+            logger.warning(
+                "%s %s ran the same statement %d times, a likely N+1 query: %s",
+                request.method,
+                request.path,
+                repeats,
+                " ".join(statement.split()),
+            )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "%s %s ran %d SQL statements in %.3f ms", request.method, request.path, queries.count, queries.seconds * 1000
+            )
+        if self.headers:
+            response.headers["X-SQL-Count"] = str(queries.count)
+            response.headers["X-SQL-Time-Ms"] = f"{queries.seconds * 1000:.3f}"
+            response.headers["X-SQL-Max-Repeats"] = str(repeats)
+        return response
+
+    def _teardown_request(self, _error):
+        self._local.request = None
+
+
+query_log = QueryLog()
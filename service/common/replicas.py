@@ -0,0 +1,174 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Read Replicas
+
+Routes the queries of read-only requests to the databases in
+DATABASE_REPLICA_URIS. Each GET or HEAD request takes the next healthy
+replica in turn and keeps it for all of its reads. Everything else uses
+the primary: requests with other methods, queries outside of a request,
+and every query of a request after its first write, so a request always
+reads what it wrote. A replica whose connection fails is left out for
+DATABASE_REPLICA_EJECT_SECONDS, and while every replica is out the
+primary takes their reads.
+
+Reads that fill the promotion cache always go to the primary, see
+ReplicaRouter.primary, so replica lag can never be cached for a TTL.
+"""
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+
+from service.common.db_pool import engine_options
+from service.common.query_log import query_log
+
+logger = logging.getLogger("flask.app")
+
+READ_METHODS = frozenset(("GET", "HEAD"))
+
+# where a request keeps its routing, in its WSGI environ
+PRIMARY_KEY = "promotions.db_primary"
+REPLICA_KEY = "promotions.db_replica"
+
+
+class Replica:
+    """One read replica and its health"""
+
+    def __init__(self, name: str, engine):
+        self.name = name
+        self.engine = engine
+        self.ejected_until = 0.0
+        self.reads = 0
+        self.ejections = 0
+
+    def healthy(self, now: float) -> bool:
+        """True when the replica is not ejected at now"""
+        return self.ejected_until <= now
+
+    def stats(self, now: float) -> dict:
+        """Returns the health and counters of the replica"""
+        return {"name": self.name, "healthy": self.healthy(now), "reads": self.reads, "ejections": self.ejections}
+
+
+class ReplicaRouter:
+    """Chooses the engine of each query, a replica for the reads of read-only requests"""
+
+    def __init__(self):
+        self.replicas = []
+        self.eject_seconds = 30.0
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def init_app(self, app):
+        """Creates an engine for every replica in the app config"""
+        for replica in self.replicas:
+            replica.engine.dispose()
+        self.eject_seconds = app.config["DATABASE_REPLICA_EJECT_SECONDS"]
+        self.replicas = []
+        for number, uri in enumerate(app.config["DATABASE_REPLICA_URIS"]):
+            engine = create_engine(uri, **engine_options({**app.config, "SQLALCHEMY_DATABASE_URI": uri}))
+            replica = Replica(f"replica_{number}", engine)
+            event.listen(engine, "handle_error", lambda context, replica=replica: self._failed(replica, context))
+            query_log.watch(engine)
+            self.replicas.append(replica)
+
+    @property
+    def enabled(self) -> bool:
+        """True when there are replicas to read from"""
+        return bool(self.replicas)
+
+    def stats(self) -> list:
+        """Returns the health and counters of every replica"""
+        now = time.monotonic()
+        with self._lock:
+            return [replica.stats(now) for replica in self.replicas]
+
+    def engine_for(self, clause, flushing: bool):
+        """Returns the replica engine a query should use, None for the primary"""
+        if not self.replicas or not has_request_context() or getattr(self._local, "primary", False):
+            return None
+        environ = request.environ
+        if flushing or (clause is not None and clause.is_dml):
+            environ[PRIMARY_KEY] = True
+            return None
+        if request.method not in READ_METHODS or environ.get(PRIMARY_KEY):
+            return None
+        replica = environ.get(REPLICA_KEY)
+        if replica is None or not replica.healthy(time.monotonic()):
+            replica = environ[REPLICA_KEY] = self.choose()
+        return replica.engine if replica is not None else None
+
+    @contextmanager
+    def primary(self):
+        """Sends the reads of this thread to the primary inside the block
+
+        Used for the reads that fill the promotion cache. A replica that lags
+        behind a write would otherwise put the old row back in the cache
+        right after the write invalidated it, for the whole TTL.
+        """
+        previous = getattr(self._local, "primary", False)
+        self._local.primary = True
+        try:
+            yield
+        finally:
+            self._local.primary = previous
+
+    def choose(self):
+        """Returns the next healthy replica in turn, None when all of them are ejected"""
+        now = time.monotonic()
+        with self._lock:
+            for _ in range(len(self.replicas)):
+                replica = self.replicas[next(self._turn) % len(self.replicas)]
+                if replica.healthy(now):
+                    replica.reads += 1
+                    return replica
+        return None
+
+    def _failed(self, replica: Replica, context):
+        """Ejects a replica that cannot be connected to or dropped a connection"""
+        if not (context.is_disconnect or context.connection is None):
+            return
+        with self._lock:
+            replica.ejected_until = time.monotonic() + self.eject_seconds
+            replica.ejections += 1
+        logger.warning(
+            "Read replica %s failed and is ejected for %.0f seconds: %s",
+            replica.name,
+            self.eject_seconds,
+            context.original_exception,
+        )
+
+
+replica_router = ReplicaRouter()
+
+
+class RoutingSession(Session):
+    """The Flask-SQLAlchemy session, sending the reads of read-only requests to a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            engine = replica_router.engine_for(clause, self._flushing)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -0,0 +1,438 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Shared Promotion Cache
+
+A promotion cache that every worker on a node shares. It is a hash table
+in a memory mapped file, /dev/shm/promotion-cache by default, so one
+worker's fill serves the others. When one worker invalidates an entry,
+it is gone for all of them.
+
+The table is made of buckets of WAYS fixed size slots. A full bucket
+replaces its oldest entry. Readers take no lock. Each slot carries a
+version that a writer makes odd while it writes, and a reader retries
+until it sees the same even version before and after copying a slot.
+Writers lock the bucket with a thread lock and an fcntl record lock.
+
+Entries expire by the wall clock, which every process shares, so a file
+left over from an earlier run or boot holds nothing older than the ttl.
+
+Values are stored as JSON, never pickles, so whoever can write the file
+cannot make a worker run code. The file is opened without following
+symlinks, and it is refused unless it belongs to this user with mode 0600.
+
+Generations keep stale data out:
+    the file generation    clear() bumps it, which empties the table for every worker at once
+    bucket generations     invalidate() bumps the generation of the key's bucket, and a fill
+                           whose database read began before that is dropped
+"""
+import errno
+import fcntl
+import json
+import os
+import stat
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime
+from mmap import mmap
+
+from service.common.cache import NOT_FOUND
+from service.models import PromotionType
+
+MAGIC = b"PROMOCA2"
+HEADER = struct.Struct("<8sQQQ")  # magic, buckets, slot bytes, generation
+HEADER_BYTES = 64
+WAYS = 8
+SLOTS_PER_ENTRY = 2  # a table at most half full seldom has a full bucket
+BUCKET = struct.Struct(f"<Q{WAYS}I")  # generation, key hash of each slot
+SLOT = struct.Struct("<QQddIIHB5x")  # version, generation, expires at, written at, key hash, value length, key length, flags
+FLAG_NOT_FOUND = 1
+LOCK_STRIPES = 64
+READ_RETRIES = 100
+MAX_PENDING_FILLS = 64
+
+
+def default_path() -> str:
+    """Returns where the cache file lives, in memory when /dev/shm exists"""
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "promotion-cache")
+
+
+def bucket_count(maxsize: int) -> int:
+    """Returns the number of buckets of WAYS slots for maxsize entries"""
+    return max(1, -(-maxsize * SLOTS_PER_ENTRY // WAYS))
+
+
+def encode_key(key) -> bytes:
+    """Returns the bytes of a cache key, a Promotion id or a ("promotion_id", code) pair"""
+    if isinstance(key, tuple):
+        return f"{key[0]}:{key[1]}".encode()
+    return str(key).encode()
+
+
+def encode_value(value) -> bytes:
+    """Returns the JSON of a cached value, with its datetimes and PromotionTypes tagged"""
+    return json.dumps(value, default=_tag, separators=(",", ":")).encode()
+
+
+def decode_value(payload: bytes):
+    """Returns a cached value from its JSON, raising ValueError when it is not valid"""
+    return json.loads(payload, object_hook=_untag)
+
+
+def _tag(value):
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, PromotionType):
+        return {"$promotion_type": value.value}
+    raise TypeError(f"Cannot cache a {type(value).__name__}")
+
+
+def _untag(obj: dict):
+    if len(obj) == 1:
+        if "$datetime" in obj:
+            return datetime.fromisoformat(obj["$datetime"])
+        if "$promotion_type" in obj:
+            return PromotionType(obj["$promotion_type"])
+    return obj
+
+
+class SharedCache:  # pylint: disable=too-many-instance-attributes
+    """Promotion cache in a memory mapped file shared by the processes that open it"""
+
+    def __init__(self, path: str = "", maxsize: int = 1024, ttl: float = 5.0, negative_ttl: float = 1.0,
+                 slot_bytes: int = 1024):  # pylint: disable=too-many-arguments
+        self.enabled = False
+        self.path = path or default_path()
+        self.maxsize = maxsize
+        self.buckets = bucket_count(maxsize)
+        self.slot_bytes = max(slot_bytes, SLOT.size + 64)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._fd = None
+        self._map = None
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "hits": 0, "negative_hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "stale_fills": 0, "oversized": 0
+        }
+
+    def init_app(self, app):
+        """Configures the cache from the app config and maps the shared file, keeping what other workers cached"""
+        self.enabled = app.config["PROMOTION_CACHE_ENABLED"]
+        self.path = app.config["PROMOTION_CACHE_SHARED_PATH"] or default_path()
+        self.maxsize = max(1, app.config["PROMOTION_CACHE_SIZE"])
+        self.buckets = bucket_count(self.maxsize)
+        self.slot_bytes = max(app.config["PROMOTION_CACHE_SLOT_BYTES"], SLOT.size + 64)
+        self.ttl = app.config["PROMOTION_CACHE_TTL"]
+        self.negative_ttl = app.config["PROMOTION_CACHE_NEGATIVE_TTL"]
+        self.close()
+        with self._stats_lock:
+            self._stats = dict.fromkeys(self._stats, 0)
+        if self.enabled:
+            self.open()
+
+    @property
+    def size_bytes(self) -> int:
+        """Size of the shared file"""
+        return HEADER_BYTES + self.buckets * BUCKET.size + self.buckets * WAYS * self.slot_bytes
+
+    def open(self):
+        """Maps the shared file, replacing it when it was made for another layout
+
+        A file in use is never truncated, processes that still map an old file keep it.
+        """
+        while self._map is None:
+            fd = self._open_owned(self.path, os.O_RDWR | os.O_CREAT)
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                self._map_file(fd)
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+                if self._map is None:
+                    os.close(fd)
+        self._fd = fd
+
+    @staticmethod
+    def _open_owned(path: str, flags: int) -> int:
+        """Opens path without following a symlink, and only when this user owns it with mode 0600"""
+        try:
+            fd = os.open(path, flags | os.O_NOFOLLOW, 0o600)
+        except OSError as error:
+            if error.errno == errno.ELOOP:
+                raise PermissionError(f"Refusing the shared promotion cache {path}: it is a symlink") from error
+            raise
+        info = os.fstat(fd)
+        if info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) != 0o600:
+            os.close(fd)
+            raise PermissionError(
+                f"Refusing the shared promotion cache {path}: it must belong to uid {os.getuid()} with mode 0600"
+            )
+        return fd
+
+    def _map_file(self, fd):
+        """Maps fd when it is still the file at path and has this layout"""
+        try:
+            replaced = os.fstat(fd).st_ino != os.lstat(self.path).st_ino
+        except FileNotFoundError:
+            replaced = True
+        if replaced:
+            return  # replaced while this process waited for the lock
+        expected = HEADER.pack(MAGIC, self.buckets, self.slot_bytes, 1)
+        size = os.fstat(fd).st_size
+        if size == 0:
+            os.ftruncate(fd, self.size_bytes)
+            os.pwrite(fd, expected, 0)
+        elif size != self.size_bytes or os.pread(fd, HEADER.size - 8, 0) != expected[:-8]:
+            fresh = f"{self.path}.{os.getpid()}"
+            try:
+                os.unlink(fresh)  # left by a process with this pid that died while replacing the file
+            except FileNotFoundError:
+                pass
+            fresh_fd = self._open_owned(fresh, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            try:
+                os.ftruncate(fresh_fd, self.size_bytes)
+                os.pwrite(fresh_fd, expected, 0)
+            finally:
+                os.close(fresh_fd)
+            os.replace(fresh, self.path)
+            return
+        self._map = mmap(fd, self.size_bytes)
+
+    def close(self):
+        """Unmaps the shared file, the entries stay for the other processes"""
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+        self._map = None
+        self._fd = None
+
+    ######################################################################
+    # Cache interface of LRUCache
+    ######################################################################
+
+    def get(self, key):
+        """Returns the cached value of key, NOT_FOUND for a cached miss or None"""
+        raw = encode_key(key)
+        digest = zlib.crc32(raw)
+        bucket = digest % self.buckets
+        generation = self._generation()
+        now = time.time()
+        tags = BUCKET.unpack_from(self._map, HEADER_BYTES + bucket * BUCKET.size)
+        for way in range(WAYS):
+            if tags[way + 1] != digest:
+                continue
+            entry = self._read(bucket * WAYS + way, digest)
+            if entry is None or entry[0] != raw or entry[1] != generation:
+                continue
+            _, _, expires_at, flags, value = entry
+            if expires_at <= now:
+                self._count("expirations")
+                break
+            if flags & FLAG_NOT_FOUND:
+                self._count("negative_hits")
+                return NOT_FOUND
+            try:
+                cached = decode_value(value)
+            except ValueError:
+                break  # a slot a dead writer left half written is a miss
+            self._count("hits")
+            return cached
+        self._count("misses")
+        self._remember_miss(raw, bucket)
+        return None
+
+    def put(self, key, value):
+        """Caches value, or NOT_FOUND, unless key was invalidated since the lookup that missed it"""
+        raw = encode_key(key)
+        found = value is NOT_FOUND
+        payload = b"" if found else encode_value(value)
+        if SLOT.size + len(raw) + len(payload) > self.slot_bytes:
+            self._count("oversized")
+            return
+        digest = zlib.crc32(raw)
+        bucket = digest % self.buckets
+        missed_at = self._pending().pop(raw, None)
+        now = time.time()
+        with self._locked(bucket):
+            if missed_at is not None and missed_at != self._bucket_generation(bucket):
+                self._count("stale_fills")
+                return
+            index = self._victim(bucket, raw, digest, now)
+            expires_at = now + (self.negative_ttl if found else self.ttl)
+            self._write(index, raw, digest, payload, expires_at, now, FLAG_NOT_FOUND if found else 0)
+
+    def invalidate(self, *keys):
+        """Forgets keys in every process and drops fills that read them before"""
+        for key in keys:
+            raw = encode_key(key)
+            digest = zlib.crc32(raw)
+            bucket = digest % self.buckets
+            with self._locked(bucket):
+                offset = HEADER_BYTES + bucket * BUCKET.size
+                struct.pack_into("<Q", self._map, offset, self._bucket_generation(bucket) + 1)
+                for index in self._slots(bucket):
+                    entry = self._read(index, digest)
+                    if entry is not None and entry[0] == raw:
+                        self._write(index, b"", 0, b"", 0.0, 0.0, 0)
+
+    def clear(self):
+        """Forgets every entry in every process by moving to the next file generation"""
+        if self._map is None:
+            return
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 8, 24)
+        try:
+            struct.pack_into("<Q", self._map, 24, self._generation() + 1)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 8, 24)
+
+    def stats(self) -> dict:
+        """Returns the entries in the shared file and this process's hit, miss and eviction counters"""
+        generation = self._generation() if self._map is not None else 0
+        now = time.time()
+        size = 0
+        if self._map is not None:
+            for index in range(self.buckets * WAYS):
+                entry = self._read(index)
+                size += entry is not None and entry[0] != b"" and entry[1] == generation and entry[2] > now
+        with self._stats_lock:
+            lookups = self._stats["hits"] + self._stats["negative_hits"] + self._stats["misses"]
+            hit_rate = (lookups - self._stats["misses"]) / lookups if lookups else 0.0
+            return {
+                "size": size,
+                "maxsize": self.maxsize,
+                "hit_rate": round(hit_rate, 3),
+                "generation": generation,
+                **self._stats,
+            }
+
+    ######################################################################
+    # Slots
+    ######################################################################
+
+    def _slots(self, bucket: int):
+        return range(bucket * WAYS, bucket * WAYS + WAYS)
+
+    def _offset(self, index: int) -> int:
+        return HEADER_BYTES + self.buckets * BUCKET.size + index * self.slot_bytes
+
+    def _generation(self) -> int:
+        return struct.unpack_from("<Q", self._map, 24)[0]
+
+    def _bucket_generation(self, bucket: int) -> int:
+        return struct.unpack_from("<Q", self._map, HEADER_BYTES + bucket * BUCKET.size)[0]
+
+    def _read(self, index: int, digest=None):
+        """Returns the key, generation, expiry, flags and value bytes of a slot
+
+        None while the slot is being written, or when it holds another key hash than digest.
+        """
+        offset = self._offset(index)
+        for _ in range(READ_RETRIES):
+            version, generation, expires_at, _, key_hash, value_length, key_length, flags = SLOT.unpack_from(
+                self._map, offset
+            )
+            if version & 1:
+                continue
+            if digest is not None and key_hash != digest:
+                return None
+            start = offset + SLOT.size
+            key = self._map[start:start + key_length]
+            value = self._map[start + key_length:start + key_length + value_length]
+            if struct.unpack_from("<Q", self._map, offset)[0] == version:
+                return key, generation, expires_at, flags, value
+        return None
+
+    def _victim(self, bucket: int, raw: bytes, digest: int, now: float) -> int:  # pylint: disable=too-many-arguments
+        """Returns the slot to write key to: its own, a free one or the oldest entry"""
+        generation = self._generation()
+        oldest, oldest_at = None, None
+        for index in self._slots(bucket):
+            offset = self._offset(index)
+            _, slot_generation, expires_at, written_at, key_hash, _, key_length, _ = SLOT.unpack_from(self._map, offset)
+            start = offset + SLOT.size
+            if key_hash == digest and self._map[start:start + key_length] == raw:
+                return index
+            if not key_length or slot_generation != generation or expires_at <= now:
+                return index
+            if oldest_at is None or written_at < oldest_at:
+                oldest, oldest_at = index, written_at
+        self._count("evictions")
+        return oldest
+
+    def _write(self, index: int, raw: bytes, digest: int, payload: bytes, expires_at: float, now: float, flags: int):
+        """Writes a slot, its version is odd until the write is complete"""
+        # pylint: disable=too-many-arguments
+        offset = self._offset(index)
+        # | 1 rather than + 1: a writer killed half way leaves the version odd, and the next write must still end even
+        writing = struct.unpack_from("<Q", self._map, offset)[0] | 1
+        struct.pack_into("<Q", self._map, offset, writing)
+        start = offset + SLOT.size
+        self._map[start:start + len(raw) + len(payload)] = raw + payload
+        SLOT.pack_into(
+            self._map, offset, writing, self._generation(), expires_at, now, digest, len(payload), len(raw), flags
+        )
+        struct.pack_into("<Q", self._map, offset, writing + 1)
+        bucket, way = divmod(index, WAYS)
+        struct.pack_into("<I", self._map, HEADER_BYTES + bucket * BUCKET.size + 8 + way * 4, digest)
+
+    def _locked(self, bucket: int):
+        return _BucketLock(self._locks[bucket % LOCK_STRIPES], self._fd, self._offset(bucket * WAYS))
+
+    ######################################################################
+    # Fills and counters
+    ######################################################################
+
+    def _pending(self) -> dict:
+        """The keys this thread missed and may fill, with the bucket generation at the miss"""
+        pending = getattr(self._local, "pending", None)
+        if pending is None:
+            pending = self._local.pending = {}
+        return pending
+
+    def _remember_miss(self, raw: bytes, bucket: int):
+        pending = self._pending()
+        if len(pending) >= MAX_PENDING_FILLS:
+            pending.clear()
+        pending[raw] = self._bucket_generation(bucket)
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+
+class _BucketLock:
+    """Locks a bucket against the other threads of this process and against other processes"""
+
+    __slots__ = ("lock", "fd", "offset")
+
+    def __init__(self, lock, fd, offset):
+        self.lock = lock
+        self.fd = fd
+        self.offset = offset
+
+    def __enter__(self):
+        self.lock.acquire()
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, self.offset)
+
+    def __exit__(self, *exc_info):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, self.offset)
+        self.lock.release()
@@ -0,0 +1,168 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Usage Buffer
+
+Write-behind buffer for Promotion applies. Applies are counted in memory
+in lock-sharded counters and flushed to usage_count in one batched
+UPDATE every USAGE_BUFFER_FLUSH_MS or USAGE_BUFFER_FLUSH_INCREMENTS,
+whichever comes first, and once more when the process exits.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from service.models import Promotion
+
+logger = logging.getLogger("flask.app")
+
+
+class _Shard:  # pylint: disable=too-few-public-methods
+    """Pending applies for the Promotion ids that hash to one lock"""
+
+    __slots__ = ("lock", "counts", "total", "since")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.total = 0
+        self.since = None
+
+
+class UsageBuffer:
+    """Sharded in-process counter of applies waiting to be written"""
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.flush_interval = 0.1
+        self.flush_increments = 1000
+        self._shards = [_Shard()]
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats = {"flushes": 0, "flushed_increments": 0, "flush_errors": 0, "last_flush_ms": 0.0}
+
+    def init_app(self, app):
+        """Configures the buffer from the app config and flushes it at exit"""
+        self.app = app
+        self.enabled = app.config["USAGE_BUFFER_ENABLED"]
+        self.flush_interval = app.config["USAGE_BUFFER_FLUSH_MS"] / 1000
+        self.flush_increments = app.config["USAGE_BUFFER_FLUSH_INCREMENTS"]
+        self._shards = [_Shard() for _ in range(max(1, app.config["USAGE_BUFFER_SHARDS"]))]
+        if self.enabled:
+            atexit.register(self.stop)
+
+    def add(self, promotion_id: int, count: int = 1) -> int:
+        """Counts applies of a Promotion and returns how many of them are pending"""
+        self._start()
+        pending = self._merge(promotion_id, count)
+        if self.pending_increments() >= self.flush_increments:
+            self._wakeup.set()
+        return pending
+
+    def pending(self, promotion_id: int) -> int:
+        """Returns the applies of a Promotion that are not in the database yet"""
+        shard = self._shards[hash(promotion_id) % len(self._shards)]
+        return shard.counts.get(promotion_id, 0)
+
+    def pending_increments(self) -> int:
+        """Returns the number of applies that are not in the database yet"""
+        return sum(shard.total for shard in self._shards)
+
+    def flush(self) -> int:
+        """Writes every pending apply to the database and returns how many there were"""
+        counts = {}
+        for shard in self._shards:
+            with shard.lock:
+                taken, shard.counts, shard.total, shard.since = shard.counts, {}, 0, None
+            counts.update(taken)
+        if not counts:
+            return 0
+
+        start = time.perf_counter()
+        try:
+            with self.app.app_context():
+                Promotion.add_usage(counts)
+        except Exception:
+            self._stats["flush_errors"] += 1
+            # put them back without add(), which would restart the flusher while it stops
+            for promotion_id, count in counts.items():
+                self._merge(promotion_id, count)
+            raise
+        flushed = sum(counts.values())
+        self._stats["flushes"] += 1
+        self._stats["flushed_increments"] += flushed
+        self._stats["last_flush_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return flushed
+
+    def stats(self) -> dict:
+        """Returns counters that show how far the database lags behind the buffer"""
+        oldest = [shard.since for shard in self._shards if shard.since is not None]
+        return {
+            "pending_increments": self.pending_increments(),
+            "pending_promotions": sum(len(shard.counts) for shard in self._shards),
+            "lag_seconds": round(time.monotonic() - min(oldest), 3) if oldest else 0.0,
+            **self._stats,
+        }
+
+    def stop(self):
+        """Stops the flusher thread and writes whatever is still pending"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+        self._thread = None
+        try:
+            self.flush()
+        finally:
+            self._stopping.clear()
+
+    def _merge(self, promotion_id: int, count: int) -> int:
+        """Adds applies to the shard of a Promotion and returns how many of them are pending"""
+        shard = self._shards[hash(promotion_id) % len(self._shards)]
+        with shard.lock:
+            if not shard.counts:
+                shard.since = time.monotonic()
+            pending = shard.counts.get(promotion_id, 0) + count
+            shard.counts[promotion_id] = pending
+            shard.total += count
+        return pending
+
+    def _start(self):
+        """Starts the flusher thread, again in a forked worker that lost it"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="usage-buffer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        """Flushes the buffer on every interval or when it fills up"""
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as error:  # pylint: disable=broad-except
+                logger.error("Usage buffer flush failed, will retry: %s", error)
+
+
+usage_buffer = UsageBuffer()
@@ -13,8 +13,83 @@ DATABASE_URI = os.getenv(
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-# SQLALCHEMY_POOL_SIZE = 2
+
+# Read replicas for GET requests, a comma separated list of URIs, and how long a failed one sits out
+DATABASE_REPLICA_URIS = [uri.strip() for uri in os.getenv("DATABASE_REPLICA_URIS", "").split(",") if uri.strip()]
+DATABASE_REPLICA_EJECT_SECONDS = float(os.getenv("DATABASE_REPLICA_EJECT_SECONDS", "30"))
+
+# Refuse to start when the schema is not at the latest migration, warn only when false
+SCHEMA_CHECK_STRICT = os.getenv("SCHEMA_CHECK_STRICT", "True").lower() in ["true", "yes", "1"]
+
+# Connection pool of each worker, turned into SQLALCHEMY_ENGINE_OPTIONS by create_app()
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "True").lower() in ["true", "yes", "1"]
+
+# Threads that run the requests of one asgi:app worker, 0 to match DB_POOL_SIZE + DB_MAX_OVERFLOW
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", "0"))
+
+# Keyset pagination for list queries
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+
+# Rows fetched per database round trip when streaming NDJSON lists
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+# Largest batch accepted by POST /promotions/bulk
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "10000"))
+
+# Most rows changed by one transaction of PUT /promotions/state
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+
+# Write-behind buffering of PUT /promotions/<id>/apply
+USAGE_BUFFER_ENABLED = os.getenv("USAGE_BUFFER_ENABLED", "False").lower() in ["true", "yes", "1"]
+USAGE_BUFFER_FLUSH_MS = int(os.getenv("USAGE_BUFFER_FLUSH_MS", "100"))
+USAGE_BUFFER_FLUSH_INCREMENTS = int(os.getenv("USAGE_BUFFER_FLUSH_INCREMENTS", "1000"))
+USAGE_BUFFER_SHARDS = int(os.getenv("USAGE_BUFFER_SHARDS", "16"))
+
+# In-memory interval tree that answers GET /promotions?active_at=
+LIVE_INDEX_ENABLED = os.getenv("LIVE_INDEX_ENABLED", "False").lower() in ["true", "yes", "1"]
+LIVE_INDEX_TTL = float(os.getenv("LIVE_INDEX_TTL", "5"))
+# above this many running promotions active_at falls back to the SQL filter instead of a huge IN list
+LIVE_INDEX_MAX_IDS = int(os.getenv("LIVE_INDEX_MAX_IDS", "1000"))
+
+# POST /promotions/evaluate: most lines in a cart, seconds a snapshot of the active promotions is kept
+EVALUATE_MAX_ITEMS = int(os.getenv("EVALUATE_MAX_ITEMS", "1000"))
+EVALUATE_SNAPSHOT_TTL = float(os.getenv("EVALUATE_SNAPSHOT_TTL", "5"))
+
+# Read-through cache in front of Promotion.find
+PROMOTION_CACHE_ENABLED = os.getenv("PROMOTION_CACHE_ENABLED", "False").lower() in ["true", "yes", "1"]
+PROMOTION_CACHE_SIZE = int(os.getenv("PROMOTION_CACHE_SIZE", "1024"))
+PROMOTION_CACHE_TTL = float(os.getenv("PROMOTION_CACHE_TTL", "5"))
+PROMOTION_CACHE_NEGATIVE_TTL = float(os.getenv("PROMOTION_CACHE_NEGATIVE_TTL", "1"))
+PROMOTION_CACHE_WARM = int(os.getenv("PROMOTION_CACHE_WARM", "0"))
+# "memory" caches in each worker, "shared" in one memory mapped file for all the workers of a node
+PROMOTION_CACHE_BACKEND = os.getenv("PROMOTION_CACHE_BACKEND", "memory")
+PROMOTION_CACHE_SHARED_PATH = os.getenv("PROMOTION_CACHE_SHARED_PATH", "")  # /dev/shm/promotion-cache
+PROMOTION_CACHE_SLOT_BYTES = int(os.getenv("PROMOTION_CACHE_SLOT_BYTES", "1024"))
+
+# Longest Cache-Control max-age of a promotion response, in seconds
+CACHE_MAX_AGE = int(os.getenv("CACHE_MAX_AGE", "60"))
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
 LOGGING_LEVEL = logging.INFO
+
+# Request metrics on GET /metrics, shared by the workers that use the same METRICS_DIR
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True").lower() in ["true", "yes", "1"]
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+
+# Profile requests that send PROFILE_SECRET in X-Profile or ?profile=, and a sample of the rest
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/promotion-profiles")
+PROFILE_BACKEND = os.getenv("PROFILE_BACKEND", "cprofile")
+
+# Per-request SQL statement counts, N+1 warnings and the slow query log
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "200"))
+SQL_SLOW_QUERY_LOG = os.getenv("SQL_SLOW_QUERY_LOG", "")
+SQL_REPEAT_THRESHOLD = int(os.getenv("SQL_REPEAT_THRESHOLD", "10"))
+SQL_DEBUG_HEADERS = os.getenv("SQL_DEBUG_HEADERS", "False").lower() in ["true", "yes", "1"]
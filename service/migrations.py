@@ -0,0 +1,206 @@
+"""
+Schema Migrations
+
+Versioned migrations for the promotions database. Every migration runs
+once, in order, in its own transaction and is recorded in the
+schema_version table, so the schema only changes when a migration says so.
+Migrations describe the schema as it was when they were written and must
+never be edited once released: add a new one instead.
+"""
+
+import logging
+from datetime import datetime, timezone
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Enum,
+    Float,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    exc,
+    func,
+    select,
+    text,
+)
+
+logger = logging.getLogger("flask.app")
+
+version_table = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+class SchemaVersionError(Exception):
+    """Used when the database schema is not the version the code expects"""
+
+
+class MigrationError(Exception):
+    """Used when the data in the database keeps a migration from running"""
+
+
+# (version, description, upgrade function) in the order they are applied
+MIGRATIONS = []
+
+
+def migration(version: int, description: str):
+    """Registers a function that upgrades the schema to version"""
+
+    def register(function):
+        MIGRATIONS.append((version, description, function))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return function
+
+    return register
+
+
+def latest_version() -> int:
+    """Returns the schema version the code expects"""
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(connection) -> int:
+    """Returns the schema version of the database, 0 if it was never migrated"""
+    if not connection.dialect.has_table(connection, version_table.name):
+        return 0
+    return connection.execute(select(func.max(version_table.c.version))).scalar() or 0
+
+
+def check(engine) -> int:
+    """Returns the schema version of the database with one query
+
+    Raises SchemaVersionError unless it is the version the code expects
+    """
+    with engine.connect() as connection:
+        try:
+            version = connection.execute(select(func.max(version_table.c.version))).scalar() or 0
+        except exc.DBAPIError:
+            connection.rollback()
+            if connection.dialect.has_table(connection, version_table.name):
+                raise
+            version = 0
+    if version != latest_version():
+        raise SchemaVersionError(
+            f"Database schema is at version {version} but the service needs version {latest_version()}, "
+            "run flask db-upgrade"
+        )
+    return version
+
+
+def upgrade(engine) -> list:
+    """Applies every pending migration and returns the versions that were applied"""
+    with engine.begin() as connection:
+        version_table.create(connection, checkfirst=True)
+        version = current_version(connection)
+
+    applied = []
+    for number, description, apply_migration in MIGRATIONS:
+        if number <= version:
+            continue
+        logger.info("Migrating schema to version %d: %s", number, description)
+        with engine.begin() as connection:
+            apply_migration(connection)
+            connection.execute(
+                version_table.insert().values(
+                    version=number,
+                    description=description,
+                    applied_at=datetime.now(timezone.utc).replace(tzinfo=None),
+                )
+            )
+        applied.append(number)
+    return applied
+
+
+def drop_all(engine, metadata) -> None:
+    """Drops the tables in metadata and the migration history"""
+    with engine.begin() as connection:
+        metadata.drop_all(connection)
+        version_table.drop(connection, checkfirst=True)
+
+
+def _promotion_table(connection) -> Table:
+    """Returns the promotion table as it is in the database right now"""
+    return Table("promotion", MetaData(), autoload_with=connection)
+
+
+def _check_periods(connection, promotion: Table) -> None:
+    """Raises MigrationError if a Promotion starts after it ends, which tsrange() rejects"""
+    inverted = connection.execute(
+        select(promotion.c.id).where(promotion.c.start_date > promotion.c.end_date).order_by(promotion.c.id)
+    ).scalars().all()
+    if inverted:
+        raise MigrationError(
+            f"{len(inverted)} promotions start after they end, fix their dates and run flask db-upgrade again: "
+            f"ids {inverted[:20]}"
+        )
+
+
+######################################################################
+#  M I G R A T I O N S
+######################################################################
+
+
+@migration(1, "Create the promotion table")
+def _create_promotion_table(connection):
+    metadata = MetaData()
+    Table(
+        "promotion",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("name", String(63)),
+        Column("promotion_id", String(63), nullable=False, unique=True),
+        Column("start_date", DateTime, nullable=False),
+        Column("end_date", DateTime, nullable=False),
+        Column("promotion_type", Enum("DISCOUNT", "FLASH", "COUPON", name="promotiontype"), nullable=False),
+        Column("promotion_amount", Float, nullable=False),
+        Column("promotion_description", String(255), nullable=False),
+        Column("usage_count", Integer, nullable=False),
+        Column("state", String(63), nullable=False),
+    )
+    # databases built by db.create_all() before migrations existed already have it
+    metadata.create_all(connection, checkfirst=True)
+
+
+@migration(2, "Index the list, state and date filters")
+def _create_filter_indexes(connection):
+    promotion = _promotion_table(connection)
+    indexes = [
+        Index("ix_promotion_name", promotion.c.name),
+        Index("ix_promotion_type_state", promotion.c.promotion_type, promotion.c.state),
+        Index("ix_promotion_state_dates", promotion.c.state, promotion.c.start_date, promotion.c.end_date),
+    ]
+    for index in indexes:
+        index.create(connection, checkfirst=True)
+
+
+@migration(3, "Index the promotion schedule for date range and active_at filters")
+def _create_schedule_indexes(connection):
+    promotion = _promotion_table(connection)
+    indexes = [
+        Index("ix_promotion_start_date", promotion.c.start_date),
+        Index("ix_promotion_end_date", promotion.c.end_date),
+    ]
+    for index in indexes:
+        index.create(connection, checkfirst=True)
+    if connection.dialect.name == "postgresql":
+        _check_periods(connection, promotion)
+        # serves tsrange(start_date, end_date, '[]') @> :active_at, see Promotion.running_at
+        connection.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_promotion_period ON promotion "
+                "USING gist (tsrange(start_date, end_date, '[]'))"
+            )
+        )
+
+
+@migration(4, "Add the row version behind ETags")
+def _add_promotion_version(connection):
+    promotion = _promotion_table(connection)
+    if "version" not in promotion.c:
+        connection.execute(text("ALTER TABLE promotion ADD COLUMN version INTEGER DEFAULT 1 NOT NULL"))
@@ -8,9 +8,14 @@ from datetime import datetime
 import logging
 import os
 from enum import Enum
+from typing import NamedTuple
 from flask_sqlalchemy import SQLAlchemy
 from retry import retry
 from sqlalchemy import Enum as SQLAlchemyEnum
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.orm import make_transient_to_detached
+from service.common.cache import NOT_FOUND, promotion_cache, promotion_id_key
+from service.common.replicas import RoutingSession, replica_router
 
 # global variables for retry (must be int)
 RETRY_COUNT = int(os.environ.get("RETRY_COUNT", 5))
@@ -20,7 +25,7 @@ RETRY_BACKOFF = int(os.environ.get("RETRY_BACKOFF", 2))
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 @retry(
@@ -39,6 +44,15 @@ class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+def to_datetime(value):
+    """Returns a datetime from an ISO 8601 string, or value itself if it already is one"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
 class PromotionType(Enum):
     """Enumeration of the Promotion types"""
 
@@ -47,7 +61,7 @@ class PromotionType(Enum):
     COUPON = "COUPON"
 
 
-class Promotion(db.Model):
+class Promotion(db.Model):  # pylint: disable=too-many-public-methods
     """
     Class that represents a Promotion
     """
@@ -65,6 +79,34 @@ class Promotion(db.Model):
     promotion_description = db.Column(db.String(255), nullable=False)
     usage_count = db.Column(db.Integer, nullable=False, default=0)
     state = db.Column(db.String(63), nullable=False, default="active")
+    # bumped by every UPDATE, ORM or Core, that does not set it; the ETag of a Promotion
+    version = db.Column(
+        db.Integer, nullable=False, default=1, server_default="1", onupdate=db.literal_column("version + 1")
+    )
+
+    # The fields of a serialized Promotion, each one the column of the same name
+    FIELDS = (
+        "id",
+        "name",
+        "promotion_id",
+        "start_date",
+        "end_date",
+        "promotion_type",
+        "promotion_amount",
+        "promotion_description",
+        "usage_count",
+        "state",
+    )
+
+    # Created by service/migrations.py, declared here to keep the metadata in step
+    __table_args__ = (
+        db.Index("ix_promotion_name", "name"),
+        db.Index("ix_promotion_type_state", "promotion_type", "state"),
+        db.Index("ix_promotion_state_dates", "state", "start_date", "end_date"),
+        db.Index("ix_promotion_start_date", "start_date"),
+        db.Index("ix_promotion_end_date", "end_date"),
+        # PostgreSQL also gets ix_promotion_period, a GiST index on tsrange(start_date, end_date)
+    )
 
     def __repr__(self):
         return f"<Promotion {self.name} id=[{self.id}]>"
@@ -82,6 +124,7 @@ class Promotion(db.Model):
             db.session.rollback()
             logger.error("Error creating record: %s", self)
             raise DataValidationError(e) from e
+        promotion_cache.invalidate(self.id, promotion_id_key(self.promotion_id))
 
     def update(self):
         """
@@ -94,10 +137,12 @@ class Promotion(db.Model):
             db.session.rollback()
             logger.error("Error updating record: %s", self)
             raise DataValidationError(e) from e
+        promotion_cache.invalidate(self.id, promotion_id_key(self.promotion_id))
 
     def delete(self):
         """Removes a Promotion from the data store"""
         logger.info("Deleting %s", self.name)
+        keys = (self.id, promotion_id_key(self.promotion_id))
         try:
             db.session.delete(self)
             db.session.commit()
@@ -105,22 +150,47 @@ class Promotion(db.Model):
             db.session.rollback()
             logger.error("Error deleting record: %s", self)
             raise DataValidationError(e) from e
+        promotion_cache.invalidate(*keys)
 
-    def serialize(self) -> dict:
-        """Serializes a Promotion into a dictionary"""
+    def serialize(self, fields=None) -> dict:
+        """Serializes a Promotion into a dictionary of raw values for the app JSON provider
+
+        Args:
+            fields (list): the FIELDS to include, all of them when None
+        """
+        if fields is not None:
+            return {name: getattr(self, name) for name in fields}
         return {
             "id": self.id,
             "name": self.name,
             "promotion_id": self.promotion_id,
-            "start_date": self.start_date.isoformat(),
-            "end_date": self.end_date.isoformat(),
-            "promotion_type": self.promotion_type.value,
+            "start_date": self.start_date,
+            "end_date": self.end_date,
+            "promotion_type": self.promotion_type,
             "promotion_amount": self.promotion_amount,
             "promotion_description": self.promotion_description,
             "usage_count": self.usage_count,
             "state": self.state,
         }
 
+    def as_row(self) -> dict:
+        """Returns the column values of a new Promotion for a bulk INSERT"""
+        return {
+            "name": self.name,
+            "promotion_id": self.promotion_id,
+            "start_date": self.start_date,
+            "end_date": self.end_date,
+            "promotion_type": self.promotion_type,
+            "promotion_amount": self.promotion_amount,
+            "promotion_description": self.promotion_description,
+            "usage_count": self.usage_count or 0,
+            "state": self.state or "active",
+        }
+
+    def as_cached(self) -> dict:
+        """Returns the column values of a Promotion for the promotion cache"""
+        return {"id": self.id, "version": self.version, **self.as_row()}
+
     def deserialize(self, data):
         """
         Deserializes a Promotion from a dictionary
@@ -138,16 +208,10 @@ class Promotion(db.Model):
             self.name = data["name"]
             self.promotion_id = data["promotion_id"]
 
-            self.start_date = (
-                datetime.fromisoformat(data["start_date"])
-                if data.get("start_date")
-                else None
-            )
-            self.end_date = (
-                datetime.fromisoformat(data["end_date"])
-                if data.get("end_date")
-                else None
-            )
+            self.start_date = to_datetime(data.get("start_date"))
+            self.end_date = to_datetime(data.get("end_date"))
+            if self.start_date and self.end_date and self.start_date > self.end_date:
+                raise DataValidationError("Invalid Promotion: start_date is after end_date")
 
             self.promotion_type = PromotionType(data["promotion_type"])
 
@@ -190,9 +254,88 @@ class Promotion(db.Model):
 
     @classmethod
     def find(cls, by_id):
-        """Finds a Promotion by it's ID"""
+        """Finds a Promotion by it's ID, through the promotion cache when it is enabled"""
         logger.info("Processing lookup for id %s ...", by_id)
-        return cls.query.session.get(cls, by_id)
+        if not promotion_cache.enabled:
+            return cls.query.session.get(cls, by_id)
+
+        cached = promotion_cache.get(by_id)
+        if cached is NOT_FOUND:
+            return None
+        if cached is not None:
+            return cls._from_cache(cached)
+        with replica_router.primary():  # what goes in the cache must not lag behind a write
+            promotion = cls.query.session.get(cls, by_id)
+        promotion_cache.put(by_id, promotion.as_cached() if promotion else NOT_FOUND)
+        return promotion
+
+    @classmethod
+    def find_view(cls, by_id, fields=None):
+        """Finds a read-only PromotionView by it's ID without building a Promotion
+
+        Args:
+            by_id (int): the id of the Promotion
+            fields (list): the only FIELDS to read when it comes from the database
+        """
+        logger.info("Processing view lookup for id %s ...", by_id)
+        if promotion_cache.enabled:
+            cached = promotion_cache.get(by_id)
+            if cached is not None:
+                return None if cached is NOT_FOUND else PromotionView(**cached)
+            with replica_router.primary():  # what goes in the cache must not lag behind a write
+                row = db.session.execute(select(*PromotionView.columns()).where(cls.id == by_id)).first()
+            promotion_cache.put(by_id, row._asdict() if row else NOT_FOUND)
+        else:
+            row = db.session.execute(select(*PromotionView.columns(fields)).where(cls.id == by_id)).first()
+        return PromotionView(**row._mapping) if row else None
+
+    @classmethod
+    def find_view_by_promotion_id(cls, code):
+        """Finds the read-only PromotionView with a promotion_id, through the promotion cache
+
+        The cache maps the promotion_id to the id of the Promotion, and the id
+        to its columns, so a hit needs no query. A cached id whose Promotion
+        is gone or has another promotion_id now is read again.
+
+        Args:
+            code (str): the promotion_id of the Promotion
+        """
+        logger.info("Processing view lookup for promotion_id %s ...", code)
+        key = promotion_id_key(code)
+        by_id = promotion_cache.get(key)
+        if by_id is NOT_FOUND:
+            return None
+        if by_id is not None:
+            cached = promotion_cache.get(by_id)
+            if isinstance(cached, dict) and cached["promotion_id"] == code:
+                return PromotionView(**cached)
+        with replica_router.primary():  # what goes in the cache must not lag behind a write
+            row = db.session.execute(select(*PromotionView.columns()).where(cls.promotion_id == code)).first()
+        promotion_cache.put(key, row.id if row else NOT_FOUND)
+        if row:
+            promotion_cache.put(row.id, row._asdict())
+        return PromotionView(**row._mapping) if row else None
+
+    @classmethod
+    def views(cls, query, fields=None):
+        """Returns a query for the rows behind the PromotionViews of the Promotions in a query"""
+        return query.with_entities(*PromotionView.columns(fields))
+
+    @classmethod
+    def warm_cache(cls, count):
+        """Loads the count most used Promotions into the promotion cache"""
+        logger.info("Warming the cache with the top %d Promotions ...", count)
+        promotions = cls.query.order_by(cls.usage_count.desc(), cls.id).limit(count).all()
+        for promotion in promotions:
+            promotion_cache.put(promotion.id, promotion.as_cached())
+        return len(promotions)
+
+    @classmethod
+    def _from_cache(cls, row):
+        """Attaches a Promotion rebuilt from cached column values to the session without a query"""
+        promotion = cls(**row)
+        make_transient_to_detached(promotion)
+        return db.session.merge(promotion, load=False)
 
     @classmethod
     def find_by_name(cls, name):
@@ -213,3 +356,294 @@ class Promotion(db.Model):
         """
         logger.info("Processing promotion_type query for %s ...", promotion_type)
         return cls.query.filter(cls.promotion_type == promotion_type).all()
+
+    @classmethod
+    def create_many(cls, promotions, atomic=True):
+        """
+        Creates Promotions with a multi-row INSERT in a single transaction
+
+        Returns one entry per Promotion: its new id, or the DataValidationError
+        that kept it out of the database. When atomic, any error rolls back the
+        whole batch and is raised instead.
+
+        Args:
+            promotions (list): the deserialized Promotions to create
+            atomic (bool): create all of the Promotions or none of them
+        """
+        logger.info("Creating %d Promotions", len(promotions))
+        rows = [promotion.as_row() for promotion in promotions]
+        if not rows:
+            return []
+        aliases = [promotion_id_key(row["promotion_id"]) for row in rows]
+        try:
+            ids = db.session.scalars(insert(cls).returning(cls.id, sort_by_parameter_order=True), rows).all()
+            db.session.commit()
+            promotion_cache.invalidate(*ids, *aliases)
+            return ids
+        except Exception as e:  # pylint: disable=broad-except
+            db.session.rollback()
+            if atomic:
+                logger.error("Error creating %d records: %s", len(rows), e)
+                raise DataValidationError(e) from e
+
+        # Some row was rejected, so retry one SAVEPOINT per row to find out which
+        logger.info("Retrying %d Promotions one at a time", len(rows))
+        results = []
+        for row in rows:
+            try:
+                with db.session.begin_nested():
+                    results.append(db.session.scalar(insert(cls).values(**row).returning(cls.id)))
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("Error creating record: %s", row.get("promotion_id"))
+                results.append(DataValidationError(e))
+        db.session.commit()
+        promotion_cache.invalidate(*(result for result in results if isinstance(result, int)), *aliases)
+        return results
+
+    @classmethod
+    def apply(cls, by_id):
+        """Increments the usage count of a Promotion in a single UPDATE
+
+        Returns the updated Promotion or None if it does not exist
+        """
+        logger.info("Processing apply for id %s ...", by_id)
+        statement = (
+            update(cls)
+            .where(cls.id == by_id)
+            .values(usage_count=cls.usage_count + 1)
+            .returning(cls)
+        )
+        promotion = cls._update_returning(statement)
+        promotion_cache.invalidate(by_id)
+        return promotion
+
+    @classmethod
+    def cancel(cls, by_id):
+        """Cancels an active Promotion in a single conditional UPDATE
+
+        Returns the canceled Promotion or None if it does not exist or is not active
+        """
+        logger.info("Processing cancel for id %s ...", by_id)
+        statement = (
+            update(cls)
+            .where(cls.id == by_id, cls.state == "active")
+            .values(state="canceled")
+            .returning(cls)
+        )
+        promotion = cls._update_returning(statement)
+        promotion_cache.invalidate(by_id)
+        return promotion
+
+    @classmethod
+    def add_usage(cls, counts):
+        """Adds buffered applies to the usage counts of Promotions in one transaction
+
+        Args:
+            counts (dict): the number of applies to add keyed by Promotion id
+        """
+        logger.info("Processing usage flush for %d Promotions ...", len(counts))
+        table = cls.__table__
+        statement = (
+            table.update()
+            .where(table.c.id == bindparam("b_id"))
+            .values(usage_count=table.c.usage_count + bindparam("b_count"))
+        )
+        rows = [{"b_id": by_id, "b_count": count} for by_id, count in sorted(counts.items())]
+        try:
+            db.session.execute(statement, rows)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error adding usage: %s", counts)
+            raise DataValidationError(e) from e
+        promotion_cache.invalidate(*counts)
+
+    @classmethod
+    def criteria(
+        cls, *, promotion_type=None, name=None, starts_after=None, ends_before=None, active_at=None, ids=None
+    ):  # pylint: disable=too-many-arguments
+        """
+        Returns the WHERE clauses that select Promotions by the given filters
+
+        Args:
+            promotion_type (PromotionType): the PromotionType to match
+            name (string): the name to match
+            starts_after (datetime): the earliest start_date to match
+            ends_before (datetime): the latest end_date to match
+            active_at (datetime): a moment between start_date and end_date
+            ids (list): the Promotion ids to match
+        """
+        clauses = []
+        if promotion_type is not None:
+            clauses.append(cls.promotion_type == promotion_type)
+        if name is not None:
+            clauses.append(cls.name == name)
+        if starts_after is not None:
+            clauses.append(cls.start_date >= starts_after)
+        if ends_before is not None:
+            clauses.append(cls.end_date <= ends_before)
+        if active_at is not None:
+            clauses.append(cls.running_at(active_at))
+        if ids is not None:
+            clauses.append(cls.id.in_(ids))
+        return clauses
+
+    @classmethod
+    def running_at(cls, when):
+        """Returns the clause that matches Promotions whose [start_date, end_date] contains when
+
+        On PostgreSQL this is a range containment that the GiST index on
+        tsrange(start_date, end_date) serves; elsewhere it is the two column
+        range that the start_date and end_date indexes serve.
+        """
+        if db.engine.dialect.name == "postgresql":
+            period = db.func.tsrange(cls.start_date, cls.end_date, db.literal_column("'[]'"))
+            return period.op("@>")(db.cast(when, db.DateTime))
+        return db.and_(cls.start_date <= when, cls.end_date >= when)
+
+    @classmethod
+    def schedule(cls) -> list:
+        """Returns the (id, start_date, end_date) of every Promotion"""
+        logger.info("Processing schedule query ...")
+        return db.session.execute(select(cls.id, cls.start_date, cls.end_date)).all()
+
+    @classmethod
+    def active_terms(cls) -> list:
+        """Returns the id, promotion_id, name, type, amount and dates of every active Promotion"""
+        logger.info("Processing active terms query ...")
+        # table columns skip the ORM's row processing, which doubles the time of a large snapshot
+        table = cls.__table__.c
+        columns = (table.id, table.promotion_id, table.name, table.promotion_type, table.promotion_amount)
+        statement = select(*columns, table.start_date, table.end_date).where(table.state == "active").order_by(table.id)
+        return db.session.execute(statement).all()
+
+    @classmethod
+    def transition_many(cls, clauses, from_state, to_state, chunk_size=1000):
+        """
+        Moves every Promotion that matches the clauses from one state to another
+
+        Each chunk of chunk_size rows is one UPDATE ... RETURNING in its own short
+        transaction, so a large campaign never holds its row locks for long.
+        Returns the ids of the Promotions that changed state.
+
+        Args:
+            clauses (list): the WHERE clauses from Promotion.criteria
+            from_state (string): the state a Promotion must be in to change
+            to_state (string): the state to move the Promotions to
+            chunk_size (int): the most rows changed by one transaction
+        """
+        logger.info("Processing state change from %s to %s ...", from_state, to_state)
+        chunk = (
+            select(cls.id)
+            .where(*clauses, cls.state == from_state)
+            .order_by(cls.id)
+            .limit(chunk_size)
+            .scalar_subquery()
+        )
+        statement = (
+            update(cls)
+            .where(cls.id.in_(chunk), cls.state == from_state)
+            .values(state=to_state)
+            .returning(cls.id)
+            .execution_options(synchronize_session=False)
+        )
+        changed = []
+        while True:
+            try:
+                ids = db.session.scalars(statement).all()
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error("Error changing state after %d records", len(changed))
+                raise DataValidationError(e) from e
+            promotion_cache.invalidate(*ids)
+            changed.extend(ids)
+            if len(ids) < chunk_size:
+                return sorted(changed)
+
+    @classmethod
+    def _update_returning(cls, statement):
+        """Runs an UPDATE ... RETURNING and commits it without reloading the row"""
+        try:
+            promotion = db.session.execute(
+                statement, execution_options={"populate_existing": True}
+            ).scalar_one_or_none()
+            if promotion is not None:
+                # keep the returned values instead of expiring them on commit
+                db.session.expunge(promotion)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error("Error updating record: %s", statement)
+            raise DataValidationError(e) from e
+        return promotion
+
+    @classmethod
+    def versions(cls, query):
+        """Returns a query for the (id, version, start_date, end_date) of the Promotions in a query
+
+        These are all that is needed to build the ETag and Cache-Control of a list
+        without loading the Promotions.
+        """
+        return query.with_entities(cls.id, cls.version, cls.start_date, cls.end_date)
+
+    @classmethod
+    def paginate(cls, query, limit, after_id=None):
+        """Returns one keyset page of a query and whether more rows follow it
+
+        Args:
+            query (Query): the filtered query to page through
+            limit (int): the maximum number of Promotions in the page
+            after_id (int): the id of the last Promotion on the previous page
+        """
+        logger.info("Processing page of %d after id %s ...", limit, after_id)
+        query = query.order_by(cls.id)
+        if after_id is not None:
+            query = query.filter(cls.id > after_id)
+        promotions = query.limit(limit + 1).all()
+        return promotions[:limit], len(promotions) > limit
+
+
+class PromotionView(NamedTuple):
+    """
+    Read-only Promotion mapped straight from a Core row
+
+    A plain tuple with no identity map entry, instance state or attribute
+    instrumentation, for the endpoints that only read and serialize. The
+    first fields are in the order of Promotion.FIELDS.
+    """
+
+    id: int = None
+    name: str = None
+    promotion_id: str = None
+    start_date: datetime = None
+    end_date: datetime = None
+    promotion_type: PromotionType = None
+    promotion_amount: float = None
+    promotion_description: str = None
+    usage_count: int = None
+    state: str = None
+    version: int = None
+
+    @classmethod
+    def columns(cls, fields=None) -> list:
+        """Returns the promotion columns to SELECT for a view with the given fields
+
+        The id, version and dates are always read because the ETag and
+        Cache-Control of every response are built from them.
+        """
+        names = cls._fields if fields is None else set(fields) | {"id", "version", "start_date", "end_date"}
+        return [Promotion.__table__.c[name] for name in cls._fields if name in names]
+
+    @classmethod
+    def from_rows(cls, rows, fields=None):
+        """Maps rows SELECTed with columns(fields) to PromotionViews as they are read"""
+        if fields is None:
+            return map(cls._make, rows)
+        return (cls(**row._mapping) for row in rows)
+
+    def serialize(self, fields=None) -> dict:
+        """Serializes a PromotionView like Promotion.serialize"""
+        if fields is not None:
+            return {name: getattr(self, name) for name in fields}
+        return dict(zip(Promotion.FIELDS, self))
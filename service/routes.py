@@ -21,10 +21,23 @@ This service implements a REST API that allows you to Create, Read, Update
 and Delete Promotion
 """
 
-from flask import jsonify, request, abort
+from datetime import datetime, timezone
+from flask import jsonify, request, abort, url_for, stream_with_context
 from flask import current_app as app  # Import Flask application
-from service.models import Promotion, PromotionType
+from service.models import Promotion, PromotionType, PromotionView, DataValidationError
 from service.common import status  # HTTP Status Codes
+from service.common.pagination import encode_cursor, decode_cursor
+from service.common.usage_buffer import usage_buffer
+from service.common.interval_tree import live_index
+from service.common.evaluator import MAX_CENTS, cart_evaluator, to_cents
+from service.common.cache import promotion_cache
+from service.common.db_pool import pool_metrics
+from service.common.metrics import request_metrics
+from service.common.profiling import request_profiler
+from service.common.replicas import replica_router
+from service.common.conditional import cache_headers, collection_etag, resource_etag
+
+NDJSON_MIMETYPE = "application/x-ndjson"
 
 
 ############################################################
@@ -33,7 +46,31 @@ from service.common import status  # HTTP Status Codes
 @app.route("/health")
 def health():
     """Health Status"""
-    return jsonify(status="OK"), 200
+    message = {"status": "OK", "db_pool": pool_metrics.stats()}
+    if usage_buffer.enabled:
+        message["usage_buffer"] = usage_buffer.stats()
+    if live_index.enabled:
+        message["live_index"] = live_index.stats()
+    if promotion_cache.enabled:
+        message["promotion_cache"] = promotion_cache.stats()
+    if request_profiler.enabled:
+        message["profiler"] = request_profiler.stats()
+    if replica_router.enabled:
+        message["read_replicas"] = replica_router.stats()
+    if cart_evaluator.built:
+        message["cart_evaluator"] = cart_evaluator.stats()
+    return jsonify(message), 200
+
+
+######################################################################
+# GET METRICS
+######################################################################
+@app.route("/metrics")
+def metrics():
+    """Returns the request metrics of every worker in the Prometheus text format"""
+    if not request_metrics.enabled:
+        abort(status.HTTP_404_NOT_FOUND, "Request metrics are disabled")
+    return app.response_class(request_metrics.render(), mimetype="text/plain; version=0.0.4")
 
 
 ######################################################################
@@ -63,6 +100,8 @@ def create_promotions():
     # Get the data from the request and deserialize it
     promotion.deserialize(request.get_json())
     promotion.create()
+    live_index.invalidate()
+    cart_evaluator.invalidate()
     message = promotion.serialize()
     app.logger.info("Promotion with new id [%s] saved!", promotion.id)
 
@@ -79,22 +118,97 @@ def create_promotions():
     )
 
 
-def check_content_type(content_type) -> None:
+######################################################################
+# CREATE PROMOTIONS IN BULK
+######################################################################
+@app.route("/promotions/bulk", methods=["POST"])
+def create_promotions_bulk():
+    """
+    Create Promotions in bulk
+    This endpoint creates every Promotion in a JSON array or NDJSON body in one
+    transaction. With ?atomic=false the valid ones are created even if others fail.
+    """
+    app.logger.info("Request to Create Promotions in bulk...")
+    check_content_type("application/json", NDJSON_MIMETYPE)
+    atomic = request.args.get("atomic", "true").lower() not in ["false", "no", "0"]
+
+    items = read_bulk_items()
+    results = [{"index": index} for index in range(len(items))]
+    valid = []
+    for result, item in zip(results, items):
+        try:
+            if isinstance(item, DataValidationError):
+                raise item
+            valid.append((result, Promotion().deserialize(item)))
+        except DataValidationError as error:
+            result.update(status=status.HTTP_400_BAD_REQUEST, error=str(error))
+
+    failed = len(items) - len(valid)
+    if atomic and failed:
+        message = f"{failed} of {len(items)} promotions are invalid, none were created"
+        app.logger.warning(message)
+        errors = [result for result in results if "error" in result]
+        return (
+            jsonify(status=status.HTTP_400_BAD_REQUEST, error="Bad Request", message=message, results=errors),
+            status.HTTP_400_BAD_REQUEST,
+        )
+
+    created = Promotion.create_many([promotion for _, promotion in valid], atomic)
+    live_index.invalidate()
+    cart_evaluator.invalidate()
+    for (result, _), outcome in zip(valid, created):
+        if isinstance(outcome, DataValidationError):
+            failed += 1
+            result.update(status=status.HTTP_400_BAD_REQUEST, error=str(outcome))
+        else:
+            result.update(status=status.HTTP_201_CREATED, id=outcome)
+
+    app.logger.info("Created %d of %d promotions in bulk", len(items) - failed, len(items))
+    message = {"created": len(items) - failed, "failed": failed, "results": results}
+    return jsonify(message), status.HTTP_207_MULTI_STATUS if failed else status.HTTP_201_CREATED
+
+
+def read_bulk_items() -> list:
+    """Returns the promotions in a bulk request body, with a DataValidationError for bad NDJSON lines"""
+    if request.headers["Content-Type"] == NDJSON_MIMETYPE:
+        items = []
+        for number, line in enumerate(request.get_data(as_text=True).splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                items.append(app.json.loads(line))
+            except ValueError as error:
+                items.append(DataValidationError(f"Invalid JSON on line {number}: {error}"))
+    else:
+        items = request.get_json()
+        if not isinstance(items, list):
+            abort(status.HTTP_400_BAD_REQUEST, "Request body must be a JSON array of promotions")
+
+    if len(items) > app.config["BULK_MAX_ITEMS"]:
+        abort(
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            f"At most {app.config['BULK_MAX_ITEMS']} promotions can be created at once",
+        )
+    return items
+
+
+def check_content_type(*content_types) -> None:
     """Checks that the media type is correct"""
+    expected = " or ".join(content_types)
     if "Content-Type" not in request.headers:
         app.logger.error("No Content-Type specified.")
         abort(
             status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-            f"Content-Type must be {content_type}",
+            f"Content-Type must be {expected}",
         )
 
-    if request.headers["Content-Type"] == content_type:
+    if request.headers["Content-Type"] in content_types:
         return
 
     app.logger.error("Invalid Content-Type: %s", request.headers["Content-Type"])
     abort(
         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-        f"Content-Type must be {content_type}",
+        f"Content-Type must be {expected}",
     )
 
 
@@ -112,6 +226,8 @@ def delete_promotions(promotion_id):
     if promotion:
         app.logger.info("Promotion with ID: %d found.", promotion.id)
         promotion.delete()
+        live_index.invalidate()
+        cart_evaluator.invalidate()
 
     app.logger.info("Promotion with ID: %d delete complete.", promotion_id)
     return {}, status.HTTP_204_NO_CONTENT
@@ -127,15 +243,22 @@ def get_promotions(promotion_id):
     app.logger.info("Request to Retrieve a promotion with id [%s]", promotion_id)
 
     # Attempt to find the Promotion and abort if not found
-    promotion = Promotion.find(promotion_id)
+    fields = get_fields()
+    promotion = Promotion.find_view(promotion_id, fields)
     if not promotion:
         abort(
             status.HTTP_404_NOT_FOUND,
             f"Promotion with id '{promotion_id}' was not found.",
         )
 
-    app.logger.info("Returning promotion: %s", promotion.name)
-    return jsonify(promotion.serialize()), status.HTTP_200_OK
+    etag = resource_etag(promotion.id, promotion.version)
+    headers = cache_headers(etag, [promotion.start_date, promotion.end_date], app.config["CACHE_MAX_AGE"])
+    if request.if_none_match.contains_weak(etag):
+        app.logger.info("Promotion with id [%s] not modified", promotion_id)
+        return "", status.HTTP_304_NOT_MODIFIED, headers
+
+    app.logger.info("Returning promotion with id [%s]", promotion_id)
+    return jsonify(promotion.serialize(fields)), status.HTTP_200_OK, headers
 
 
 @app.route("/promotions/<int:promotion_id>", methods=["PUT"])
@@ -155,6 +278,8 @@ def update_promotion(promotion_id):
 
     promotion.deserialize(request.get_json())
     promotion.update()
+    live_index.invalidate()
+    cart_evaluator.invalidate()
 
     return jsonify(promotion.serialize()), status.HTTP_200_OK
 
@@ -165,16 +290,27 @@ def apply_promotion(promotion_id):
     Applies a promotion and increments its usage count
     """
     app.logger.info(f"Request to apply promotion with id: {promotion_id}")
-    promotion = Promotion.find(promotion_id)
+    if usage_buffer.enabled:
+        return apply_promotion_buffered(promotion_id)
+
+    promotion = Promotion.apply(promotion_id)
     if not promotion:
         abort(404, description=f"Promotion with id {promotion_id} not found")
 
-    promotion.usage_count += 1
-    promotion.update()
-
     return jsonify(promotion.serialize()), 200
 
 
+def apply_promotion_buffered(promotion_id):
+    """Counts an apply in the write-behind buffer instead of the database"""
+    promotion = Promotion.find_view(promotion_id)
+    if not promotion:
+        abort(404, description=f"Promotion with id {promotion_id} not found")
+
+    message = promotion.serialize()
+    message["usage_count"] += usage_buffer.add(promotion_id)
+    return jsonify(message), 200
+
+
 ######################################################################
 # LIST ALL promotions
 ######################################################################
@@ -183,13 +319,108 @@ def list_promotions():
     """Returns all of the Promotions or filters by query parameters"""
     app.logger.info("Request for promotion list")
 
-    allowed_params = {"promotion_id", "name", "promotion_type"}
+    allowed_params = {
+        "promotion_id",
+        "name",
+        "promotion_type",
+        "active_at",
+        "starts_after",
+        "ends_before",
+        "fields",
+        "limit",
+        "cursor",
+    }
     for key in request.args.keys():
         if key not in allowed_params:
             abort(400, description=f"Invalid query parameter: {key}")
 
-    query = Promotion.query
-
+    code = cached_promotion_id()
+    if code:
+        return list_by_promotion_id(code)
+
+    query = apply_list_filters(Promotion.query)
+    page = get_page_params()
+    ndjson = wants_ndjson()
+
+    headers = {}
+    if request.if_none_match:
+        # decide from the ids and versions alone, before any Promotion is loaded or serialized
+        versions, has_more = list_page(Promotion.versions(query), page)
+        headers = list_cache_headers(versions, has_more, ndjson)
+        if request.if_none_match.contains_weak(headers["ETag"].strip('"')):
+            app.logger.info("Promotion list not modified")
+            return "", status.HTTP_304_NOT_MODIFIED, headers
+
+    fields = get_fields()
+    rows, has_more = list_page(Promotion.views(query, fields), page)
+    if has_more:
+        headers.update(next_page_headers(rows[-1].id, page[0]))
+
+    if ndjson:
+        if page is None:
+            rows = rows.yield_per(app.config["STREAM_BATCH_SIZE"])
+        return stream_ndjson(PromotionView.from_rows(rows, fields), fields), status.HTTP_200_OK, headers
+
+    promotions = list(PromotionView.from_rows(rows, fields))
+    if "ETag" not in headers:
+        versions = [(promotion.id, promotion.version, promotion.start_date, promotion.end_date) for promotion in promotions]
+        headers.update(list_cache_headers(versions, has_more, ndjson))
+    results = [promotion.serialize(fields) for promotion in promotions]
+    app.logger.info("Returning %d promotions", len(results))
+    return jsonify(results), status.HTTP_200_OK, headers
+
+
+def cached_promotion_id():
+    """Returns the promotion_id of a list request the promotion cache can answer, or None"""
+    if not promotion_cache.enabled or not set(request.args) <= {"promotion_id", "fields"} or wants_ndjson():
+        return None
+    return request.args.get("promotion_id")
+
+
+def list_by_promotion_id(code):
+    """Returns the list of the Promotion with a promotion_id without a query when it is cached"""
+    app.logger.info("Filter by promotion_id: %s", code)
+    fields = get_fields()
+    promotion = Promotion.find_view_by_promotion_id(code)
+    promotions = [promotion] if promotion else []
+    versions = [(promotion.id, promotion.version, promotion.start_date, promotion.end_date) for promotion in promotions]
+    headers = list_cache_headers(versions, False, False)
+    if request.if_none_match.contains_weak(headers["ETag"].strip('"')):
+        app.logger.info("Promotion list not modified")
+        return "", status.HTTP_304_NOT_MODIFIED, headers
+    app.logger.info("Returning %d promotions", len(promotions))
+    return jsonify([promotion.serialize(fields) for promotion in promotions]), status.HTTP_200_OK, headers
+
+
+def get_fields():
+    """Returns the Promotion fields a request asks for with ?fields= or None for all of them"""
+    fields_param = request.args.get("fields")
+    if fields_param is None:
+        return None
+    fields = list(dict.fromkeys(name.strip() for name in fields_param.split(",") if name.strip()))
+    unknown = [name for name in fields if name not in Promotion.FIELDS]
+    if unknown or not fields:
+        abort(status.HTTP_400_BAD_REQUEST, f"Invalid fields: {', '.join(unknown) or fields_param}")
+    return fields
+
+
+def list_page(query, page):
+    """Returns the Promotions of a list request in id order and whether more rows follow them"""
+    if page is None:
+        return query.order_by(Promotion.id), False
+    limit, after_id = page
+    return Promotion.paginate(query, limit, after_id)
+
+
+def list_cache_headers(versions, has_more, ndjson) -> dict:
+    """Returns the ETag and Cache-Control of a list from the (id, version, start_date, end_date) in it"""
+    etag = collection_etag(versions, ndjson, has_more)
+    boundaries = [boundary for row in versions for boundary in row[2:4]]
+    return cache_headers(etag, boundaries, app.config["CACHE_MAX_AGE"])
+
+
+def apply_list_filters(query):
+    """Applies the filters in the query string of a list request"""
     promotion_id = request.args.get("promotion_id")
     name = request.args.get("name")
     promotion_type_param = request.args.get("promotion_type")
@@ -209,10 +440,82 @@ def list_promotions():
         except ValueError:
             abort(400, description=f"Invalid promotion_type: {promotion_type_param}")
 
-    promotions = query.all()
-    results = [promotion.serialize() for promotion in promotions]
-    app.logger.info("Returning %d promotions", len(results))
-    return jsonify(results), status.HTTP_200_OK
+    return apply_date_filters(query)
+
+
+def apply_date_filters(query):
+    """Applies the active_at, starts_after and ends_before filters of a list request"""
+    dates = {}
+    for key in ("active_at", "starts_after", "ends_before"):
+        if request.args.get(key):
+            dates[key] = parse_datetime(key, request.args[key])
+    if not dates:
+        return query
+    app.logger.info("Filter by dates: %s", dates)
+
+    if "active_at" in dates and live_index.enabled:
+        # the interval tree finds the running promotions, the primary key fetches them
+        ids = live_index.ids_at(dates["active_at"])
+        if len(ids) <= live_index.max_ids:
+            query = query.filter(Promotion.id.in_(ids))
+            del dates["active_at"]
+        else:
+            app.logger.info("%d promotions running, filtering active_at in SQL", len(ids))
+    return query.filter(*Promotion.criteria(**dates))
+
+
+def wants_ndjson() -> bool:
+    """Checks if the client prefers newline delimited JSON over a JSON array"""
+    best = request.accept_mimetypes.best_match(["application/json", NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def stream_ndjson(promotions, fields=None):
+    """Returns a streaming response that serializes one Promotion per line"""
+
+    def generate():
+        count = 0
+        for promotion in promotions:
+            count += 1
+            yield app.json.dumps(promotion.serialize(fields)) + "\n"
+        app.logger.info("Streamed %d promotions", count)
+
+    return app.response_class(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def next_page_headers(last_id, limit) -> dict:
+    """Returns the Link and X-Next-Cursor headers that point at the next page"""
+    next_cursor = encode_cursor(last_id)
+    args = request.args.to_dict()
+    args.update(limit=limit, cursor=next_cursor)
+    next_url = url_for("list_promotions", _external=True, **args)
+    return {"Link": f'<{next_url}>; rel="next"', "X-Next-Cursor": next_cursor}
+
+
+def get_page_params():
+    """Returns the (limit, after_id) of a paged list request or None if it is not paged"""
+    limit_param = request.args.get("limit")
+    cursor = request.args.get("cursor")
+    if limit_param is None and cursor is None:
+        return None
+
+    limit = app.config["PAGE_SIZE_DEFAULT"]
+    if limit_param is not None:
+        try:
+            limit = int(limit_param)
+        except ValueError:
+            abort(status.HTTP_400_BAD_REQUEST, f"Invalid limit: {limit_param}")
+        if limit < 1:
+            abort(status.HTTP_400_BAD_REQUEST, f"Invalid limit: {limit_param}")
+    limit = min(limit, app.config["PAGE_SIZE_MAX"])
+
+    after_id = None
+    if cursor:
+        try:
+            after_id = decode_cursor(cursor)
+        except ValueError as error:
+            abort(status.HTTP_400_BAD_REQUEST, str(error))
+    return limit, after_id
 
 
 ######################################################################
@@ -223,24 +526,155 @@ def cancel_promotion(promotion_id):
     """Cancel a Promotion by changing its state to 'canceled'"""
     app.logger.info("Request to cancel promotion with id: %d", promotion_id)
 
-    # Find the promotion
-    promotion = Promotion.find(promotion_id)
+    # Only an active promotion is canceled
+    promotion = Promotion.cancel(promotion_id)
     if not promotion:
-        abort(
-            status.HTTP_404_NOT_FOUND,
-            f"Promotion with id '{promotion_id}' was not found.",
-        )
-
-    # Only cancel if currently active
-    if promotion.state != "active":
+        # Find out why nothing was canceled
+        if not Promotion.find(promotion_id):
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Promotion with id '{promotion_id}' was not found.",
+            )
         abort(
             status.HTTP_409_CONFLICT,
             f"Promotion with id '{promotion_id}' cannot be canceled because it is not active.",
         )
 
-    # Perform the state change
-    promotion.state = "canceled"
-    promotion.update()
-
+    cart_evaluator.invalidate()
     app.logger.info("Promotion with ID: %d has been canceled.", promotion_id)
     return jsonify(promotion.serialize()), status.HTTP_200_OK
+
+
+######################################################################
+# CHANGE THE STATE OF PROMOTIONS IN BULK
+######################################################################
+# The state a Promotion must be in to move to each target state
+STATE_TRANSITIONS = {"canceled": "active", "active": "canceled"}
+
+
+@app.route("/promotions/state", methods=["PUT"])
+def change_promotions_state():
+    """
+    Change the state of Promotions in bulk
+    This endpoint cancels or reactivates every Promotion that matches the
+    filter in the body with set-based UPDATEs
+    """
+    app.logger.info("Request to change the state of promotions in bulk")
+    check_content_type("application/json")
+
+    data = request.get_json()
+    if not isinstance(data, dict):
+        abort(status.HTTP_400_BAD_REQUEST, "Request body must be a JSON object")
+    to_state = data.get("state")
+    if to_state not in STATE_TRANSITIONS:
+        abort(status.HTTP_400_BAD_REQUEST, f"Invalid state: {to_state}")
+
+    clauses = Promotion.criteria(**read_bulk_filter(data))
+    if not clauses:
+        abort(status.HTTP_400_BAD_REQUEST, "At least one filter is required")
+
+    ids = Promotion.transition_many(
+        clauses, STATE_TRANSITIONS[to_state], to_state, app.config["BULK_CHUNK_SIZE"]
+    )
+    cart_evaluator.invalidate()
+    app.logger.info("Moved %d promotions to %s", len(ids), to_state)
+    return jsonify(state=to_state, count=len(ids), ids=ids), status.HTTP_200_OK
+
+
+def read_bulk_filter(data) -> dict:
+    """Returns the Promotion.criteria arguments for the filter in a bulk request body"""
+    allowed_keys = {"state", "promotion_type", "name", "starts_after", "ends_before", "ids"}
+    for key in data:
+        if key not in allowed_keys:
+            abort(status.HTTP_400_BAD_REQUEST, f"Invalid filter: {key}")
+
+    bulk_filter = {"name": data.get("name")}
+    if data.get("promotion_type") is not None:
+        try:
+            bulk_filter["promotion_type"] = PromotionType(data["promotion_type"])
+        except ValueError:
+            abort(status.HTTP_400_BAD_REQUEST, f"Invalid promotion_type: {data['promotion_type']}")
+    for key in ("starts_after", "ends_before"):
+        if data.get(key) is not None:
+            bulk_filter[key] = parse_datetime(key, data[key])
+    if data.get("ids") is not None:
+        ids = data["ids"]
+        if not isinstance(ids, list) or not all(
+            isinstance(by_id, int) and not isinstance(by_id, bool) for by_id in ids
+        ):
+            abort(status.HTTP_400_BAD_REQUEST, "ids must be a list of integers")
+        bulk_filter["ids"] = ids
+    return bulk_filter
+
+
+######################################################################
+# EVALUATE A CART
+######################################################################
+@app.route("/promotions/evaluate", methods=["POST"])
+def evaluate_cart():
+    """
+    Evaluate a cart
+    This endpoint returns the subtotal of a cart and what each running
+    Promotion takes off it, the biggest discount first
+    """
+    app.logger.info("Request to evaluate a cart")
+    check_content_type("application/json")
+
+    data = request.get_json()
+    if not isinstance(data, dict):
+        abort(status.HTTP_400_BAD_REQUEST, "Request body must be a JSON object")
+    prices, quantities = read_cart_items(data.get("items"))
+    limit = data.get("limit")
+    if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 1):
+        abort(status.HTTP_400_BAD_REQUEST, f"Invalid limit: {limit}")
+
+    result = cart_evaluator.evaluate(prices, quantities, read_cart_time(data.get("at")), limit)
+    app.logger.info("Evaluated %d lines against %d running promotions", len(prices), result["count"])
+    return jsonify(result), status.HTTP_200_OK
+
+
+def read_cart_items(items) -> tuple:
+    """Returns the prices and quantities of the lines of a cart or aborts with 400_BAD_REQUEST"""
+    if not isinstance(items, list):
+        abort(status.HTTP_400_BAD_REQUEST, "items must be a list of cart lines")
+    if len(items) > app.config["EVALUATE_MAX_ITEMS"]:
+        abort(
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            f"At most {app.config['EVALUATE_MAX_ITEMS']} lines can be evaluated at once",
+        )
+    prices, quantities = [], []
+    subtotal = 0
+    for line, item in enumerate(items):
+        if not isinstance(item, dict):
+            abort(status.HTTP_400_BAD_REQUEST, f"Invalid line {line}: {item}")
+        price, quantity = item.get("price"), item.get("quantity", 1)
+        if isinstance(price, bool) or not isinstance(price, (int, float)) or not 0 <= price * 100 < MAX_CENTS:
+            abort(status.HTTP_400_BAD_REQUEST, f"Invalid price on line {line}: {price}")
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or not 1 <= quantity < MAX_CENTS:
+            abort(status.HTTP_400_BAD_REQUEST, f"Invalid quantity on line {line}: {quantity}")
+        # summed in Python ints, so the NumPy subtotal is known to fit in int64 before it is computed
+        subtotal += to_cents(price) * quantity
+        if subtotal >= MAX_CENTS:
+            abort(status.HTTP_400_BAD_REQUEST, f"The subtotal is over {MAX_CENTS // 100} on line {line}")
+        prices.append(price)
+        quantities.append(quantity)
+    return prices, quantities
+
+
+def read_cart_time(value) -> datetime:
+    """Returns the time of a cart as a naive UTC datetime, now when it has none"""
+    if value is None:
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+    return parse_datetime("at", value)
+
+
+def parse_datetime(name, value):
+    """Parses an ISO 8601 date filter as a naive UTC datetime or aborts with 400_BAD_REQUEST"""
+    try:
+        when = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        abort(status.HTTP_400_BAD_REQUEST, f"Invalid {name}: {value}")
+    # the dates are stored as naive UTC, so an offset is converted instead of compared or dropped
+    if when.tzinfo is not None:
+        when = when.astimezone(timezone.utc).replace(tzinfo=None)
+    return when
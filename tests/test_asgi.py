@@ -0,0 +1,167 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for serving the app over ASGI
+
+Every REST API test runs again through a2wsgi's WSGIMiddleware, the
+adapter behind asgi:app.
+"""
+import asyncio
+import threading
+import time
+from http import HTTPStatus
+from unittest import TestCase
+
+from a2wsgi import WSGIMiddleware
+from flask.testing import FlaskClient
+from werkzeug.test import run_wsgi_app
+
+from wsgi import app
+from service.common import status
+from tests import test_routes
+
+
+def http_scope(method="GET", path="/", query=b"", headers=None) -> dict:
+    """Returns the ASGI scope of an HTTP request"""
+    return {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "path": path,
+        "query_string": query,
+        "headers": headers or [],
+        "server": ("testserver", 8080),
+        "client": ("127.0.0.1", 50000),
+    }
+
+
+def call(asgi_app, scope: dict, body: bytes = b"", chunk: int = 0) -> list:
+    """Runs one request through an ASGI app and returns the messages it sent"""
+    parts = [body[offset:offset + chunk] for offset in range(0, len(body), chunk)] if chunk and body else [body]
+    incoming = [
+        {"type": "http.request", "body": part, "more_body": number < len(parts) - 1} for number, part in enumerate(parts)
+    ]
+    sent = []
+
+    async def receive():
+        return incoming.pop(0) if incoming else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi_app(scope, receive, send))
+    return sent
+
+
+class AsgiToWsgi:  # pylint: disable=too-few-public-methods
+    """Lets the werkzeug test client send its requests through an ASGI app"""
+
+    def __init__(self, asgi_app):
+        self.asgi_app = asgi_app
+
+    def __call__(self, environ, start_response):
+        headers = [
+            (key[5:].replace("_", "-").lower().encode("latin-1"), value.encode("latin-1"))
+            for key, value in environ.items()
+            if key.startswith("HTTP_")
+        ]
+        for key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            if environ.get(key):
+                headers.append((key.replace("_", "-").lower().encode("latin-1"), environ[key].encode("latin-1")))
+        scope = http_scope(
+            environ["REQUEST_METHOD"],
+            environ["PATH_INFO"].encode("latin-1").decode("utf-8"),
+            environ.get("QUERY_STRING", "").encode("latin-1"),
+            headers,
+        )
+        sent = call(self.asgi_app, scope, environ["wsgi.input"].read())
+        code = sent[0]["status"]
+        start_response(
+            f"{code} {HTTPStatus(code).phrase}",
+            [(name.decode("latin-1"), value.decode("latin-1")) for name, value in sent[0]["headers"]],
+        )
+        return [b"".join(message.get("body", b"") for message in sent[1:])]
+
+
+class AsgiClient(FlaskClient):
+    """The Flask test client, sending its requests through an ASGI adapter of the app"""
+
+    adapter = None
+
+    def run_wsgi_app(self, environ, buffered=False):
+        return run_wsgi_app(AsgiToWsgi(self.adapter), environ, buffered=buffered)
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestConcurrency(TestCase):
+    """The middleware with a small WSGI app"""
+
+    def test_requests_run_at_once(self):
+        """It should run as many slow requests at once as it has threads"""
+
+        def wsgi_app(environ, start_response):
+            time.sleep(0.2)
+            start_response("200 OK", [("X-Thread", threading.current_thread().name)])
+            return [environ["wsgi.input"].read()]
+
+        middleware = WSGIMiddleware(wsgi_app, workers=4)
+
+        async def run_all():
+            return await asyncio.gather(
+                *(asyncio.to_thread(call, middleware, http_scope("POST"), b"hello") for _ in range(4))
+            )
+
+        start = time.perf_counter()
+        results = asyncio.run(run_all())
+        middleware.executor.shutdown()
+        self.assertLess(time.perf_counter() - start, 0.6)
+        self.assertEqual({len(set(dict(sent[0]["headers"])[b"x-thread"] for sent in results))}, {4})
+        self.assertEqual([b"".join(message.get("body", b"") for message in sent[1:]) for sent in results], [b"hello"] * 4)
+
+
+class TestPromotionServiceAsgi(test_routes.TestPromotionService):
+    """Runs every REST API test through the ASGI middleware"""
+
+    adapter = None
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.adapter = WSGIMiddleware(app, workers=4)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.adapter.executor.shutdown()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.client = AsgiClient(app, app.response_class)
+        self.client.adapter = self.adapter
+
+    def test_served_by_adapter(self):
+        """It should answer on a middleware thread"""
+        threads = []
+        app.before_request_funcs.setdefault(None, []).append(lambda: threads.append(threading.current_thread().name))
+        try:
+            resp = self.client.get("/")
+        finally:
+            app.before_request_funcs[None].pop()
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(threads[0].startswith("WSGI"))
@@ -19,14 +19,17 @@ CLI Command Extensions for Flask
 """
 
 # pylint: disable=duplicate-code
+import json
 import os
+import tempfile
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
 
 # pylint: disable=unused-import
 from wsgi import app  # noqa: F401
-from service.common.cli_commands import db_create  # noqa: E402
+from service import migrations  # noqa: E402
+from service.common.cli_commands import db_create, db_upgrade, load_test  # noqa: E402
 
 
 class TestFlaskCLI(TestCase):
@@ -35,10 +38,57 @@ class TestFlaskCLI(TestCase):
     def setUp(self):
         self.runner = CliRunner()
 
+    @patch("service.common.cli_commands.migrations")
     @patch("service.common.cli_commands.db")
-    def test_db_create(self, db_mock):
+    def test_db_create(self, db_mock, migrations_mock):
         """It should call the db-create command"""
         db_mock.return_value = MagicMock()
         with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+        migrations_mock.drop_all.assert_called_once()
+        migrations_mock.upgrade.assert_called_once()
+
+    @patch("service.common.cli_commands.migrations")
+    @patch("service.common.cli_commands.db")
+    def test_db_upgrade(self, db_mock, migrations_mock):
+        """It should call the db-upgrade command"""
+        db_mock.return_value = MagicMock()
+        migrations_mock.upgrade.return_value = [2, 3]
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(db_upgrade)
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("version 3", result.output)
+
+            migrations_mock.upgrade.return_value = []
+            migrations_mock.latest_version.return_value = 3
+            result = self.runner.invoke(db_upgrade)
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("up to date", result.output)
+
+            migrations_mock.MigrationError = migrations.MigrationError
+            migrations_mock.upgrade.side_effect = migrations.MigrationError("promotions start after they end")
+            result = self.runner.invoke(db_upgrade)
+            self.assertEqual(result.exit_code, 1)
+            self.assertIn("start after they end", result.output)
+
+    def test_load_test(self):
+        """It should run a load test in process and write the results"""
+        with tempfile.TemporaryDirectory() as tempdir, patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            output = os.path.join(tempdir, "results.json")
+            result = self.runner.invoke(load_test, ["--requests", "10", "--mix", "list=1,get=1", "--output", output])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn("p99_ms", result.output)
+            with open(output, encoding="utf-8") as file:
+                report = json.load(file)
+        self.assertEqual(report["total"]["requests"], 10)
+        self.assertEqual(report["settings"]["mix"], {"list": 1.0, "get": 1.0})
+
+    def test_load_test_bad_options(self):
+        """It should reject a bad mix and a load test without an end"""
+        with patch.dict(os.environ, {"FLASK_APP": "wsgi:app"}, clear=True):
+            result = self.runner.invoke(load_test, ["--mix", "list=1,refund=1"])
+            self.assertEqual(result.exit_code, 2)
+            self.assertIn("Unknown operation", result.output)
+            result = self.runner.invoke(load_test, ["--duration", "0"])
+            self.assertEqual(result.exit_code, 2)
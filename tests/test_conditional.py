@@ -0,0 +1,60 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for Conditional Requests
+"""
+
+from datetime import datetime, timedelta
+from unittest import TestCase
+from service.common.conditional import cache_headers, collection_etag, max_age, resource_etag
+
+
+######################################################################
+#  C O N D I T I O N A L   T E S T   C A S E S
+######################################################################
+class TestConditional(TestCase):
+    """Test Cases for ETags and Cache-Control"""
+
+    def test_resource_etag(self):
+        """It should build the ETag of a Promotion from its id and version"""
+        self.assertEqual(resource_etag(7, 3), "7-3")
+
+    def test_collection_etag(self):
+        """It should change the ETag of a list with its ids, versions, order and variant"""
+        etag = collection_etag([(1, 1), (2, 1)], False)
+        self.assertEqual(etag, collection_etag([(1, 1, "ignored"), (2, 1)], False))
+        self.assertNotEqual(etag, collection_etag([(1, 1), (2, 2)], False))
+        self.assertNotEqual(etag, collection_etag([(2, 1), (1, 1)], False))
+        self.assertNotEqual(etag, collection_etag([(1, 1), (2, 1)], True))
+        self.assertNotEqual(etag, collection_etag([(1, 1)], False))
+
+    def test_max_age(self):
+        """It should cache a response until the next boundary, and never longer than the limit"""
+        now = datetime(2025, 1, 1)
+        past, soon, later = now - timedelta(days=1), now + timedelta(seconds=10), now + timedelta(hours=1)
+        self.assertEqual(max_age([], 60, now), 60)
+        self.assertEqual(max_age([past], 60, now), 60)
+        self.assertEqual(max_age([past, later, soon], 60, now), 10)
+        self.assertEqual(max_age([later], 60, now), 60)
+        self.assertEqual(max_age([now + timedelta(milliseconds=5)], 60, now), 0)
+
+    def test_cache_headers(self):
+        """It should quote the ETag and vary on Accept"""
+        headers = cache_headers("7-3", [], 60)
+        self.assertEqual(headers["ETag"], '"7-3"')
+        self.assertEqual(headers["Cache-Control"], "public, max-age=60")
+        self.assertEqual(headers["Vary"], "Accept")
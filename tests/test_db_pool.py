@@ -0,0 +1,116 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Database Connection Pool
+"""
+import os
+import tempfile
+from unittest import TestCase
+from sqlalchemy import create_engine, exc, text
+from wsgi import app
+from service.common import status
+from service.common.db_pool import PoolMetrics, TimedQueuePool, engine_options
+
+
+def pool_config(uri: str) -> dict:
+    """Returns a configuration with the pool settings for a database URI"""
+    return {
+        "SQLALCHEMY_DATABASE_URI": uri,
+        "DB_POOL_SIZE": 2,
+        "DB_MAX_OVERFLOW": 1,
+        "DB_POOL_TIMEOUT": 0.05,
+        "DB_POOL_RECYCLE": 300,
+        "DB_POOL_PRE_PING": True,
+    }
+
+
+######################################################################
+#  E N G I N E   O P T I O N S   T E S T   C A S E S
+######################################################################
+class TestEngineOptions(TestCase):
+    """Test Cases for the pool engine options"""
+
+    def test_sized_pool(self):
+        """It should size a timed queue pool for server databases"""
+        options = engine_options(pool_config("postgresql+psycopg://postgres@localhost/testdb"))
+        self.assertIs(options["poolclass"], TimedQueuePool)
+        self.assertEqual(options["pool_size"], 2)
+        self.assertEqual(options["max_overflow"], 1)
+        self.assertEqual(options["pool_timeout"], 0.05)
+        self.assertEqual(options["pool_recycle"], 300)
+        self.assertTrue(options["pool_pre_ping"])
+
+    def test_in_memory_sqlite(self):
+        """It should not size the pool of an in-memory SQLite database"""
+        for uri in ("sqlite://", "sqlite:///:memory:"):
+            options = engine_options(pool_config(uri))
+            self.assertEqual(options, {"pool_pre_ping": True, "pool_recycle": 300})
+        self.assertIn("pool_size", engine_options(pool_config("sqlite:////tmp/pool.db")))
+
+
+######################################################################
+#  P O O L   M E T R I C S   T E S T   C A S E S
+######################################################################
+class TestPoolMetrics(TestCase):
+    """Test Cases for the pool metrics"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        uri = f"sqlite:///{os.path.join(self.directory.name, 'pool.db')}"
+        self.engine = create_engine(uri, **engine_options(pool_config(uri)))
+        self.metrics = PoolMetrics()
+        self.metrics.watch(self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def test_counts_checkouts(self):
+        """It should count checkouts, checkins and connects"""
+        with self.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            stats = self.metrics.stats()
+            self.assertEqual(stats["checked_out"], 1)
+        stats = self.metrics.stats()
+        self.assertEqual((stats["checkouts"], stats["checkins"], stats["connects"]), (1, 1, 1))
+        self.assertEqual((stats["size"], stats["checked_out"], stats["checked_in"]), (2, 0, 1))
+        self.assertEqual(stats["waits"], 1)
+        self.assertGreaterEqual(stats["wait_ms_max"], stats["wait_ms_avg"])
+
+    def test_overflow_and_timeout(self):
+        """It should report overflow connections and checkouts that time out"""
+        connections = [self.engine.connect() for _ in range(3)]
+        stats = self.metrics.stats()
+        self.assertEqual((stats["checked_out"], stats["overflow"], stats["max_overflow"]), (3, 1, 1))
+        self.assertRaises(exc.TimeoutError, self.engine.connect)
+        for connection in connections:
+            connection.close()
+        stats = self.metrics.stats()
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["waits"], 4)
+        self.assertGreaterEqual(stats["wait_ms_max"], 50)
+
+    def test_without_engine(self):
+        """It should report only counters before it watches an engine"""
+        self.assertEqual(PoolMetrics().stats(), {"checkouts": 0, "checkins": 0, "connects": 0, "invalidations": 0})
+
+    def test_health(self):
+        """It should report the pool of the service in the health check"""
+        client = app.test_client()
+        resp = client.get("/health")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn("checkouts", resp.get_json()["db_pool"])
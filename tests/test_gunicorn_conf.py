@@ -0,0 +1,171 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the gunicorn configuration
+"""
+import gc
+import logging
+import os
+import runpy
+import tempfile
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import patch
+
+from wsgi import app
+from service.common.metrics import IN_FLIGHT, request_metrics
+from service.common.replicas import replica_router
+from service.models import db
+
+CONFIG = os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py")
+
+
+def load_config(**env) -> dict:
+    """Reads gunicorn.conf.py with only the given gunicorn variables set"""
+    names = (
+        "GUNICORN_THREADS", "GUNICORN_WORKER_CLASS", "WEB_CONCURRENCY", "GUNICORN_PRELOAD", "DB_MAX_OVERFLOW", "METRICS_DIR"
+    )
+    clean = {name: value for name, value in os.environ.items() if name not in names}
+    with patch.dict(os.environ, {**clean, **env}, clear=True):
+        return runpy.run_path(CONFIG)
+
+
+def fake_server(preload: bool = True):
+    """Returns the parts of a gunicorn arbiter the hooks use"""
+    return SimpleNamespace(
+        cfg=SimpleNamespace(preload_app=preload),
+        app=SimpleNamespace(wsgi=lambda: app),
+        log=logging.getLogger("gunicorn.error"),
+    )
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestGunicornConfig(TestCase):
+    """gunicorn.conf.py"""
+
+    def test_threaded_by_default(self):
+        """It should run gthread workers, one per CPU plus one, with preloading"""
+        with patch("multiprocessing.cpu_count", return_value=4):
+            config = load_config()
+        self.assertEqual(config["worker_class"], "gthread")
+        self.assertEqual(config["threads"], 4)
+        self.assertEqual(config["workers"], 5)
+        self.assertTrue(config["preload_app"])
+
+    def test_sync_workers(self):
+        """It should run twice the CPUs plus one sync workers without threads"""
+        with patch("multiprocessing.cpu_count", return_value=4):
+            config = load_config(GUNICORN_THREADS="1")
+        self.assertEqual(config["worker_class"], "sync")
+        self.assertEqual(config["workers"], 9)
+
+    def test_settings_from_env(self):
+        """It should take the worker class, workers and threads from the environment"""
+        config = load_config(
+            GUNICORN_WORKER_CLASS="gevent", WEB_CONCURRENCY="3", GUNICORN_THREADS="50", GUNICORN_PRELOAD="false"
+        )
+        self.assertEqual(config["worker_class"], "gevent")
+        self.assertEqual(config["workers"], 3)
+        self.assertEqual(config["threads"], 15)  # capped at DB_POOL_SIZE + DB_MAX_OVERFLOW
+        self.assertFalse(config["preload_app"])
+
+    def test_fork_hooks(self):
+        """It should freeze the collector before a fork and drop the inherited connections after"""
+        config = load_config()
+        server = fake_server()
+        with app.app_context():
+            with db.engine.connect():
+                pass
+            pool = db.engine.pool
+            config["when_ready"](server)
+            self.assertIsNot(db.engine.pool, pool)
+            try:
+                config["pre_fork"](server, None)
+                self.assertGreater(gc.get_freeze_count(), 0)
+                pool = db.engine.pool
+                config["post_fork"](server, SimpleNamespace(pid=os.getpid()))
+                self.assertIsNot(db.engine.pool, pool)
+            finally:
+                gc.unfreeze()
+
+    def test_fork_hooks_with_replicas(self):
+        """It should drop the inherited connections to the read replicas too"""
+        config = load_config()
+        app.config["DATABASE_REPLICA_URIS"] = ["sqlite://"]
+        replica_router.init_app(app)
+        try:
+            engine = replica_router.replicas[0].engine
+            with engine.connect():
+                pass
+            pool = engine.pool
+            with app.app_context():
+                config["post_fork"](fake_server(), SimpleNamespace(pid=os.getpid()))
+            gc.unfreeze()
+            self.assertIsNot(engine.pool, pool)
+        finally:
+            app.config["DATABASE_REPLICA_URIS"] = []
+            replica_router.init_app(app)
+
+    def test_hooks_without_preload(self):
+        """It should leave the engine alone when the workers create their own app"""
+        config = load_config()
+        server = fake_server(preload=False)
+        with app.app_context():
+            pool = db.engine.pool
+            config["when_ready"](server)
+            config["post_fork"](server, SimpleNamespace(pid=os.getpid()))
+            gc.unfreeze()
+            self.assertIs(db.engine.pool, pool)
+
+    def test_shared_metrics_by_default(self):
+        """It should share the metrics of the workers through a directory unless one is set"""
+        config = load_config()
+        self.assertTrue(config["_metrics_dir"].endswith("promotion-metrics"))
+        self.assertEqual(load_config(METRICS_DIR="/tmp/metrics")["_metrics_dir"], "/tmp/metrics")
+
+        config = load_config(METRICS_DIR="", WEB_CONCURRENCY="3")
+        with self.assertLogs("gunicorn.error", level="WARNING") as logs:
+            config["on_starting"](fake_server())
+        self.assertIn("METRICS_DIR is empty", logs.output[0])
+        config = load_config(METRICS_DIR="", WEB_CONCURRENCY="1")
+        with self.assertNoLogs("gunicorn.error", level="WARNING"):
+            config["on_starting"](fake_server())
+
+    def test_metrics_files(self):
+        """It should clear old metrics files at start and zero the in-flight requests of dead workers"""
+        directory = request_metrics.directory
+        with tempfile.TemporaryDirectory() as parent:
+            metrics_dir = os.path.join(parent, "metrics")
+            config = load_config(METRICS_DIR=metrics_dir)
+            config["on_starting"](fake_server())
+            stale = os.path.join(metrics_dir, "metrics_1.db")
+            with open(stale, "wb") as file:
+                file.write(bytes(8 * (IN_FLIGHT + 1)))
+            config["on_starting"](fake_server())
+            self.assertFalse(os.path.exists(stale))
+            with open(os.path.join(metrics_dir, "metrics_2.db"), "wb") as file:
+                file.write(b"\xff" * (8 * (IN_FLIGHT + 1)))
+            request_metrics.directory = ""
+            try:
+                config["child_exit"](None, SimpleNamespace(pid=2))
+            finally:
+                request_metrics.directory = directory
+            with open(os.path.join(metrics_dir, "metrics_2.db"), "rb") as file:
+                file.seek(IN_FLIGHT * 8)
+                self.assertEqual(file.read(8), bytes(8))
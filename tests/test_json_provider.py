@@ -0,0 +1,100 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the JSON Provider
+"""
+
+import importlib.util
+import json
+import sys
+from datetime import date, datetime
+from unittest import TestCase
+from unittest.mock import patch
+from wsgi import app
+from service.common.json_provider import PromotionJSONProvider, _default
+from service.models import PromotionType
+from .factories import PromotionFactory
+
+
+######################################################################
+#  J S O N   P R O V I D E R   T E S T   C A S E S
+######################################################################
+class TestJSONProvider(TestCase):
+    """Test Cases for the JSON Provider"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.provider = PromotionJSONProvider(app)
+
+    def test_app_uses_provider(self):
+        """It should be the JSON provider of the app"""
+        self.assertIsInstance(app.json, PromotionJSONProvider)
+
+    def test_dumps_raw_values(self):
+        """It should encode datetimes as ISO 8601 and enums as their values"""
+        promotion = PromotionFactory(id=7, start_date=datetime(2025, 3, 1, 9, 30, 15, 250000))
+        data = json.loads(self.provider.dumps(promotion.serialize()))
+        self.assertEqual(data["start_date"], "2025-03-01T09:30:15.250000")
+        self.assertEqual(data["end_date"], promotion.end_date.isoformat())
+        self.assertEqual(data["promotion_type"], promotion.promotion_type.value)
+        self.assertEqual(list(data), sorted(data))
+
+    def test_dumps_options(self):
+        """It should honor indent and non string keys like json.dumps"""
+        self.assertEqual(self.provider.dumps({2: "b", 1: "a"}), '{"1":"a","2":"b"}')
+        self.assertIn("\n  ", self.provider.dumps({"a": 1}, indent=2))
+
+    def test_loads(self):
+        """It should decode strings and bytes"""
+        self.assertEqual(self.provider.loads('{"a": [1, 2.5, null]}'), {"a": [1, 2.5, None]})
+        self.assertEqual(self.provider.loads(b'{"a": true}'), {"a": True})
+        self.assertRaises(ValueError, self.provider.loads, "{not json")
+
+    def test_response(self):
+        """It should build compact JSON responses and pretty ones when asked"""
+        with app.app_context():
+            response = self.provider.response({"type": PromotionType.FLASH, "day": date(2025, 1, 2)})
+            self.assertEqual(response.mimetype, "application/json")
+            self.assertEqual(response.data, b'{"day":"2025-01-02","type":"FLASH"}\n')
+
+            self.provider.compact = False
+            response = self.provider.response([1])
+            self.assertEqual(response.data, b"[\n  1\n]\n")
+
+    def test_default(self):
+        """It should encode dates and enums for the standard library and reject the rest"""
+        self.assertEqual(_default(date(2025, 1, 2)), "2025-01-02")
+        self.assertEqual(_default(PromotionType.COUPON), "COUPON")
+        self.assertEqual(json.dumps({"at": datetime(2025, 1, 2)}, default=_default), '{"at": "2025-01-02T00:00:00"}')
+        self.assertRaises(TypeError, _default, object())
+
+    def test_without_orjson(self):
+        """It should fall back to the standard library when orjson cannot be imported"""
+        spec = importlib.util.find_spec("service.common.json_provider")
+        module = importlib.util.module_from_spec(spec)
+        with patch.dict(sys.modules, {"orjson": None}):
+            spec.loader.exec_module(module)
+        self.assertIsNone(module.orjson)
+
+        provider = module.PromotionJSONProvider(app)
+        value = {"type": PromotionType.FLASH, "day": date(2025, 1, 2), "at": datetime(2025, 1, 2, 3)}
+        self.assertEqual(json.loads(provider.dumps(value)), json.loads(self.provider.dumps(value)))
+        self.assertEqual(provider.loads(b'{"a": [1, null]}'), {"a": [1, None]})
+        with app.app_context():
+            response = provider.response(value)
+            self.assertEqual(response.mimetype, "application/json")
+            self.assertEqual(response.get_json(), {"at": "2025-01-02T03:00:00", "day": "2025-01-02", "type": "FLASH"})
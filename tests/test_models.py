@@ -19,13 +19,14 @@ Test cases for Promotion Model
 """
 
 # pylint: disable=duplicate-code
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import os
 import logging
 from unittest import TestCase
 from unittest.mock import patch
 from wsgi import app
-from service.models import Promotion, DataValidationError, db
+from service.models import Promotion, PromotionView, DataValidationError, db
 from .factories import PromotionFactory
 
 DATABASE_URI = os.getenv(
@@ -98,13 +99,13 @@ class TestPromotion(TestCase):
         self.assertEqual(data["promotion_id"], promotion.promotion_id)
 
         self.assertIn("start_date", data)
-        self.assertEqual(data["start_date"], promotion.start_date.isoformat())
+        self.assertEqual(data["start_date"], promotion.start_date)
 
         self.assertIn("end_date", data)
-        self.assertEqual(data["end_date"], promotion.end_date.isoformat())
+        self.assertEqual(data["end_date"], promotion.end_date)
 
         self.assertIn("promotion_type", data)
-        self.assertEqual(data["promotion_type"], promotion.promotion_type.value)
+        self.assertEqual(data["promotion_type"], promotion.promotion_type)
         self.assertIn("promotion_amount", data)
         self.assertEqual(data["promotion_amount"], promotion.promotion_amount)
         self.assertIn("promotion_description", data)
@@ -112,6 +113,11 @@ class TestPromotion(TestCase):
         self.assertIn("usage_count", data)
         self.assertEqual(data["usage_count"], promotion.usage_count)
 
+    def test_serialize_fields(self):
+        """It should serialize only the requested fields"""
+        promotion = PromotionFactory()
+        self.assertEqual(promotion.serialize(["state", "id"]), {"state": promotion.state, "id": promotion.id})
+
     def test_deserialize_a_promotion(self):
         """It should deserialize a Promotion"""
         data = PromotionFactory().serialize()
@@ -126,15 +132,11 @@ class TestPromotion(TestCase):
         self.assertIn("promotion_id", data)
         self.assertEqual(data["promotion_id"], promotion.promotion_id)
         self.assertIn("start_date", data)
-        self.assertEqual(
-            promotion.start_date, datetime.fromisoformat(data["start_date"])
-        )  # Fix
+        self.assertEqual(promotion.start_date, data["start_date"])
         self.assertIn("end_date", data)
-        self.assertEqual(
-            promotion.end_date, datetime.fromisoformat(data["end_date"])
-        )  # Fix
+        self.assertEqual(promotion.end_date, data["end_date"])
         self.assertIn("promotion_type", data)
-        self.assertEqual(data["promotion_type"], promotion.promotion_type.value)
+        self.assertEqual(data["promotion_type"], promotion.promotion_type)
         self.assertIn("promotion_amount", data)
         self.assertEqual(data["promotion_amount"], promotion.promotion_amount)
         self.assertIn("promotion_description", data)
@@ -159,6 +161,12 @@ class TestPromotion(TestCase):
         promotion = Promotion()
         self.assertRaises(DataValidationError, promotion.deserialize, data)
 
+    def test_deserialize_start_after_end(self):
+        """It should not deserialize a Promotion that starts after it ends"""
+        data = PromotionFactory().serialize()
+        data["start_date"], data["end_date"] = data["end_date"], data["start_date"]
+        self.assertRaises(DataValidationError, Promotion().deserialize, data)
+
     def test_deserialize_bad_available(self):  # need fix
         """It should not deserialize a bad available attribute"""
         test_promotion = PromotionFactory()
@@ -200,6 +208,51 @@ class TestPromotion(TestCase):
         self.assertEqual(updated_promotion.promotion_description, "Updated Description")
         self.assertEqual(updated_promotion.usage_count, 0)
 
+    def test_apply_a_promotion(self):
+        """It should increment the usage count in the database"""
+        promotion = PromotionFactory(usage_count=3)
+        promotion.create()
+        applied = Promotion.apply(promotion.id)
+        self.assertEqual(applied.id, promotion.id)
+        self.assertEqual(applied.usage_count, 4)
+        db.session.remove()
+        self.assertEqual(Promotion.find(promotion.id).usage_count, 4)
+
+    def test_apply_a_missing_promotion(self):
+        """It should not apply a Promotion that is not there"""
+        self.assertIsNone(Promotion.apply(0))
+
+    def test_cancel_a_promotion(self):
+        """It should cancel an active Promotion only once"""
+        promotion = PromotionFactory(state="active")
+        promotion.create()
+        canceled = Promotion.cancel(promotion.id)
+        self.assertEqual(canceled.state, "canceled")
+        self.assertIsNone(Promotion.cancel(promotion.id))
+        db.session.remove()
+        self.assertEqual(Promotion.find(promotion.id).state, "canceled")
+
+    def test_apply_concurrently(self):
+        """It should not lose increments when applied concurrently"""
+        promotion = PromotionFactory(usage_count=0)
+        promotion.create()
+        promotion_id = promotion.id
+        db.session.remove()
+        workers, applies = 8, 25
+
+        def apply_many():
+            with app.app_context():
+                for _ in range(applies):
+                    Promotion.apply(promotion_id)
+                db.session.remove()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(apply_many) for _ in range(workers)]
+            for future in futures:
+                future.result()
+
+        self.assertEqual(Promotion.find(promotion_id).usage_count, workers * applies)
+
 
 class TestExceptionHandlers(TestCase):
     """Promotion Model Exception Handlers"""
@@ -225,6 +278,19 @@ class TestExceptionHandlers(TestCase):
         promotion = PromotionFactory()
         self.assertRaises(DataValidationError, promotion.delete)
 
+    @patch("service.models.db.session.commit")
+    def test_transition_many_exception(self, exception_mock):
+        """It should catch a bulk state change exception"""
+        exception_mock.side_effect = Exception()
+        clauses = Promotion.criteria(ids=[0])
+        self.assertRaises(DataValidationError, Promotion.transition_many, clauses, "active", "canceled")
+
+    @patch("service.models.db.session.commit")
+    def test_apply_exception(self, exception_mock):
+        """It should catch an apply exception"""
+        exception_mock.side_effect = Exception()
+        self.assertRaises(DataValidationError, Promotion.apply, 0)
+
 
 class TestModelQueries(TestCase):
     """Promotion Model Query Tests"""
@@ -299,3 +365,33 @@ class TestModelQueries(TestCase):
 
         for promotion in found:
             self.assertEqual(promotion.promotion_type.value, promotion_type)
+
+    def test_find_view(self):
+        """It should Find a read-only PromotionView that serializes like the Promotion"""
+        promotion = PromotionFactory()
+        promotion.create()
+        view = Promotion.find_view(promotion.id)
+        self.assertIsInstance(view, PromotionView)
+        self.assertEqual(view.serialize(), promotion.serialize())
+        self.assertEqual(view.version, 1)
+        self.assertIsNone(Promotion.find_view(0))
+
+        view = Promotion.find_view(promotion.id, ["promotion_amount"])
+        self.assertEqual(view.serialize(["promotion_amount"]), {"promotion_amount": promotion.promotion_amount})
+        self.assertIsNone(view.promotion_description)
+        self.assertEqual(view.end_date, promotion.end_date)
+
+    def test_views(self):
+        """It should map the rows of a filtered query to PromotionViews"""
+        promotions = PromotionFactory.create_batch(3)
+        for promotion in promotions:
+            promotion.create()
+        query = Promotion.query.filter(Promotion.id.in_([promotion.id for promotion in promotions]))
+        views = list(PromotionView.from_rows(Promotion.views(query).order_by(Promotion.id)))
+        self.assertEqual([view.serialize() for view in views], [promotion.serialize() for promotion in promotions])
+
+        sql = str(Promotion.views(query, ["state"]))
+        self.assertIn("promotion.state", sql)
+        self.assertIn("promotion.version", sql)
+        self.assertNotIn("promotion_description", sql)
+        self.assertEqual(PromotionView._fields[: len(Promotion.FIELDS)], Promotion.FIELDS)
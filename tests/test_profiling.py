@@ -0,0 +1,156 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Request Profiler
+"""
+import cProfile
+import logging
+import os
+import pstats
+import tempfile
+import time
+from unittest import TestCase
+from flask import Flask
+from werkzeug.test import Client
+from wsgi import app
+from service.common import status
+from service.common.profiling import RequestProfiler, collapsed_stacks, without_profile_parameters
+
+SECRET = "let-me-see"
+
+
+def busy_wait(seconds: float):
+    """Spins for a while so the profile has something to show"""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+######################################################################
+#  C O L L A P S E D   S T A C K S   T E S T   C A S E S
+######################################################################
+class TestCollapsedStacks(TestCase):
+    """Test Cases for collapsed stacks"""
+
+    def test_collapsed_stacks(self):
+        """It should turn a profile into weighted stacks"""
+        profiler = cProfile.Profile()
+        with profiler:
+            busy_wait(0.005)
+        lines = collapsed_stacks(pstats.Stats(profiler)).splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            stack, weight = line.rsplit(" ", 1)
+            self.assertGreater(int(weight), 0)
+            self.assertTrue(stack)
+        self.assertTrue(any("busy_wait (test_profiling.py:" in line for line in lines))
+
+    def test_without_profile_parameters(self):
+        """It should take only the profiler's parameters out of a query string"""
+        query = "profile=s3cret&name=a%20b&profile_format=collapsed&profiled=1&&pro%66ile=x"
+        self.assertEqual(without_profile_parameters(query), "name=a%20b&profiled=1")
+        self.assertEqual(without_profile_parameters(""), "")
+
+
+######################################################################
+#  R E Q U E S T   P R O F I L E R   T E S T   C A S E S
+######################################################################
+class TestRequestProfiler(TestCase):
+    """Test Cases for the Request Profiler"""
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.app = Flask(__name__)
+        self.app.config.update(
+            PROFILE_SECRET=SECRET, PROFILE_SAMPLE_RATE=0.0, PROFILE_DIR=self.tempdir.name, PROFILE_BACKEND="cprofile"
+        )
+
+        @self.app.route("/work")
+        def work():
+            busy_wait(0.002)
+            return {"done": True}, status.HTTP_201_CREATED
+
+        self.profiler = RequestProfiler()
+        self.profiler.init_app(self.app)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_not_requested(self):
+        """It should not profile requests without the secret"""
+        resp = self.client.get("/work")
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.client.get("/work", headers={"X-Profile": "guess"})
+        self.assertNotIn("X-Profile-File", resp.headers)
+        self.assertEqual(os.listdir(self.tempdir.name), [])
+        self.assertEqual(self.profiler.stats(), {"profiled": 0, "sampled": 0})
+
+    def test_profile_to_file(self):
+        """It should write the profile of a flagged request to the profile directory"""
+        resp = self.client.get("/work", headers={"X-Profile": SECRET})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.get_json(), {"done": True})
+        name = resp.headers["X-Profile-File"]
+        self.assertTrue(name.endswith(".prof"))
+        self.assertIn("-GET-work-", name)
+        stats = pstats.Stats(os.path.join(self.tempdir.name, name))
+        self.assertTrue(any(func[2] == "busy_wait" for func in stats.stats))  # pylint: disable=no-member
+        self.assertEqual(self.profiler.stats()["profiled"], 1)
+
+    def test_profile_inline(self):
+        """It should return collapsed stacks instead of the response when asked to"""
+        resp = self.client.get(f"/work?profile={SECRET}&profile_format=collapsed")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["X-Profile-Status"], "201 CREATED")
+        self.assertIn("busy_wait", resp.get_data(as_text=True))
+        resp = self.client.get("/work", headers={"X-Profile": SECRET, "X-Profile-Format": "collapsed"})
+        self.assertIn("work (test_profiling.py:", resp.get_data(as_text=True))
+        self.assertEqual(os.listdir(self.tempdir.name), [])
+
+    def test_sampled(self):
+        """It should write profiles of sampled requests without telling the client"""
+        self.profiler.sample_rate = 1.0
+        resp = self.client.get("/work")
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn("X-Profile-File", resp.headers)
+        self.assertEqual(len(os.listdir(self.tempdir.name)), 1)
+        self.assertEqual(self.profiler.stats()["sampled"], 1)
+
+    def test_disabled(self):
+        """It should leave the WSGI app alone when profiling is not configured"""
+        flask_app = Flask(__name__)
+        flask_app.config.update(PROFILE_SECRET="", PROFILE_SAMPLE_RATE=0.0, PROFILE_DIR="", PROFILE_BACKEND="cprofile")
+        wsgi_app = flask_app.wsgi_app
+        profiler = RequestProfiler()
+        profiler.init_app(flask_app)
+        self.assertFalse(profiler.enabled)
+        self.assertEqual(flask_app.wsgi_app, wsgi_app)
+
+    def test_strict_route(self):
+        """It should hide its query parameters from routes that reject unknown ones"""
+        app.logger.setLevel(logging.CRITICAL)
+        self.profiler.directory = self.tempdir.name
+        client = Client(self.profiler.wrap(app.wsgi_app))
+        resp = client.get(f"/promotions?profile={SECRET}&profile_format=collapsed&limit=1")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["X-Profile-Status"], "200 OK")
+        resp = client.get(f"/promotions?profile={SECRET}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn("X-Profile-File", resp.headers)
+        resp = client.get("/promotions?profile=guess")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,128 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Query Log
+"""
+import logging
+import os
+import tempfile
+from unittest import TestCase
+from flask import Flask
+from sqlalchemy import create_engine, text
+from service.common import status
+from service.common.query_log import QueryLog, redact, slow_logger
+
+
+######################################################################
+#  R E D A C T   T E S T   C A S E S
+######################################################################
+class TestRedact(TestCase):
+    """Test Cases for parameter redaction"""
+
+    def test_redact(self):
+        """It should keep the types of parameters and drop their values"""
+        self.assertEqual(redact({"name": "SAVE10", "id": 3}), {"name": "str", "id": "int"})
+        self.assertEqual(redact(("SAVE10", 3.5)), ["str", "float"])
+        self.assertEqual(redact([{"id": 1}, {"id": 2}], executemany=True), "<2 parameter sets>")
+        self.assertEqual(redact(None), "NoneType")
+
+
+######################################################################
+#  Q U E R Y   L O G   T E S T   C A S E S
+######################################################################
+class TestQueryLog(TestCase):
+    """Test Cases for the Query Log"""
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.engine = create_engine("sqlite://")
+        self.app = Flask(__name__)
+        self.app.config.update(
+            SQL_SLOW_QUERY_MS=0.0, SQL_SLOW_QUERY_LOG="", SQL_REPEAT_THRESHOLD=3, SQL_DEBUG_HEADERS=True
+        )
+
+        @self.app.route("/queries/<int:count>")
+        def queries(count):
+            with self.engine.connect() as connection:
+                for number in range(count):
+                    connection.execute(text("SELECT :number"), {"number": number})
+            return "", status.HTTP_204_NO_CONTENT
+
+        self.query_log = QueryLog()
+        self.query_log.init_app(self.app, self.engine)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        for handler in list(slow_logger.handlers):
+            slow_logger.removeHandler(handler)
+            handler.close()
+        self.engine.dispose()
+        self.tempdir.cleanup()
+
+    def test_counts_queries(self):
+        """It should count and time the statements of a request in debug headers"""
+        resp = self.client.get("/queries/2")
+        self.assertEqual(resp.headers["X-SQL-Count"], "2")
+        self.assertGreater(float(resp.headers["X-SQL-Time-Ms"]), 0)
+        self.assertEqual(resp.headers["X-SQL-Max-Repeats"], "2")
+        self.assertIsNone(self.query_log.current())
+        self.assertEqual(self.query_log.request_seconds(), 0.0)
+
+    def test_no_headers(self):
+        """It should leave the headers alone outside of debug mode"""
+        self.query_log.headers = False
+        resp = self.client.get("/queries/1")
+        self.assertNotIn("X-SQL-Count", resp.headers)
+
+    def test_repeated_statement(self):
+        """It should warn about a statement that runs again and again in one request"""
+        with self.assertLogs("flask.app", level="WARNING") as logs:
+            self.client.get("/queries/3")
+        self.assertIn("ran the same statement 3 times", logs.output[0])
+        self.assertIn("SELECT ?", logs.output[0])
+
+    def test_debug_summary(self):
+        """It should summarize every request in the debug log"""
+        with self.assertLogs("flask.app", level="DEBUG") as logs:
+            self.client.get("/queries/1")
+        self.assertTrue(any("ran 1 SQL statements" in line for line in logs.output))
+
+    def test_slow_query_log(self):
+        """It should write slow statements to the slow query log without their values"""
+        path = os.path.join(self.tempdir.name, "slow.log")
+        self.app.config.update(SQL_SLOW_QUERY_MS=1e-6, SQL_SLOW_QUERY_LOG=path)
+        self.query_log.init_app(self.app, self.engine)
+        with self.engine.connect() as connection:
+            connection.execute(text("SELECT :secret"), {"secret": "hunter2"})
+        with open(path, encoding="utf-8") as file:
+            line = file.read()
+        self.assertIn("Slow query took", line)
+        self.assertIn("parameters=['str']", line)
+        self.assertNotIn("hunter2", line)
+
+        self.query_log.init_app(self.app, self.engine)
+        self.assertEqual(len(slow_logger.handlers), 1)
+        with self.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        with open(path, encoding="utf-8") as file:
+            self.assertEqual(len(file.readlines()), 2)
+
+    def test_slow_query_disabled(self):
+        """It should not log slow statements when the threshold is zero"""
+        slow_logger.setLevel(logging.WARNING)
+        with self.assertNoLogs("flask.app.slow_query", level="WARNING"):
+            self.client.get("/queries/1")
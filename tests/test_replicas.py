@@ -0,0 +1,203 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for read replica routing
+
+Two SQLite files stand in for the replicas. Each holds its own promotions,
+so the answer to a request shows which database served it.
+"""
+import logging
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from sqlalchemy import create_engine, exc, func, insert, select, update
+
+from wsgi import app
+from service import migrations
+from service.common import status
+from service.common.cache import NOT_FOUND, promotion_cache
+from service.common.replicas import replica_router
+from service.models import Promotion, db
+from tests.factories import PromotionFactory
+
+BASE_URL = "/promotions"
+
+
+def seed_replica(uri: str, first_id: int, name: str) -> None:
+    """Creates the tables of a replica and two promotions named after it"""
+    engine = create_engine(uri)
+    migrations.upgrade(engine)
+    with engine.begin() as connection:
+        for number in range(2):
+            row = PromotionFactory().as_row()
+            row.update(id=first_id + number, name=name, promotion_id=f"{name}-{number}")
+            connection.execute(insert(Promotion), row)
+    engine.dispose()
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestReplicaRouting(TestCase):
+    """Reads of read-only requests go to the replicas, everything else to the primary"""
+
+    @classmethod
+    def setUpClass(cls):
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        app.app_context().push()
+        cls.tempdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        cls.uris = [f"sqlite:///{os.path.join(cls.tempdir.name, f'replica_{number}.db')}" for number in range(2)]
+        for number, uri in enumerate(cls.uris):
+            seed_replica(uri, 1000 * (number + 1), f"replica_{number}")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tempdir.cleanup()
+
+    def setUp(self):
+        self.client = app.test_client()
+        db.session.query(Promotion).delete()
+        db.session.commit()
+        self.configure(self.uris)
+
+    def tearDown(self):
+        db.session.remove()
+        self.configure([])
+
+    @staticmethod
+    def configure(uris, eject_seconds=30.0):
+        """Points the router at replicas"""
+        db.session.remove()
+        app.config["DATABASE_REPLICA_URIS"] = uris
+        app.config["DATABASE_REPLICA_EJECT_SECONDS"] = eject_seconds
+        replica_router.init_app(app)
+
+    def served_by(self) -> str:
+        """Returns the name of the database that answered a list request"""
+        resp = self.client.get(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        names = {promotion["name"] for promotion in resp.get_json()}
+        return names.pop() if names else "primary"
+
+    def test_round_robin(self):
+        """It should send each read-only request to the next replica in turn"""
+        served = [self.served_by() for _ in range(4)]
+        self.assertEqual(set(served), {"replica_0", "replica_1"})
+        self.assertNotEqual(served[0], served[1])
+        self.assertEqual(served[0], served[2])
+        self.assertEqual([replica["reads"] for replica in replica_router.stats()], [2, 2])
+
+    def test_writes_go_to_the_primary(self):
+        """It should create, update and delete on the primary"""
+        promotion = PromotionFactory()
+        resp = self.client.post(BASE_URL, json=promotion.serialize())
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        new_id = resp.get_json()["id"]
+        self.assertIsNotNone(db.session.get(Promotion, new_id))
+        self.assertIn(self.served_by(), ("replica_0", "replica_1"))
+
+        resp = self.client.put(f"{BASE_URL}/{new_id}/apply")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.delete(f"{BASE_URL}/{new_id}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertIsNone(db.session.get(Promotion, new_id))
+
+    def test_get_from_replica(self):
+        """It should read a single promotion from a replica"""
+        found = {self.client.get(f"{BASE_URL}/1000").status_code for _ in range(2)}
+        self.assertEqual(found, {status.HTTP_200_OK, status.HTTP_404_NOT_FOUND})
+
+    def test_cache_fills_from_the_primary(self):
+        """It should fill the promotion cache from the primary, never from a replica that may lag"""
+        app.config["PROMOTION_CACHE_ENABLED"] = True
+        promotion_cache.init_app(app)
+        try:
+            for _ in range(2):
+                self.assertEqual(self.client.get(f"{BASE_URL}/1000").status_code, status.HTTP_404_NOT_FOUND)
+                self.assertEqual(self.client.get(f"{BASE_URL}?promotion_id=replica_0-0").get_json(), [])
+            self.assertIs(promotion_cache.get(1000), NOT_FOUND)
+            self.assertIn(self.served_by(), ("replica_0", "replica_1"))  # lists still read from the replicas
+        finally:
+            app.config["PROMOTION_CACHE_ENABLED"] = False
+            promotion_cache.init_app(app)
+
+    def test_read_after_write(self):
+        """It should keep the reads of a request on the primary after its first write"""
+        primary = db.engines[None]
+        statement = select(Promotion.id)
+        with app.test_request_context(BASE_URL, method="GET"):
+            replica = db.session.get_bind(clause=statement)
+            self.assertIn(replica, [replica.engine for replica in replica_router.replicas])
+            self.assertEqual(db.session.get_bind(clause=statement), replica)
+            self.assertEqual(len(db.session.scalars(statement).all()), 2)
+            db.session.execute(update(Promotion).where(Promotion.id == 0).values(usage_count=1))
+            self.assertIs(db.session.get_bind(clause=statement), primary)
+            self.assertEqual(db.session.scalars(statement).all(), [])
+            db.session.rollback()
+        with app.test_request_context(BASE_URL, method="GET"):
+            db.session.add(PromotionFactory())
+            db.session.flush()
+            self.assertIs(db.session.get_bind(clause=statement), primary)
+            db.session.rollback()
+
+    def test_primary_outside_read_requests(self):
+        """It should use the primary for other methods and outside of a request"""
+        primary = db.engines[None]
+        statement = select(Promotion)
+        self.assertIs(db.session.get_bind(clause=statement), primary)
+        with app.test_request_context(BASE_URL, method="PUT"):
+            self.assertIs(db.session.get_bind(clause=statement), primary)
+
+    def test_ejection(self):
+        """It should leave out a failed replica until its ejection ends"""
+        broken = "sqlite:///" + os.path.join(self.tempdir.name, "missing", "replica.db")
+        self.configure([broken, self.uris[1]])
+        with self.assertLogs("flask.app", level="WARNING") as logs:
+            failures = 0
+            for _ in range(2):
+                try:
+                    self.served_by()
+                except exc.OperationalError:
+                    failures += 1
+                    db.session.rollback()
+        self.assertEqual(failures, 1)
+        self.assertIn("replica_0 failed", logs.output[0])
+        self.assertEqual([self.served_by() for _ in range(3)], ["replica_1"] * 3)
+
+        stats = self.client.get("/health").get_json()["read_replicas"]
+        self.assertEqual([replica["healthy"] for replica in stats], [False, True])
+        self.assertEqual(stats[0]["ejections"], 1)
+
+        replica_router.replicas[0].ejected_until = time.monotonic()
+        self.assertTrue(replica_router.stats()[0]["healthy"])
+
+    def test_all_ejected(self):
+        """It should read from the primary while every replica is ejected"""
+        for replica in replica_router.replicas:
+            replica.ejected_until = time.monotonic() + 60
+        self.assertEqual(self.served_by(), "primary")
+
+    def test_other_errors(self):
+        """It should not eject a replica for an error in the statement"""
+        with app.test_request_context(BASE_URL, method="GET"):
+            with self.assertRaises(exc.DBAPIError):
+                db.session.execute(select(func.no_such_function(Promotion.id)))
+            db.session.rollback()
+        self.assertEqual([replica["ejections"] for replica in replica_router.stats()], [0, 0])
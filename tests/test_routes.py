@@ -20,7 +20,8 @@ TestPromotion API Service Test Suite
 """
 
 # pylint: disable=duplicate-code
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+import json
 import os
 import logging
 from unittest import TestCase
@@ -29,6 +30,8 @@ from unittest import TestCase
 from wsgi import app
 from service.common import status
 from service.models import PromotionType, db, Promotion
+from service.common.pagination import encode_cursor
+from service.common.interval_tree import live_index
 
 # from .factories import PromotionFactory
 
@@ -263,6 +266,13 @@ class TestPromotionService(TestCase):
         response = self.client.get(f"{BASE_URL}?non_existent_field=value")
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_promotion_ending_before_start(self):
+        """It should not Create a Promotion that ends before it starts"""
+        promotion = PromotionFactory(start_date=datetime(2025, 5, 1), end_date=datetime(2025, 4, 1))
+        response = self.client.post(BASE_URL, json=promotion.serialize())
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("start_date is after end_date", response.get_json()["message"])
+
     def test_apply_promotion(self):
         """It should increment the usage count when a promotion is applied"""
         promo = PromotionFactory(usage_count=0)
@@ -304,6 +314,183 @@ class TestPromotionService(TestCase):
             len(data), 0, "Expected an empty list when no promotions exist"
         )
 
+    def test_list_promotions_paged(self):
+        """It should page through all Promotions with a cursor"""
+        promotions = self._create_promotions(5)
+        response = self.client.get(f"{BASE_URL}?limit=2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        seen = [promo["id"] for promo in response.get_json()]
+        self.assertEqual(len(seen), 2)
+        while "X-Next-Cursor" in response.headers:
+            self.assertIn('rel="next"', response.headers["Link"])
+            cursor = response.headers["X-Next-Cursor"]
+            response = self.client.get(f"{BASE_URL}?limit=2&cursor={cursor}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(promo["id"] for promo in response.get_json())
+        self.assertEqual(seen, sorted(promotion.id for promotion in promotions))
+        self.assertNotIn("Link", response.headers)
+
+    def test_list_promotions_paged_with_filter(self):
+        """It should keep the filters in the next page link"""
+        for _ in range(3):
+            promo = PromotionFactory(name="PAGED")
+            response = self.client.post(BASE_URL, json=promo.serialize())
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self._create_promotions(2)
+        response = self.client.get(f"{BASE_URL}?name=PAGED&limit=2")
+        self.assertEqual(len(response.get_json()), 2)
+        self.assertIn("name=PAGED", response.headers["Link"])
+        response = self.client.get(response.headers["Link"][1:].split(">")[0])
+        data = response.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]["name"], "PAGED")
+
+    def test_list_promotions_cursor_without_limit(self):
+        """It should use the default page size when only a cursor is given"""
+        self._create_promotions(3)
+        response = self.client.get(f"{BASE_URL}?cursor={encode_cursor(0)}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.get_json()), 3)
+        self.assertNotIn("X-Next-Cursor", response.headers)
+
+    def test_list_promotions_limit_is_capped(self):
+        """It should not return more than the maximum page size"""
+        self._create_promotions(3)
+        page_size_max = app.config["PAGE_SIZE_MAX"]
+        app.config["PAGE_SIZE_MAX"] = 2
+        try:
+            response = self.client.get(f"{BASE_URL}?limit=500")
+        finally:
+            app.config["PAGE_SIZE_MAX"] = page_size_max
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.get_json()), 2)
+        self.assertIn("limit=2", response.headers["Link"])
+
+    def test_list_promotions_bad_page_params(self):
+        """It should return 400 for a bad limit or cursor"""
+        for query in ("limit=abc", "limit=0", "cursor=not-a-cursor", f"cursor={encode_cursor(-1)}"):
+            response = self.client.get(f"{BASE_URL}?{query}")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_list_promotions_ndjson(self):
+        """It should stream Promotions as NDJSON when asked to"""
+        promotions = self._create_promotions(3)
+        response = self.client.get(BASE_URL, headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 3)
+        data = [json.loads(line) for line in lines]
+        self.assertEqual(
+            sorted(promo["id"] for promo in data),
+            sorted(promotion.id for promotion in promotions),
+        )
+
+    def test_list_promotions_ndjson_paged(self):
+        """It should stream one page of NDJSON with a next cursor"""
+        self._create_promotions(3)
+        response = self.client.get(
+            f"{BASE_URL}?limit=2", headers={"Accept": "application/x-ndjson"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.get_data(as_text=True).splitlines()), 2)
+        self.assertIn("X-Next-Cursor", response.headers)
+
+    def test_list_promotions_prefers_json(self):
+        """It should return a JSON array when NDJSON is not preferred"""
+        self._create_promotions(1)
+        response = self.client.get(
+            BASE_URL, headers={"Accept": "application/json, application/x-ndjson;q=0.5"}
+        )
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertIsInstance(response.get_json(), list)
+
+    def test_create_promotions_bulk(self):
+        """It should create a batch of Promotions in one request"""
+        batch = [promo.serialize() for promo in PromotionFactory.build_batch(3)]
+        response = self.client.post(f"{BASE_URL}/bulk", json=batch)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        data = response.get_json()
+        self.assertEqual(data["created"], 3)
+        self.assertEqual(data["failed"], 0)
+        for index, result in enumerate(data["results"]):
+            self.assertEqual(result["index"], index)
+            self.assertEqual(result["status"], status.HTTP_201_CREATED)
+            promo = self.client.get(f"{BASE_URL}/{result['id']}").get_json()
+            self.assertEqual(promo["promotion_id"], batch[index]["promotion_id"])
+
+    def test_create_promotions_bulk_ndjson(self):
+        """It should create a batch of Promotions from NDJSON"""
+        batch = [promo.serialize() for promo in PromotionFactory.build_batch(2)]
+        body = "\n".join(app.json.dumps(item) for item in batch) + "\n\n"
+        response = self.client.post(
+            f"{BASE_URL}/bulk", data=body, content_type="application/x-ndjson"
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.get_json()["created"], 2)
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 2)
+
+    def test_create_promotions_bulk_all_or_nothing(self):
+        """It should create nothing when one Promotion in an atomic batch is invalid"""
+        batch = [promo.serialize() for promo in PromotionFactory.build_batch(2)]
+        batch.insert(1, {"name": "incomplete"})
+        response = self.client.post(f"{BASE_URL}/bulk", json=batch)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        data = response.get_json()
+        self.assertEqual([result["index"] for result in data["results"]], [1])
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 0)
+
+        # a duplicate promotion_id is only caught by the database
+        batch = [promo.serialize() for promo in PromotionFactory.build_batch(2, promotion_id="DUPLICATE")]
+        response = self.client.post(f"{BASE_URL}/bulk", json=batch)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 0)
+
+    def test_create_promotions_bulk_partial(self):
+        """It should create the valid Promotions of a partial batch"""
+        batch = [promo.serialize() for promo in PromotionFactory.build_batch(2)]
+        batch.append({"name": "incomplete"})
+        body = "\n".join(app.json.dumps(item) for item in batch) + "\n{not json"
+        response = self.client.post(
+            f"{BASE_URL}/bulk?atomic=false", data=body, content_type="application/x-ndjson"
+        )
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        data = response.get_json()
+        self.assertEqual(data["created"], 2)
+        self.assertEqual(data["failed"], 2)
+        statuses = [result["status"] for result in data["results"]]
+        self.assertEqual(statuses, [201, 201, 400, 400])
+        self.assertIn("line 4", data["results"][3]["error"])
+
+    def test_create_promotions_bulk_partial_conflict(self):
+        """It should skip rows the database rejects in a partial batch"""
+        existing = self._create_promotions(1)[0]
+        batch = [promo.serialize() for promo in PromotionFactory.build_batch(3)]
+        batch[1]["promotion_id"] = existing.promotion_id
+        response = self.client.post(f"{BASE_URL}/bulk?atomic=false", json=batch)
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        data = response.get_json()
+        self.assertEqual([result["status"] for result in data["results"]], [201, 400, 201])
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 3)
+
+    def test_create_promotions_bulk_bad_requests(self):
+        """It should reject bulk bodies that are not a list of promotions"""
+        response = self.client.post(f"{BASE_URL}/bulk", json={"name": "not a list"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(f"{BASE_URL}/bulk", data="hello", content_type="text/plain")
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        response = self.client.post(f"{BASE_URL}/bulk", json=[])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.get_json()["created"], 0)
+
+        bulk_max_items = app.config["BULK_MAX_ITEMS"]
+        app.config["BULK_MAX_ITEMS"] = 1
+        try:
+            response = self.client.post(f"{BASE_URL}/bulk", json=[{}, {}])
+        finally:
+            app.config["BULK_MAX_ITEMS"] = bulk_max_items
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
     def test_list_promotions_invalid_enum_value(self):
         """It should return 400 for invalid promotion_type enum value"""
         response = self.client.get("/promotions?promotion_type=INVALID_ENUM")
@@ -311,6 +498,232 @@ class TestPromotionService(TestCase):
         data = response.get_json()
         self.assertIn("Invalid promotion_type", data["message"])
 
+    def test_cancel_promotion(self):
+        """It should cancel an active Promotion and refuse to cancel it twice"""
+        promo = PromotionFactory(state="active")
+        response = self.client.post(BASE_URL, json=promo.serialize())
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        promo_id = response.get_json()["id"]
+
+        response = self.client.put(f"{BASE_URL}/{promo_id}/cancel")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["state"], "canceled")
+
+        response = self.client.put(f"{BASE_URL}/{promo_id}/cancel")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_cancel_promotions_by_filter(self):
+        """It should cancel every active Promotion that matches a filter"""
+        flash = [
+            PromotionFactory(promotion_type=PromotionType.FLASH, state=state)
+            for state in ("active", "active", "canceled")
+        ]
+        other = PromotionFactory(promotion_type=PromotionType.COUPON, state="active")
+        ids = []
+        for promo in flash + [other]:
+            response = self.client.post(BASE_URL, json=promo.serialize())
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            ids.append(response.get_json()["id"])
+
+        bulk_chunk_size = app.config["BULK_CHUNK_SIZE"]
+        app.config["BULK_CHUNK_SIZE"] = 1
+        try:
+            response = self.client.put(
+                f"{BASE_URL}/state", json={"state": "canceled", "promotion_type": "FLASH"}
+            )
+        finally:
+            app.config["BULK_CHUNK_SIZE"] = bulk_chunk_size
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(data["count"], 2)
+        self.assertEqual(data["ids"], ids[:2])
+        for promo_id in ids[:3]:
+            self.assertEqual(self.client.get(f"{BASE_URL}/{promo_id}").get_json()["state"], "canceled")
+        self.assertEqual(self.client.get(f"{BASE_URL}/{ids[3]}").get_json()["state"], "active")
+
+    def test_reactivate_promotions_by_filter(self):
+        """It should reactivate canceled Promotions by id, name and date window"""
+        promo = PromotionFactory(
+            name="SPRING",
+            state="canceled",
+            start_date=datetime(2025, 3, 1),
+            end_date=datetime(2025, 3, 31),
+        )
+        response = self.client.post(BASE_URL, json=promo.serialize())
+        promo_id = response.get_json()["id"]
+        request_body = {
+            "state": "active",
+            "ids": [promo_id, 0],
+            "name": "SPRING",
+            "starts_after": "2025-02-01T05:00:00+05:00",
+            "ends_before": "2025-03-31T23:00:00-01:00",
+        }
+        response = self.client.put(f"{BASE_URL}/state", json=request_body)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["ids"], [promo_id])
+
+        request_body["ends_before"] = "2025-03-15T00:00:00"
+        response = self.client.put(f"{BASE_URL}/state", json=request_body)
+        self.assertEqual(response.get_json()["count"], 0)
+
+    def test_change_promotions_state_bad_requests(self):
+        """It should reject bulk state changes that are not well formed"""
+        bad_bodies = [
+            ["not", "an", "object"],
+            {"state": "deleted", "name": "x"},
+            {"state": "canceled"},
+            {"state": "canceled", "color": "red"},
+            {"state": "canceled", "promotion_type": "BOGUS"},
+            {"state": "canceled", "starts_after": "yesterday"},
+            {"state": "canceled", "ids": "1,2"},
+            {"state": "canceled", "ids": [True]},
+        ]
+        for body in bad_bodies:
+            response = self.client.put(f"{BASE_URL}/state", json=body)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
+
+    def _create_schedule(self) -> list:
+        """Creates Promotions that run in March, April and March through May of 2025"""
+        periods = [((3, 1), (3, 31)), ((4, 1), (4, 30)), ((3, 15), (5, 31))]
+        responses = [
+            self.client.post(
+                BASE_URL,
+                json=PromotionFactory(start_date=datetime(2025, *start), end_date=datetime(2025, *end)).serialize(),
+            )
+            for start, end in periods
+        ]
+        for response in responses:
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return [response.get_json()["id"] for response in responses]
+
+    def test_query_by_dates(self):
+        """It should filter Promotions by active_at, starts_after and ends_before"""
+        march, april, spring = self._create_schedule()
+        queries = {
+            "active_at=2025-03-20T12:00:00": [march, spring],
+            "active_at=2025-03-31T00:00:00": [march, spring],
+            "active_at=2025-06-01T00:00:00": [],
+            "starts_after=2025-03-10T00:00:00": [april, spring],
+            "ends_before=2025-04-30T00:00:00": [march, april],
+            "active_at=2025-04-10T00:00:00&ends_before=2025-05-01T00:00:00": [april],
+            "active_at=2025-03-31T01:00:00%2B02:00": [march, spring],
+            "active_at=2025-02-28T23:30:00-00:30": [march],
+        }
+        for query, expected in queries.items():
+            response = self.client.get(f"{BASE_URL}?{query}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK, query)
+            self.assertEqual(sorted(promo["id"] for promo in response.get_json()), expected, query)
+
+        response = self.client.get(f"{BASE_URL}?active_at=tomorrow")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_query_by_active_at_with_live_index(self):
+        """It should answer active_at from the interval tree and rebuild it after writes"""
+        app.config["LIVE_INDEX_ENABLED"] = True
+        live_index.init_app(app)
+        try:
+            march, _, spring = self._create_schedule()
+            response = self.client.get(f"{BASE_URL}?active_at=2025-03-20T00:00:00")
+            self.assertEqual([promo["id"] for promo in response.get_json()], [march, spring])
+
+            self.client.delete(f"{BASE_URL}/{march}")
+            response = self.client.get(f"{BASE_URL}?active_at=2025-03-20T00:00:00&limit=10")
+            self.assertEqual([promo["id"] for promo in response.get_json()], [spring])
+
+            stats = self.client.get("/health").get_json()["live_index"]
+            self.assertEqual(stats["intervals"], 2)
+            self.assertEqual(stats["rebuilds"], 2)
+
+            response = self.client.get(f"{BASE_URL}?active_at=2025-03-20T00:00:00Z")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual([promo["id"] for promo in response.get_json()], [spring])
+
+            live_index.max_ids = 0  # too many ids for an IN list, the SQL filter answers
+            response = self.client.get(f"{BASE_URL}?active_at=2025-03-20T00:00:00")
+            self.assertEqual([promo["id"] for promo in response.get_json()], [spring])
+        finally:
+            app.config["LIVE_INDEX_ENABLED"] = False
+            live_index.init_app(app)
+
+    def test_get_promotion_not_modified(self):
+        """It should answer If-None-Match with 304 until the Promotion changes"""
+        promo = self._create_promotions(1)[0]
+        response = self.client.get(f"{BASE_URL}/{promo.id}")
+        etag = response.headers["ETag"]
+        self.assertEqual(etag, f'"{promo.id}-1"')
+        self.assertIn("max-age=", response.headers["Cache-Control"])
+
+        response = self.client.get(f"{BASE_URL}/{promo.id}", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(response.headers["ETag"], etag)
+
+        self.client.put(f"{BASE_URL}/{promo.id}/apply")
+        response = self.client.get(f"{BASE_URL}/{promo.id}", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["ETag"], f'"{promo.id}-2"')
+
+    def test_list_promotions_not_modified(self):
+        """It should answer If-None-Match on a list with 304 until a Promotion in it changes"""
+        promos = self._create_promotions(3)
+        for query in ["", "?limit=2", "?limit=2&cursor=" + encode_cursor(promos[1].id)]:
+            response = self.client.get(f"{BASE_URL}{query}")
+            etag = response.headers["ETag"]
+            response = self.client.get(f"{BASE_URL}{query}", headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED, query)
+            response = self.client.get(
+                f"{BASE_URL}{query}", headers={"If-None-Match": etag, "Accept": "application/x-ndjson"}
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK, query)
+            self.assertNotEqual(response.headers["ETag"], etag)
+
+        etag = self.client.get(BASE_URL).headers["ETag"]
+        self.client.put(f"{BASE_URL}/{promos[2].id}/apply")
+        response = self.client.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.get_json()), 3)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_sparse_fieldsets(self):
+        """It should return only the fields a request asks for"""
+        promos = self._create_promotions(3)
+        fields = ["id", "promotion_id", "promotion_amount", "state"]
+        query = "fields=id,promotion_id, promotion_amount,state,id"
+
+        response = self.client.get(f"{BASE_URL}?{query}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual([sorted(promo) for promo in data], [sorted(fields)] * 3)
+        self.assertEqual(data[0]["promotion_id"], promos[0].promotion_id)
+
+        response = self.client.get(f"{BASE_URL}?{query}&limit=2", headers={"Accept": "application/x-ndjson"})
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([sorted(promo) for promo in lines], [sorted(fields)] * 2)
+        self.assertIn("X-Next-Cursor", response.headers)
+
+        response = self.client.get(f"{BASE_URL}/{promos[1].id}?fields=state")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), {"state": "active"})
+        self.assertEqual(response.headers["ETag"], f'"{promos[1].id}-1"')
+
+    def test_sparse_fieldsets_bad_fields(self):
+        """It should reject unknown and empty field lists"""
+        for query in ["fields=id,color", "fields=version", "fields=", "fields=,"]:
+            response = self.client.get(f"{BASE_URL}?{query}")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+        response = self.client.get(f"{BASE_URL}/1?fields=color")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cache_control_until_next_boundary(self):
+        """It should not let a response be cached past the next start_date or end_date in it"""
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        promo = PromotionFactory(start_date=now - timedelta(days=1), end_date=now + timedelta(seconds=30))
+        promo_id = self.client.post(BASE_URL, json=promo.serialize()).get_json()["id"]
+        for url in [f"{BASE_URL}/{promo_id}", BASE_URL]:
+            max_age = int(self.client.get(url).headers["Cache-Control"].split("max-age=")[1])
+            self.assertLessEqual(max_age, 30)
+            self.assertGreater(max_age, 20)
+
 
 class TestSadPaths(TestCase):
     """Test REST Exception Handling"""
@@ -0,0 +1,235 @@
+######################################################################
+# Copyright 2016, 2024 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Test cases for the Shared Promotion Cache
+"""
+import os
+import struct
+import tempfile
+import time
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import patch
+
+from wsgi import app
+from service.common.cache import NOT_FOUND, promotion_cache, promotion_id_key
+from service.common.shared_cache import SLOT, WAYS, SharedCache, default_path, encode_key, encode_value
+from service.models import PromotionType
+from tests import test_cache
+
+
+def open_cache(path, **kwargs) -> SharedCache:
+    """Returns a SharedCache mapped from path"""
+    cache = SharedCache(path, **kwargs)
+    cache.open()
+    return cache
+
+
+######################################################################
+#  S H A R E D   C A C H E   T E S T   C A S E S
+######################################################################
+class TestSharedCache(TestCase):
+    """Test Cases for the Shared Cache"""
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.path = os.path.join(self.tempdir.name, "promotion-cache")
+        self.cache = open_cache(self.path)
+
+    def tearDown(self):
+        self.cache.close()
+        self.tempdir.cleanup()
+
+    def test_get_and_put(self):
+        """It should return cached values and None for misses"""
+        self.assertIsNone(self.cache.get(1))
+        self.cache.put(1, {"id": 1})
+        self.cache.put(promotion_id_key("SPRING"), NOT_FOUND)
+        self.assertEqual(self.cache.get(1), {"id": 1})
+        self.assertIs(self.cache.get(promotion_id_key("SPRING")), NOT_FOUND)
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["negative_hits"], stats["misses"]), (1, 1, 1))
+        self.assertEqual(stats["size"], 2)
+        self.assertEqual(encode_key(promotion_id_key("SPRING")), b"promotion_id:SPRING")
+
+    def test_shared_between_mappings(self):
+        """It should share entries and invalidations with every process that maps the file"""
+        other = open_cache(self.path)
+        self.cache.put(1, "one")
+        self.assertEqual(other.get(1), "one")
+        other.invalidate(1)
+        self.assertIsNone(self.cache.get(1))
+        other.put(2, "two")
+        self.cache.clear()
+        self.assertIsNone(other.get(2))
+        self.assertEqual(other.stats()["generation"], 2)
+        other.close()
+
+    def test_shared_with_forked_workers(self):
+        """It should serve a worker the entries another worker put"""
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            self.cache.put(7, {"id": 7})
+            os._exit(0)  # pylint: disable=protected-access
+        os.waitpid(pid, 0)
+        self.assertEqual(self.cache.get(7), {"id": 7})
+
+    def test_expires(self):
+        """It should expire entries after their ttl, misses after the negative ttl"""
+        cache = open_cache(self.path, ttl=60, negative_ttl=0.01)
+        cache.put(1, "one")
+        cache.put(2, NOT_FOUND)
+        time.sleep(0.02)
+        self.assertEqual(cache.get(1), "one")
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.stats()["expirations"], 1)
+        cache.close()
+
+    def test_evicts_oldest_in_bucket(self):
+        """It should replace the oldest entry of a full bucket"""
+        cache = open_cache(os.path.join(self.tempdir.name, "small"), maxsize=WAYS // 2)
+        self.assertEqual(cache.buckets, 1)
+        for key in range(WAYS + 1):
+            cache.put(key, key)
+        self.assertIsNone(cache.get(0))
+        self.assertEqual([cache.get(key) for key in range(1, WAYS + 1)], list(range(1, WAYS + 1)))
+        self.assertEqual(cache.stats()["evictions"], 1)
+        cache.put(WAYS, "last")
+        self.assertEqual(cache.stats()["size"], WAYS)
+        cache.close()
+
+    def test_drops_stale_fills(self):
+        """It should not cache a value read before the key was invalidated"""
+        self.assertIsNone(self.cache.get(1))
+        self.cache.invalidate(1)
+        self.cache.put(1, "stale")
+        self.assertIsNone(self.cache.get(1))
+        self.cache.put(1, "fresh")
+        self.assertEqual(self.cache.get(1), "fresh")
+        self.assertEqual(self.cache.stats()["stale_fills"], 1)
+
+    def test_oversized(self):
+        """It should not cache values that do not fit in a slot"""
+        self.cache.put(1, "x" * 2048)
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.stats()["oversized"], 1)
+
+    def test_torn_read(self):
+        """It should treat a slot that is being written as a miss"""
+        self.cache.put(1, "one")
+        # pylint: disable-next=protected-access
+        index = next(index for index in range(self.cache.buckets * WAYS) if self.cache._read(index)[0] == b"1")
+        offset = self.cache._offset(index)  # pylint: disable=protected-access
+        version = struct.unpack_from("<Q", self.cache._map, offset)[0]  # pylint: disable=protected-access
+        struct.pack_into("<Q", self.cache._map, offset, version + 1)  # pylint: disable=protected-access
+        self.assertIsNone(self.cache.get(1))
+        struct.pack_into("<Q", self.cache._map, offset, version + 2)  # pylint: disable=protected-access
+        self.assertEqual(self.cache.get(1), "one")
+        self.assertEqual(SLOT.size, 48)
+
+    def test_writer_died_mid_write(self):
+        """It should recover a slot whose writer died half way and treat bytes it cannot decode as a miss"""
+        self.cache.put(1, "one")
+        # pylint: disable-next=protected-access
+        index = next(index for index in range(self.cache.buckets * WAYS) if self.cache._read(index)[0] == b"1")
+        offset = self.cache._offset(index)  # pylint: disable=protected-access
+        version = struct.unpack_from("<Q", self.cache._map, offset)[0]  # pylint: disable=protected-access
+        struct.pack_into("<Q", self.cache._map, offset, version + 1)  # pylint: disable=protected-access
+        self.cache.put(1, "again")
+        self.assertEqual(self.cache.get(1), "again")
+        self.assertEqual(struct.unpack_from("<Q", self.cache._map, offset)[0] % 2, 0)  # pylint: disable=protected-access
+
+        start = offset + SLOT.size + 1
+        self.cache._map[start:start + 2] = b"\xff\xff"  # pylint: disable=protected-access
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_values_round_trip(self):
+        """It should store values as JSON and give back their datetimes and PromotionTypes"""
+        row = {"id": 1, "start_date": datetime(2025, 4, 1, 12), "promotion_type": PromotionType.COUPON, "amount": 1.5}
+        self.cache.put(1, row)
+        self.assertEqual(self.cache.get(1), row)
+        self.assertEqual(encode_value(7), b"7")
+        self.assertRaises(TypeError, self.cache.put, 2, object())
+
+    def test_refuses_unsafe_files(self):
+        """It should refuse a cache file that is a symlink or that another user could have written"""
+        link = os.path.join(self.tempdir.name, "link")
+        os.symlink(self.path, link)
+        self.assertRaises(PermissionError, open_cache, link)
+        readable = os.path.join(self.tempdir.name, "readable")
+        with open(readable, "wb"):
+            pass
+        os.chmod(readable, 0o644)
+        self.assertRaises(PermissionError, open_cache, readable)
+        with patch("os.getuid", return_value=os.getuid() + 1):
+            self.assertRaises(PermissionError, open_cache, self.path)
+        self.assertRaises(FileNotFoundError, open_cache, os.path.join(self.tempdir.name, "missing", "cache"))
+
+    def test_layout_change(self):
+        """It should reset the file when it was made for another size"""
+        self.cache.put(1, "one")
+        other = open_cache(self.path, maxsize=8)
+        self.assertIsNone(other.get(1))
+        self.assertEqual(os.path.getsize(self.path), other.size_bytes)
+        self.assertEqual(self.cache.get(1), "one")  # the old file stays mapped
+        other.close()
+        self.assertEqual(os.listdir(self.tempdir.name), ["promotion-cache"])
+
+    def test_default_path(self):
+        """It should keep the file in /dev/shm when there is one"""
+        self.assertEqual(os.path.basename(default_path()), "promotion-cache")
+        closed = SharedCache(self.path)
+        closed.clear()
+        self.assertEqual(closed.stats()["size"], 0)
+
+    def test_backends(self):
+        """It should switch the promotion cache between backends and reject unknown ones"""
+        app.config["PROMOTION_CACHE_BACKEND"] = "shared"
+        app.config["PROMOTION_CACHE_SHARED_PATH"] = self.path
+        app.config["PROMOTION_CACHE_ENABLED"] = True
+        try:
+            promotion_cache.init_app(app)
+            self.cache.put(3, "three")
+            self.assertEqual(promotion_cache.get(3), "three")
+            self.assertEqual(promotion_cache.stats()["backend"], "shared")
+            app.config["PROMOTION_CACHE_BACKEND"] = "redis"
+            with self.assertRaises(ValueError):
+                promotion_cache.init_app(app)
+        finally:
+            app.config["PROMOTION_CACHE_BACKEND"] = "memory"
+            app.config["PROMOTION_CACHE_ENABLED"] = False
+            promotion_cache.init_app(app)
+        self.assertEqual(promotion_cache.stats()["backend"], "memory")
+
+
+######################################################################
+#  C A C H E D   F I N D   O N   T H E   S H A R E D   C A C H E
+######################################################################
+class TestSharedCachedFind(test_cache.TestCachedFind):
+    """Runs the cached find test cases on the shared backend"""
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        app.config["PROMOTION_CACHE_BACKEND"] = "shared"
+        app.config["PROMOTION_CACHE_SHARED_PATH"] = os.path.join(self.tempdir.name, "promotion-cache")
+        super().setUp()
+
+    def tearDown(self):
+        app.config["PROMOTION_CACHE_BACKEND"] = "memory"
+        super().tearDown()
+        self.tempdir.cleanup()